@@ -1,26 +1,99 @@
+import copy
+import hashlib
 import json
+import logging
 import os
-from flask import Flask, request, jsonify, g
+import time
+from contextlib import ExitStack
+from flask import Flask, Response, request, jsonify, g, send_from_directory, stream_with_context
 from flask_cors import CORS
-from jsonschema import validate as validate_json_schema, exceptions
+from jsonschema import exceptions
 import psycopg2
 from psycopg2 import DatabaseError, ProgrammingError, InterfaceError, OperationalError
 from psycopg2.extensions import QueryCanceledError
+from psycopg2.pool import PoolError
 from lib.ctes.construct_search_area import (
     AreaInvalidError,
 )
 from lib.utils import (
     get_spots,
+    decode_geometries,
     set_area,
     results_to_geojson,
     check_area_surface,
-    validate_spot_query,
     clean_spot_query,
+    hash_spot_query,
+)
+from lib.database import (
+    configure_connection_pool,
+    ensure_connection_pool,
+    warm_up_connection_pool,
+    get_db,
+    close_db,
+    apply_statement_timeout,
 )
-from lib.database import initialize_connection_pool, get_db, close_db
 import lib.constructor as constructor
-from collections import Counter
+from lib.coalesce import single_flight
+from lib.cancellation import (
+    QueryAbortedError,
+    cancel_backends,
+    cancel_request,
+    cancellable,
+    register_request,
+    request_id_from,
+    unregister_request,
+)
+from lib.recorder import query_log_path, record_query
+from lib.slowlog import log_slow_query, slow_query_threshold
+from lib.profiling import RequestProfile, parse_profile_modes, profile_dir, profiling_enabled
+from lib import metrics
+from lib.admission import (
+    QueryDeadlineExceededError,
+    QueryQueueTimeoutError,
+    QueryRejectedError,
+    QueryTooLargeError,
+    admit_query,
+    construct_count_query,
+    heavy_query_slot,
+    remaining_timeout,
+)
+from lib.filters import spot_query_is_empty
+from lib.validation import compile_spot_query_schema, validate_spot_query_request
+from lib.batch import (
+    BATCH_MAX_SIZE,
+    area_key,
+    batch_deadline,
+    run_batch,
+)
+from lib.executors import (
+    choose_executor,
+    execute_hybrid,
+    execute_prefetch,
+    execute_sql,
+    python_cluster_tables,
+)
+from lib.tiles import (
+    TileInvalidError,
+    TileQueryNotFoundError,
+    construct_tile_query,
+    load_tile_query,
+    register_tile_query,
+    restrict_area_to_tile,
+    tile_cache,
+)
+from lib.serializer import JSONFragment, dumps
 from lib.timer import Timer
+from lib.cache import LRUCache
+from lib.compression import (
+    COMPRESS_MIN_SIZE,
+    cache_response,
+    complete_response,
+    encode_head,
+    encode_response,
+    encoded_response,
+    get_cached_response,
+    serialize_payload,
+)
 from flask_compress import Compress
 from dotenv import load_dotenv
 import jwt
@@ -57,8 +130,17 @@ check_env_vars()
 
 environment = os.getenv("ENVIRONMENT") or "production"
 
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+)
+logger = logging.getLogger(__name__)
+
 compress = Compress()
 app = Flask(__name__)
+app.config["COMPRESS_MIN_SIZE"] = COMPRESS_MIN_SIZE
+# Same encodings as `lib.compression`, so that identity bodies it sends are not compressed here
+app.config["COMPRESS_ALGORITHM"] = ["br", "gzip"]
 compress.init_app(app)
 CORS(app)
 
@@ -73,15 +155,29 @@ DATABASE = {
 JWT_SECRET = os.getenv("JWT_SECRET")
 AUTH_ENABLED = os.getenv("AUTH_ENABLED", "false").lower() in ["true", "1", "yes"]
 
+# Verified token payloads keyed by token digest, never kept past their `exp`
+JWT_CACHE_TTL = int(os.getenv("JWT_CACHE_TTL", 300))
+jwt_cache = LRUCache(maxsize=int(os.getenv("JWT_CACHE_SIZE", 1024)), ttl=JWT_CACHE_TTL)
+
 with open("./schemas/spot_query.json", "r") as file:
     schema = json.load(file)
 
-@app.before_first_request
-def setup():
+# Compiled once; see `lib.validation`
+schema_validator = compile_spot_query_schema(schema)
+
+# Connections are opened per worker (see `init_worker`), never before forking
+configure_connection_pool(DATABASE)
+
+def init_worker():
     """
-    Initialize the database connection pool before the first request.
+    Create and warm up the database connection pool of a worker process.
+
+    Called by gunicorn's `post_worker_init` hook (see `gunicorn.conf.py`), so that the
+    first request of a worker does not pay for opening connections. Without
+    it, the pool is created on the first request.
     """
-    initialize_connection_pool(DATABASE)
+    ensure_connection_pool()
+    warm_up_connection_pool(os.getenv("TABLE_VIEW"))
 
 @app.teardown_appcontext
 def teardown(e=None):
@@ -97,6 +193,10 @@ def validate_jwt(token):
     """
     Validate a JWT using the configured secret and HS256 algorithm.
 
+    Successfully verified tokens are cached under their SHA-256 digest for at
+    most `JWT_CACHE_TTL` seconds and never beyond their `exp` claim, so repeated
+    requests with the same token skip the signature verification.
+
     Args:
         token (str): The bearer token string (without the 'Bearer ' prefix).
 
@@ -106,12 +206,68 @@ def validate_jwt(token):
     Raises:
         ValueError: If the token is invalid or expired.
     """
+    digest = hashlib.sha256(token.encode()).digest()
+    payload = jwt_cache.get(digest)
+    if payload is not None:
+        metrics.increment("auth_cache_hits")
+        return payload
+
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-        return payload
     except InvalidTokenError as e:
         raise ValueError(f"Invalid token: {str(e)}")
 
+    ttl = JWT_CACHE_TTL
+    if isinstance(payload.get("exp"), (int, float)):
+        ttl = min(ttl, payload["exp"] - time.time())
+    if ttl > 0:
+        jwt_cache.set(digest, payload, ttl=ttl)
+
+    return payload
+
+@app.before_request
+def start_timer():
+    """
+    Start the request timer (`g.timer`) used for the `timing` checkpoints.
+    """
+    g.timer = Timer()
+
+@app.before_request
+def start_request():
+    """
+    Assign the request id (`X-Request-ID`) and register the request for
+    cancellation (see `lib.cancellation`).
+    """
+    g.inflight = register_request(request_id_from(request.headers.get("X-Request-ID")), request.environ)
+
+@app.after_request
+def add_request_id(response):
+    """
+    Return the request id in the `X-Request-ID` header.
+
+    Args:
+        response (flask.Response): The outgoing response.
+
+    Returns:
+        flask.Response: The response with the header.
+    """
+    if "inflight" in g:
+        response.headers["X-Request-ID"] = g.inflight.request_id
+    return response
+
+@app.teardown_request
+def finish_request(e=None):
+    """
+    Remove the request from the cancellation registry, before its connection
+    goes back to the pool.
+
+    Args:
+        e (Exception | None): Optional teardown exception provided by Flask.
+    """
+    inflight = g.pop("inflight", None)
+    if inflight is not None:
+        unregister_request(inflight)
+
 @app.before_request
 def check_jwt():
     """
@@ -136,6 +292,141 @@ def check_jwt():
         except ValueError as e:
             return jsonify({"status": "error", "message": str(e)}), 401
 
+        g.timer.add_checkpoint("authentication")
+
+@app.before_request
+def start_profiling():
+    """
+    Start profiling the request when it carries an `X-Profile` header and
+    profiling is enabled (`PROFILING_ENABLED`, see `lib.profiling`).
+    """
+    if not profiling_enabled():
+        return
+
+    modes = parse_profile_modes(request.headers.get("X-Profile"))
+    if modes:
+        g.timer.track_cpu = "cpu" in modes
+        g.profile = RequestProfile(modes)
+        g.profile.start()
+
+@app.after_request
+def stop_profiling(response):
+    """
+    Stop the request profile and announce its artifacts in the response headers.
+
+    Args:
+        response (flask.Response): The outgoing response.
+
+    Returns:
+        flask.Response: The response with the profile headers.
+    """
+    profile = g.pop("profile", None)
+    if profile is not None:
+        headers = profile.stop()
+        if "Server-Timing" in headers and "Server-Timing" in response.headers:
+            headers["Server-Timing"] = f"{response.headers['Server-Timing']}, {headers['Server-Timing']}"
+        response.headers.update(headers)
+    return response
+
+@app.teardown_request
+def discard_profiling(e=None):
+    """
+    Stop a request profile left running by an aborted request.
+
+    Args:
+        e (Exception | None): Optional teardown exception provided by Flask.
+    """
+    profile = g.pop("profile", None)
+    if profile is not None:
+        profile.stop(write=False)
+
+@app.after_request
+def record_spot_query(response):
+    """
+    Append the spot query served by this request to the query log, if enabled
+    (`QUERY_LOG_PATH`, see `lib.recorder`).
+
+    Args:
+        response (flask.Response): The outgoing response.
+
+    Returns:
+        flask.Response: The response, unchanged.
+    """
+    record = g.pop("query_record", None)
+    if record is None:
+        return response
+
+    error = response.get_json(silent=True) if response.status_code != 200 else None
+    record_query(
+        {
+            **record,
+            "status": response.status_code,
+            **({"errorType": error.get("errorType")} if error else {}),
+            **({"rows": g.result_size} if "result_size" in g else {}),
+            "timing": dict(g.timer.get_all_checkpoints()),
+            "cache": response.headers.get("X-Cache"),
+            "coalesced": response.headers.get("X-Coalesced"),
+        }
+    )
+    return response
+
+@app.after_request
+def log_slow_spot_query(response):
+    """
+    Log the spot query served by this request if it took longer than
+    `SLOW_QUERY_MS` (see `lib.slowlog`).
+
+    Args:
+        response (flask.Response): The outgoing response.
+
+    Returns:
+        flask.Response: The response, unchanged.
+    """
+    slow_query = g.pop("slow_query", None)
+    if slow_query is None:
+        return response
+
+    elapsed = g.timer.elapsed()
+    if elapsed < slow_query_threshold():
+        return response
+
+    metrics.increment("slow_queries")
+    query = slow_query.pop("sql", None)
+    log_slow_query(
+        {
+            "requestId": g.inflight.request_id if "inflight" in g else None,
+            "path": request.path,
+            "status": response.status_code,
+            "elapsed": elapsed,
+            **slow_query,
+            **({"rows": g.result_size} if "result_size" in g else {}),
+            "timing": dict(g.timer.get_all_checkpoints()),
+            "cache": response.headers.get("X-Cache"),
+            "coalesced": response.headers.get("X-Coalesced"),
+        },
+        g.get("db"),
+        query,
+    )
+    return response
+
+@app.errorhandler(QueryQueueTimeoutError)
+@app.errorhandler(PoolError)
+def server_busy(e):
+    """
+    Answer 503 when no database connection can be taken for the request.
+
+    Routes that run spot queries handle `QueryQueueTimeoutError` themselves
+    (with their timings); this covers `get_db` in the other routes and an
+    exhausted pool.
+
+    Args:
+        e (Exception): `QueryQueueTimeoutError` or `psycopg2.pool.PoolError`.
+
+    Returns:
+        (flask.Response, int, dict): 503 serverBusy with a `Retry-After` header.
+    """
+    return jsonify({"status": "error", "errorType": "serverBusy", "message": str(e)}), 503, {"Retry-After": "1"}
+
 @app.route("/validate-spot-query", methods=["POST"])
 def validate_spot_query_route():
     """
@@ -152,8 +443,7 @@ def validate_spot_query_route():
     data = request.json
 
     try:
-        validate_json_schema(data, schema)
-        validate_spot_query(data)
+        validate_spot_query_request(data, schema_validator)
 
         return jsonify({"status": "success"}), 200
     except (exceptions.ValidationError, ValueError) as e:
@@ -174,7 +464,8 @@ def get_spot_query_route():
         2) Clean the spot query.
         3) Set/derive the search area in Flask `g`.
         4) Construct the SQL using `constructor.construct_query_from_graph`.
-        5) Return the SQL string (cursor.as_string).
+        5) Return the SQL string (cursor.as_string). With `CLUSTER_STRATEGY=python`,
+           cluster nodes read a table that only exists while the query runs.
 
     Returns:
         str | flask.Response: SQL query string on success; JSON error response otherwise.
@@ -189,10 +480,9 @@ def get_spot_query_route():
     cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
     try:
-        validate_json_schema(data, schema)
-        validate_spot_query(data)
+        validate_spot_query_request(data, schema_validator)
     except (exceptions.ValidationError, ValueError) as e:
-        print(e)
+        logger.debug("Invalid spot query: %s", e)
         return jsonify({"error": str(e)}), 400
 
     try:
@@ -228,6 +518,132 @@ def get_spot_query_route():
 
         return jsonify(response), 500
 
+def build_spot_query_payload(cleaned_spot_query, db, timer, executor=None, area_checked=False, timeout=None):
+    """
+    Run a cleaned spot query and build the `/run-spot-query` response payload.
+
+    Args:
+        cleaned_spot_query (dict): Output of `clean_spot_query`.
+        db (psycopg2.extensions.connection): Request connection.
+        timer (Timer): Request timer.
+        executor (str | None): Requested executor (see `lib.executors`).
+        area_checked (bool): Whether `g.area` / `g.utm` are already set and the
+            area surface was checked (batch items sharing an area).
+        timeout (int | None): Statement timeout in milliseconds (defaults to
+            `TIMEOUT`). When given (batch items), it is also a deadline: waiting
+            for an admission slot counts against it and never outlasts it.
+
+    Returns:
+        dict: The response payload (without timings).
+
+    Raises:
+        AreaInvalidError, QueryRejectedError, QueryTooLargeError,
+        QueryQueueTimeoutError, QueryDeadlineExceededError, QueryCanceledError,
+        ValueError, psycopg2 errors:
+            Handled by the calling route.
+    """
+    deadline = time.monotonic() + timeout / 1000 if timeout is not None else None
+
+    if not area_checked:
+        with timer.stage("set_area"):
+            set_area(cleaned_spot_query)
+        timer.add_checkpoint("area_setting")
+        with timer.stage("area_check"):
+            check_area_surface(g.db)
+
+    # Contradictory filters: answer without running the query, once the area is known to be valid
+    if spot_query_is_empty(cleaned_spot_query):
+        timer.add_checkpoint("filter_normalization")
+        return {
+            "results": {"type": "FeatureCollection", "features": []},
+            "sets": {"distinct_sets": [], "stats": {}},
+            "spots": [],
+            "status": "success",
+        }
+
+    with timer.stage("construct"):
+        query = constructor.construct_query_from_graph(cleaned_spot_query)
+
+    timer.add_checkpoint("query_construction")
+    if "slow_query" in g:
+        g.slow_query["sql"] = query
+
+    apply_statement_timeout(db, timeout)
+
+    with ExitStack() as stack:
+        # Clusters computed in-process are loaded once, before anything reads them
+        stack.enter_context(python_cluster_tables(db, cleaned_spot_query))
+
+        decision, estimate = admit_query(db, query)
+        timer.add_checkpoint("admission")
+
+        if decision == "tiles":
+            raise QueryTooLargeError(
+                "Estimated query size exceeds the configured budget, use the tiles instead",
+                estimate,
+                register_tile_query(cleaned_spot_query),
+            )
+
+        if decision == "queue":
+            stack.enter_context(heavy_query_slot(deadline))
+            timer.add_checkpoint("admission_queue")
+            if deadline is not None:
+                # What is left after queueing
+                timeout = remaining_timeout(deadline)
+                apply_statement_timeout(db, timeout)
+
+        if decision == "count":
+            columns, rows = execute_sql(db, construct_count_query(query))
+            timer.add_checkpoint("query_execution")
+
+            return {
+                "results": {"type": "FeatureCollection", "features": []},
+                "sets": {"distinct_sets": [row[0] for row in rows], "stats": dict(rows)},
+                "spots": [],
+                "downgraded": "count",
+                "estimate": estimate,
+                "status": "success",
+            }
+
+        executor = choose_executor(db, cleaned_spot_query, executor)
+        if "slow_query" in g:
+            g.slow_query["executor"] = executor
+
+        with timer.stage("execute"):
+            if executor == "hybrid":
+                columns, rows = execute_hybrid(db, cleaned_spot_query)
+            elif executor == "prefetch":
+                columns, rows = execute_prefetch(
+                    db, cleaned_spot_query, remaining_timeout(deadline) if deadline is not None else None
+                )
+            else:
+                columns, rows = execute_sql(db, query)
+        timer.add_checkpoint("query_execution")
+
+    with timer.stage("geojson"):
+        geometries = decode_geometries(rows, columns)
+        geojson, set_name_counts = results_to_geojson(rows, columns, geometries)
+        spots = get_spots(rows, columns, geometries)
+    del rows, geometries
+    timer.add_checkpoint("results_transformation_to_geojson")
+
+    distinct_set_names = list(set_name_counts)
+    area_value = getattr(g, "area", None)
+
+    return {
+        "results": geojson,
+        **(
+            {"query": query.as_string(db), "executor": executor}
+            if environment == "development"
+            else {}
+        ),
+        **({"area": area_value} if area_value is not None else {}),
+        "sets": {"distinct_sets": distinct_set_names, "stats": set_name_counts},
+        "spots": spots,
+        "status": "success",
+    }
+
+
 @app.route("/run-spot-query", methods=["POST"])
 def run_spot_query_route():
     """
@@ -235,10 +651,28 @@ def run_spot_query_route():
 
     Process:
         1) Validate input JSON (schema + custom checks).
-        2) Clean query, set area, and verify area surface (via `check_area_surface`).
-        3) Construct the SQL query from the graph.
-        4) Apply statement timeout from TIMEOUT env var and execute the query.
+        2) Clean query (including filter normalization), set area, and verify area
+           surface (via `check_area_surface`). Queries whose filters can never
+           match are then answered with an empty result without running the query.
+        3) Construct the SQL query from the graph and check its planner estimates
+           against the admission budgets (see `lib.admission`); over-budget
+           queries are rejected, counted only, redirected to tiles or queued.
+        4) Apply statement timeout from TIMEOUT env var and execute the query
+           on a connection taken within the worker's connection budget (cache
+           hits and coalesced requests take none), either in PostgreSQL, with the
+           relations evaluated in-process or with the node filters prefetched
+           concurrently (`?executor=sql|hybrid|prefetch|auto`, see `lib.executors`).
         5) Transform rows to GeoJSON; compute set stats; include timing checkpoints.
+        6) Serialize and compress the response (see `lib.compression`) and cache
+           the serialized payload; identical queries are then served from the
+           per-worker cache (for `RESULT_CACHE_TTL` seconds, not invalidated by
+           data imports) without compressing them again, with their own
+           timings in `timing` (also sent as `Server-Timing`).
+           Identical queries arriving while one is running wait for it and
+           share its result (see `lib.coalesce`, `X-Coalesced` header).
+        7) The queries stop when the client disconnects or the request is
+           canceled with `/cancel/<request_id>` (`X-Request-ID` header, see
+           `lib.cancellation`).
 
     Returns:
         (flask.Response, int): 200 with payload:
@@ -247,22 +681,28 @@ def run_spot_query_route():
               "query": <SQL string> (only in development),
               "area": <area value> (if available),
               "sets": {"distinct_sets": [...], "stats": {...}},
+              "spots": [{"bbox": [...], "id": ..., "tags": {...}, "nodes": [...]}, ...],
               "timing": [...],
               "status": "success"
             }
         Error responses:
             422 areaInvalid,
             408 queryTimeout (QueryCanceledError),
+            499 queryCanceled (client disconnected or request canceled),
+            413 queryTooExpensive (rejected) / queryTooLarge (with a tile URL),
+            503 serverBusy (no free connection slot, pool exhausted),
             400 valueError,
             500 database exceptions.
     """
-    timer = Timer()
+    timer = g.timer
     data = request.json
-    db = get_db()
+    if query_log_path() is not None:
+        # Copied, since cleaning modifies the query in place
+        g.query_record = {"query": copy.deepcopy(data)}
 
     try:
-        validate_json_schema(data, schema)
-        validate_spot_query(data)
+        with timer.stage("validation"):
+            validate_spot_query_request(data, schema_validator)
 
     except (exceptions.ValidationError, ValueError) as e:
         return (
@@ -273,59 +713,109 @@ def run_spot_query_route():
         )
 
     try:
-        cleaned_spot_query = clean_spot_query(data)
-        set_area(cleaned_spot_query)
-        timer.add_checkpoint("area_setting")
-        check_area_surface(g.db)
+        with timer.stage("clean"):
+            cleaned_spot_query = clean_spot_query(data)
+        query_hash = hash_spot_query(cleaned_spot_query)
+        if "query_record" in g:
+            g.query_record.update(
+                {"queryHash": query_hash, "cleaned": cleaned_spot_query, "area": cleaned_spot_query.get("area")}
+            )
+        if slow_query_threshold() is not None:
+            g.slow_query = {"queryHash": query_hash, "cleaned": cleaned_spot_query}
 
-        query = constructor.construct_query_from_graph(cleaned_spot_query)
+        metrics.increment("spot_queries")
 
-        timer.add_checkpoint("query_construction")
+        cached = get_cached_response(query_hash, request.accept_encodings, timer)
+        if cached is not None:
+            metrics.increment("result_cache_hits")
+            body = complete_response(cached, timer)
+            return encoded_response(body, cached.encoding, cache_status="hit", timing=timer.get_all_checkpoints())
 
-        cursor = db.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        timeout = int(os.getenv("TIMEOUT", 20000))
-        cursor.execute("SET statement_timeout = %s", (timeout,))
-        db.commit()
-        cursor.execute(query)
-        timer.add_checkpoint("query_execution")
+        def compute_body():
+            # Only the request running the query takes a connection
+            db = get_db()
+            with cancellable(db):
+                payload = build_spot_query_payload(cleaned_spot_query, db, timer, request.args.get("executor"))
+            g.result_size = {
+                "features": len(payload["results"]["features"]),
+                "spots": len(payload["spots"]),
+                "sets": payload["sets"]["stats"],
+            }
+            body = serialize_payload(payload)
+            timer.add_checkpoint("serialize")
+            return body
 
-        # Fetch all results as a list of dictionaries
-        results = [dict(record) for record in cursor]
+        # Identical concurrent queries share one execution (see `lib.coalesce`)
+        body, shared = single_flight(query_hash, compute_body)
+        if shared is not None:
+            timer.add_checkpoint("coalesced_wait")
 
-        # spots = get_spots(results)
-        geojson = results_to_geojson(results)
-        timer.add_checkpoint("results_transformation_to_geojson")
+        encoded = encode_head(body, request.accept_encodings, timer)
+        cache_response(query_hash, body, encoded)
 
-        distinct_set_names = list({result["set_name"] for result in results})
-        set_name_counts = dict(Counter(result["set_name"] for result in results))
-        area_value = getattr(g, "area", None)
+        response = encoded_response(complete_response(encoded, timer), encoded.encoding, cache_status="miss")
+        if shared is not None:
+            response.headers["X-Coalesced"] = shared
+        return response
 
+    except AreaInvalidError as e:
+        timer.add_checkpoint("error")
         response = {
-            "results": geojson,
-            **(
-                {"query": query.as_string(cursor)}
-                if environment == "development"
-                else {}
-            ),
-            **({"area": area_value} if area_value is not None else {}),
-            "sets": {"distinct_sets": distinct_set_names, "stats": set_name_counts},
-            # "spots": spots,
+            "status": "error",
+            "errorType": "areaInvalid",
+            "message": str(e),
             "timing": timer.get_all_checkpoints(),
-            "status": "success",
         }
 
-        return jsonify(response), 200
+        return jsonify(response), 422
 
-    except AreaInvalidError as e:
+    except QueryTooLargeError as e:
         timer.add_checkpoint("error")
         response = {
             "status": "error",
-            "errorType": "areaInvalid",
+            "errorType": "queryTooLarge",
             "message": str(e),
+            "estimate": e.estimate,
+            "queryHash": e.query_hash,
+            "tiles": f"/tiles/{e.query_hash}/{{z}}/{{x}}/{{y}}.mvt",
             "timing": timer.get_all_checkpoints(),
         }
 
-        return jsonify(response), 422
+        return jsonify(response), 413
+
+    except QueryRejectedError as e:
+        timer.add_checkpoint("error")
+        response = {
+            "status": "error",
+            "errorType": "queryTooExpensive",
+            "message": str(e),
+            "estimate": e.estimate,
+            "timing": timer.get_all_checkpoints(),
+        }
+
+        return jsonify(response), 413
+
+    except QueryQueueTimeoutError as e:
+        timer.add_checkpoint("error")
+        response = {
+            "status": "error",
+            "errorType": "serverBusy",
+            "message": str(e),
+            "timing": timer.get_all_checkpoints(),
+        }
+
+        return jsonify(response), 503, {"Retry-After": "1"}
+
+    except QueryAbortedError as e:
+        timer.add_checkpoint("canceled")
+        response = {
+            "status": "error",
+            "errorType": "queryCanceled",
+            "message": str(e),
+            "timing": timer.get_all_checkpoints(),
+        }
+
+        return jsonify(response), 499
 
     except QueryCanceledError:
         timer.add_checkpoint("timeout")
@@ -358,5 +848,430 @@ def run_spot_query_route():
 
         return jsonify(response), 500
 
+def spot_query_error(e):
+    """
+    Map an exception raised while running a spot query to an error payload.
+
+    Mirrors the error responses of `/run-spot-query`; used for the items of
+    `/run-spot-query/batch`.
+
+    Args:
+        e (Exception): The exception.
+
+    Returns:
+        tuple[dict, int]: The error payload and its HTTP status code.
+
+    Raises:
+        Exception: `e` itself if it is not an expected spot query error.
+    """
+    if isinstance(e, AreaInvalidError):
+        return {"status": "error", "errorType": "areaInvalid", "message": str(e)}, 422
+    if isinstance(e, QueryTooLargeError):
+        return {
+            "status": "error",
+            "errorType": "queryTooLarge",
+            "message": str(e),
+            "estimate": e.estimate,
+            "queryHash": e.query_hash,
+            "tiles": f"/tiles/{e.query_hash}/{{z}}/{{x}}/{{y}}.mvt",
+        }, 413
+    if isinstance(e, QueryRejectedError):
+        return {"status": "error", "errorType": "queryTooExpensive", "message": str(e), "estimate": e.estimate}, 413
+    if isinstance(e, QueryQueueTimeoutError):
+        return {"status": "error", "errorType": "serverBusy", "message": str(e)}, 503
+    if isinstance(e, QueryDeadlineExceededError):
+        return {"status": "error", "errorType": "deadlineExceeded", "message": str(e)}, 408
+    if isinstance(e, QueryAbortedError):
+        return {"status": "error", "errorType": "queryCanceled", "message": str(e)}, 499
+    if isinstance(e, QueryCanceledError):
+        return {"status": "error", "errorType": "queryTimeout"}, 408
+    if isinstance(e, ValueError):
+        return {"status": "error", "errorType": "valueError", "message": str(e)}, 400
+    if isinstance(e, (InterfaceError, ProgrammingError, DatabaseError, OperationalError)):
+        return {"status": "error", "errorType": str(e)}, 500
+    raise e
+
+
+@app.route("/run-spot-query/batch", methods=["POST"])
+def run_spot_query_batch_route():
+    """
+    Execute several spot queries in one request.
+
+    Expects:
+        JSON body `{"queries": [<spot query>, ...], "deadline": <ms, optional>}`
+        or a plain list of spot queries (at most `BATCH_MAX_SIZE`).
+
+    Process:
+        1) Validate all queries; invalid ones become error items, the others run.
+        2) Set the area and check its surface once per distinct area.
+        3) Run the queries concurrently on the request connection plus pooled
+           connections (see `lib.batch`), within one deadline (`deadline`,
+           capped by `BATCH_TIMEOUT`); queries that cannot start in time,
+           e.g. while queued for an admission slot, fail with
+           `deadlineExceeded`. Each query is built like `/run-spot-query`
+           (admission, executors, coalescing with identical queries).
+        4) Return all items at once, or with `?stream=1` as newline-delimited
+           JSON, one line per item as it finishes and a final summary line.
+
+    Returns:
+        (flask.Response, int): 200 with payload:
+            {
+              "results": [
+                {"index": 0, "status": 200, "queryHash": ..., "response": <`/run-spot-query` payload>, "timing": {...}},
+                {"index": 1, "status": 422, "response": {"status": "error", "errorType": "areaInvalid", ...}, "timing": {...}},
+                ...
+              ],
+              "timing": {...},
+              "status": "success"
+            }
+        Error responses:
+            400 batchInvalid (not a list of queries, empty or too many queries,
+            or a deadline that is not a positive number).
+    """
+    timer = g.timer
+    data = request.json
+    queries = data.get("queries") if isinstance(data, dict) else data
+
+    if not isinstance(queries, list) or not 0 < len(queries) <= BATCH_MAX_SIZE:
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "errorType": "batchInvalid",
+                    "message": f"Expected a list of 1 to {BATCH_MAX_SIZE} spot queries",
+                }
+            ),
+            400,
+        )
+
+    try:
+        deadline = batch_deadline(data.get("deadline") if isinstance(data, dict) else None)
+    except ValueError as e:
+        return jsonify({"status": "error", "errorType": "batchInvalid", "message": str(e)}), 400
+    executor = request.args.get("executor")
+    db = get_db()
+
+    errors = {}
+    cleaned = {}
+    for index, spot_query in enumerate(queries):
+        try:
+            validate_spot_query_request(spot_query, schema_validator)
+            cleaned[index] = clean_spot_query(spot_query)
+        except (exceptions.ValidationError, ValueError) as e:
+            errors[index] = ({"status": "error", "errorType": "spot_queryInvalid", "message": str(e)}, 400)
+    timer.add_checkpoint("validation")
+
+    # Equal areas are parsed and checked only once
+    areas = {}
+    for index, spot_query in cleaned.items():
+        key = area_key(spot_query)
+        if key not in areas:
+            try:
+                g.area = {}
+                set_area(spot_query)
+                check_area_surface(db)
+                areas[key] = (g.area, g.utm)
+            except (AreaInvalidError, ValueError, InterfaceError, ProgrammingError, DatabaseError, OperationalError) as e:
+                db.rollback()
+                areas[key] = e
+        if isinstance(areas[key], Exception):
+            errors[index] = spot_query_error(areas[key])
+    timer.add_checkpoint("area_setting")
+
+    inflight = g.inflight
+
+    def make_task(spot_query, query_hash, area):
+        def task(timeout):
+            item_timer = g.timer = Timer()
+            g.area, g.utm = dict(area[0]), area[1]
+            # Items are canceled with the batch request
+            g.inflight = inflight
+
+            def compute_body():
+                with cancellable(g.db):
+                    payload = build_spot_query_payload(
+                        spot_query, g.db, item_timer, executor, area_checked=True, timeout=timeout
+                    )
+                body = serialize_payload(payload)
+                item_timer.add_checkpoint("serialize")
+                return body
+
+            body, shared = single_flight(query_hash, compute_body)
+            if shared is not None:
+                item_timer.add_checkpoint("coalesced_wait")
+            return body, item_timer.get_all_checkpoints()
+
+        return task
+
+    tasks = {}
+    hashes = {}
+    for index, spot_query in cleaned.items():
+        if index not in errors:
+            hashes[index] = hash_spot_query(spot_query)
+            tasks[index] = make_task(spot_query, hashes[index], areas[area_key(spot_query)])
+
+    metrics.increment("spot_queries", len(tasks))
+    metrics.increment("batches")
+
+    def items():
+        for index, (payload, status) in errors.items():
+            yield {"index": index, "status": status, "response": payload}
+
+        for index, future in run_batch(app, db, tasks, deadline):
+            try:
+                body, timing = future.result()
+                yield {
+                    "index": index,
+                    "status": 200,
+                    "queryHash": hashes[index],
+                    "response": JSONFragment(body),
+                    "timing": timing,
+                }
+            except Exception as e:
+                payload, status = spot_query_error(e)
+                yield {"index": index, "status": status, "response": payload}
+
+    if request.args.get("stream") in ["1", "true"]:
+        def stream():
+            for item in items():
+                yield dumps(item) + b"\n"
+            timer.add_checkpoint("batch_execution")
+            yield dumps({"status": "success", "timing": timer.get_all_checkpoints()}) + b"\n"
+
+        return Response(stream_with_context(stream()), status=200, mimetype="application/x-ndjson")
+
+    results = sorted(items(), key=lambda item: item["index"])
+    timer.add_checkpoint("batch_execution")
+
+    body, encoding = encode_response({"results": results, "status": "success"}, request.accept_encodings, timer)
+    return encoded_response(body, encoding)
+
+@app.route("/cancel/<request_id>", methods=["POST"])
+def cancel_route(request_id):
+    """
+    Cancel the running queries of a request, given its `X-Request-ID`.
+
+    The request is looked up in this worker first; otherwise, the database
+    backends tagged with its id are canceled (see `lib.cancellation`). The
+    canceled request answers with 499 `queryCanceled`.
+
+    Returns:
+        (flask.Response, int): 200 with {"status": "success", "scope": "worker" | "database"};
+        404 with {"status": "error", "errorType": "requestNotFound"} when no
+        running request has this id.
+    """
+    metrics.increment("cancel_requests")
+
+    if cancel_request(request_id):
+        metrics.increment("queries_canceled_by_request")
+        return jsonify({"status": "success", "scope": "worker"}), 200
+
+    try:
+        signaled = cancel_backends(get_db(), request_id)
+    except (InterfaceError, ProgrammingError, DatabaseError, OperationalError) as e:
+        return jsonify({"status": "error", "errorType": str(e)}), 500
+
+    if signaled:
+        metrics.increment("queries_canceled_by_request")
+        return jsonify({"status": "success", "scope": "database"}), 200
+
+    return (
+        jsonify(
+            {"status": "error", "errorType": "requestNotFound", "message": f"No running request {request_id}"}
+        ),
+        404,
+    )
+
+@app.route("/profiles/<name>", methods=["GET"])
+def profile_artifact_route(name):
+    """
+    Download a profiling artifact announced in `X-Profile-Artifacts`.
+
+    Returns:
+        flask.Response: The artifact as an attachment.
+        Error responses:
+            404 when profiling is disabled or the artifact does not exist.
+    """
+    if not profiling_enabled():
+        return jsonify({"status": "error", "errorType": "profilingDisabled"}), 404
+
+    return send_from_directory(profile_dir(), name, as_attachment=True)
+
+@app.route("/metrics", methods=["GET"])
+def metrics_route():
+    """
+    Report the counters of the worker handling the request (see `lib.metrics`).
+
+    Returns:
+        (flask.Response, int): 200 with payload
+            {"pid": ..., "uptime": <seconds>, "counters": {...}, "status": "success"}
+    """
+    return jsonify({**metrics.snapshot(), "status": "success"}), 200
+
+
+@app.route("/tiles", methods=["POST"])
+def register_tiles_route():
+    """
+    Register a spot query for vector tile rendering.
+
+    Process:
+        1) Validate input JSON (schema + custom checks).
+        2) Clean query, set area, and verify area surface (via `check_area_surface`).
+        3) Store the cleaned query under its hash (see `lib.tiles.register_tile_query`).
+
+    Returns:
+        (flask.Response, int): 200 with payload:
+            {
+              "queryHash": <hash of the cleaned query>,
+              "tiles": "/tiles/<hash>/{z}/{x}/{y}.mvt",
+              "status": "success"
+            }
+        Error responses:
+            400 spot_queryInvalid / valueError,
+            422 areaInvalid,
+            500 database exceptions.
+    """
+    data = request.json
+    db = get_db()
+
+    try:
+        validate_spot_query_request(data, schema_validator)
+    except (exceptions.ValidationError, ValueError) as e:
+        return (
+            jsonify(
+                {"status": "error", "errorType": "spot_queryInvalid", "message": str(e)}
+            ),
+            400,
+        )
+
+    try:
+        cleaned_spot_query = clean_spot_query(data)
+        set_area(cleaned_spot_query)
+        check_area_surface(db)
+
+        query_hash = register_tile_query(cleaned_spot_query)
+
+        response = {
+            "queryHash": query_hash,
+            "tiles": f"/tiles/{query_hash}/{{z}}/{{x}}/{{y}}.mvt",
+            "status": "success",
+        }
+
+        return jsonify(response), 200
+
+    except AreaInvalidError as e:
+        response = {
+            "status": "error",
+            "errorType": "areaInvalid",
+            "message": str(e),
+        }
+
+        return jsonify(response), 422
+
+    except ValueError as e:
+        response = {
+            "status": "error",
+            "errorType": "valueError",
+            "message": str(e),
+        }
+
+        return jsonify(response), 400
+
+    except (InterfaceError, ProgrammingError, DatabaseError, OperationalError) as e:
+        response = {
+            "status": "error",
+            "errorType": str(e),
+        }
+
+        return jsonify(response), 500
+
+@app.route("/tiles/<query_hash>/<int:z>/<int:x>/<int:y>.mvt", methods=["GET"])
+def tile_route(query_hash, z, x, y):
+    """
+    Render one Mapbox Vector Tile of a registered spot query.
+
+    Only the part of the query area covered by the tile (widened by the largest
+    distance relation) is searched. Rendered tiles are cached per worker, so
+    panning back over a tile is served without touching the database.
+
+    Returns:
+        flask.Response: 200 with an `application/vnd.mapbox-vector-tile` body
+        (empty when the tile has no features).
+        Error responses:
+            404 tileQueryNotFound,
+            400 tileInvalid / valueError,
+            422 areaInvalid,
+            408 queryTimeout (QueryCanceledError),
+            503 serverBusy (no free query slot),
+            500 database exceptions.
+    """
+    cache_key = (query_hash, z, x, y)
+    tile = tile_cache.get(cache_key)
+
+    try:
+        if tile is None:
+            spot_query = load_tile_query(query_hash)
+            set_area(spot_query)
+
+            if restrict_area_to_tile(spot_query, z, x, y):
+                query = construct_tile_query(spot_query, z, x, y)
+
+                db = get_db()
+                apply_statement_timeout(db)
+                with cancellable(db), python_cluster_tables(db, spot_query):
+                    cursor = db.cursor()
+                    cursor.execute(query)
+                    tile = bytes(cursor.fetchone()[0] or b"")
+            else:
+                tile = b""
+
+            tile_cache.set(cache_key, tile)
+
+        return Response(tile, status=200, mimetype="application/vnd.mapbox-vector-tile")
+
+    except TileQueryNotFoundError:
+        return jsonify({"status": "error", "errorType": "tileQueryNotFound"}), 404
+
+    except TileInvalidError as e:
+        return (
+            jsonify({"status": "error", "errorType": "tileInvalid", "message": str(e)}),
+            400,
+        )
+
+    except AreaInvalidError as e:
+        response = {
+            "status": "error",
+            "errorType": "areaInvalid",
+            "message": str(e),
+        }
+
+        return jsonify(response), 422
+
+    except QueryAbortedError as e:
+        return jsonify({"status": "error", "errorType": "queryCanceled", "message": str(e)}), 499
+
+    except QueryCanceledError:
+        return jsonify({"status": "error", "errorType": "queryTimeout"}), 408
+
+    except QueryQueueTimeoutError as e:
+        return jsonify({"status": "error", "errorType": "serverBusy", "message": str(e)}), 503, {"Retry-After": "1"}
+
+    except ValueError as e:
+        response = {
+            "status": "error",
+            "errorType": "valueError",
+            "message": str(e),
+        }
+
+        return jsonify(response), 400
+
+    except (InterfaceError, ProgrammingError, DatabaseError, OperationalError) as e:
+        response = {
+            "status": "error",
+            "errorType": str(e),
+        }
+
+        return jsonify(response), 500
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -1,10 +1,72 @@
 # gunicorn.conf.py
+import multiprocessing
+import os
 
-# Number of worker processes
-workers = 4
+# Worker model: "sync" (one request at a time per process), "gthread"
+# (threads sharing the process' connection pool) or "gevent" (green threads,
+# requires the optional `gevent` and `psycogreen` packages, see
+# `requirements-gevent.txt`)
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "sync")
+
+if worker_class not in ("sync", "gthread", "gevent"):
+    raise ValueError(f"Unsupported GUNICORN_WORKER_CLASS: {worker_class}")
+
+# Connections a worker can hold at once: its pool, within the connection
+# budget of `lib.admission`
+connections_per_worker = min(int(os.getenv("DB_POOL_MAXCONN", 10)), int(os.getenv("MAX_INFLIGHT_QUERIES", 8)))
+
+# Connections all workers together may open; keep it below the server's
+# `max_connections` (100 by default), minus other clients and reserved slots
+db_max_connections = int(os.getenv("DB_MAX_CONNECTIONS", 90))
+
+# Number of worker processes; threaded and green workers need fewer processes
+# to keep the CPUs busy. Capped so that the workers cannot open more than
+# `DB_MAX_CONNECTIONS` connections.
+default_workers = multiprocessing.cpu_count() * 2 + 1 if worker_class == "sync" else multiprocessing.cpu_count() + 1
+workers = min(
+    int(os.getenv("GUNICORN_WORKERS", os.getenv("WEB_CONCURRENCY", default_workers))),
+    max(db_max_connections // connections_per_worker, 1),
+)
+
+# The connection budget bounds how many requests of a worker can query at once;
+# more threads would only wait for a slot in `get_db` (and fail with 503)
+threads = int(os.getenv("GUNICORN_THREADS", connections_per_worker)) if worker_class == "gthread" else 1
+
+# Concurrent green threads per gevent worker, bounded by the connection budget as well
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", connections_per_worker))
 
 # Bind to port 5000
-bind = ":5000"
+bind = os.getenv("GUNICORN_BIND", ":5000")
 
 # Set timeout to 120 seconds
-timeout = 120
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+
+# Recycle workers after a number of requests (with jitter, so that they do not
+# all restart at once) to bound memory growth; 0 disables it
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", max_requests // 10))
+
+# Import the application once in the master; workers share the loaded modules.
+# gevent patches the standard library only in the workers, so locks created
+# while importing the app in the master would not be green-safe.
+preload_app = worker_class != "gevent"
+
+
+def post_worker_init(worker):
+    """Open and warm up the database pool of every new worker.
+
+    Runs once the worker is set up (for gevent, after the monkey patching), so
+    that the pool and its connections are created with green-safe primitives.
+    """
+    if worker_class == "gevent":
+        from psycogreen.gevent import patch_psycopg
+
+        patch_psycopg()
+
+    from app import init_worker
+
+    try:
+        init_worker()
+    except Exception as e:
+        # The pool is created on the first request instead
+        worker.log.warning(f"Database warm-up failed: {e}")
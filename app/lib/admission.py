@@ -0,0 +1,238 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from psycopg2 import sql
+
+"""
+Admission control for spot queries.
+
+Two independent mechanisms protect the workers and the database:
+
+- Cost budgets. Before a query runs, a plain `EXPLAIN` (no `ANALYZE`, so
+  nothing is executed) estimates its total cost and result rows. When an
+  estimate exceeds `MAX_QUERY_COST` or `MAX_QUERY_ROWS`, `ADMISSION_POLICY`
+  decides what happens:
+    - "reject" (default): fail fast with `QueryRejectedError`,
+    - "count": run a count-only version of the query (set statistics only),
+    - "tiles": register the query for vector tiles and point the client there,
+    - "queue": run it, but only `MAX_HEAVY_QUERIES` such queries at a time;
+      waiting longer than `ADMISSION_QUEUE_TIMEOUT` seconds fails with
+      `QueryQueueTimeoutError`.
+  Without any budget configured, no `EXPLAIN` is run.
+
+- Connection budget. At most `MAX_INFLIGHT_QUERIES` (and no more than
+  `DB_POOL_MAXCONN`) pooled connections are checked out at once per worker.
+  A request takes a slot before its connection leaves the pool (`get_db`),
+  waiting up to `INFLIGHT_QUEUE_TIMEOUT` seconds and then failing with
+  `QueryQueueTimeoutError` instead of exhausting the pool; connections
+  borrowed for prefetch and batch workers take a slot of the same budget
+  without waiting, or are not borrowed (see `pooled_connections`).
+
+Queries with a deadline of their own (batch items) never wait for a slot past
+it: the wait ends at the deadline with `QueryDeadlineExceededError`.
+"""
+
+ADMISSION_POLICIES = ("reject", "count", "tiles", "queue")
+
+MAX_INFLIGHT_QUERIES = int(os.getenv("MAX_INFLIGHT_QUERIES", 8))
+INFLIGHT_QUEUE_TIMEOUT = float(os.getenv("INFLIGHT_QUEUE_TIMEOUT", 5))
+MAX_HEAVY_QUERIES = int(os.getenv("MAX_HEAVY_QUERIES", 1))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 30))
+DB_POOL_MAXCONN = int(os.getenv("DB_POOL_MAXCONN", 10))
+
+_connection_slots = threading.BoundedSemaphore(min(MAX_INFLIGHT_QUERIES, DB_POOL_MAXCONN))
+_heavy_queries = threading.BoundedSemaphore(MAX_HEAVY_QUERIES)
+
+
+class QueryRejectedError(Exception):
+    """
+    Raised when the planner estimates of a query exceed the configured budgets
+    and the admission policy is "reject".
+    """
+
+    def __init__(self, message, estimate):
+        super().__init__(message)
+        self.estimate = estimate
+
+
+class QueryTooLargeError(Exception):
+    """
+    Raised when an over-budget query was registered for vector tiles instead
+    of being run (policy "tiles").
+    """
+
+    def __init__(self, message, estimate, query_hash):
+        super().__init__(message)
+        self.estimate = estimate
+        self.query_hash = query_hash
+
+
+class QueryQueueTimeoutError(Exception):
+    """
+    Raised when a query waited too long for a free execution slot.
+    """
+    pass
+
+
+class QueryDeadlineExceededError(Exception):
+    """
+    Raised when the deadline of a query passes before it can run, e.g. while
+    it waits for a slot.
+    """
+    pass
+
+
+def _budget(name):
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+def admission_policy():
+    """Return the configured `ADMISSION_POLICY` ("reject" if unset)."""
+    policy = os.getenv("ADMISSION_POLICY", "reject")
+    if policy not in ADMISSION_POLICIES:
+        raise ValueError(f"Unknown admission policy: {policy}")
+    return policy
+
+
+def estimate_query(db, query):
+    """Estimate the cost and result size of a query with `EXPLAIN`.
+
+    Args:
+        db (psycopg2.extensions.connection): Open database connection.
+        query (psycopg2.sql.Composed): Query to estimate.
+
+    Returns:
+        dict: `{"cost": <total cost>, "rows": <estimated rows>}`.
+    """
+    cursor = db.cursor()
+    cursor.execute(sql.SQL("EXPLAIN (FORMAT JSON) {}").format(query))
+    plan = cursor.fetchone()[0][0]["Plan"]
+    return {"cost": plan["Total Cost"], "rows": plan["Plan Rows"]}
+
+
+def admit_query(db, query):
+    """Decide how a constructed spot query may run.
+
+    Args:
+        db (psycopg2.extensions.connection): Open database connection.
+        query (psycopg2.sql.Composed): Output of `construct_query_from_graph`.
+
+    Returns:
+        tuple[str, dict | None]: The decision ("run", or the policy applied to
+        an over-budget query: "count", "tiles" or "queue") and the planner
+        estimate (`None` when no budget is configured).
+
+    Raises:
+        QueryRejectedError: If the query is over budget and the policy is "reject".
+    """
+    max_cost, max_rows = _budget("MAX_QUERY_COST"), _budget("MAX_QUERY_ROWS")
+
+    if max_cost is None and max_rows is None:
+        return "run", None
+
+    estimate = estimate_query(db, query)
+
+    over_cost = max_cost is not None and estimate["cost"] > max_cost
+    over_rows = max_rows is not None and estimate["rows"] > max_rows
+
+    if not over_cost and not over_rows:
+        return "run", estimate
+
+    policy = admission_policy()
+
+    if policy == "reject":
+        reason = "cost" if over_cost else "rows"
+        raise QueryRejectedError(f"Estimated query {reason} exceeds the configured budget", estimate)
+
+    return policy, estimate
+
+
+def construct_count_query(query):
+    """Wrap a spot query so that it only returns the number of rows per set.
+
+    Args:
+        query (psycopg2.sql.Composed): Output of `construct_query_from_graph`.
+
+    Returns:
+        psycopg2.sql.Composed: Query returning `(set_name, count)` rows.
+    """
+    return sql.SQL("SELECT set_name, COUNT(*) FROM ({query}) AS results GROUP BY set_name").format(query=query)
+
+
+def remaining_timeout(deadline):
+    """Return the time left until a deadline, as a statement timeout.
+
+    Args:
+        deadline (float): Deadline on the `time.monotonic()` clock.
+
+    Returns:
+        int: Milliseconds left (at least 1).
+
+    Raises:
+        QueryDeadlineExceededError: If the deadline has passed.
+    """
+    remaining = round((deadline - time.monotonic()) * 1000)
+    if remaining <= 0:
+        raise QueryDeadlineExceededError("Deadline exceeded before the query started")
+    return remaining
+
+
+def _acquire(semaphore, timeout, deadline, message):
+    """Wait for a semaphore up to `timeout` seconds, and never past `deadline`."""
+    if deadline is not None and deadline - time.monotonic() < timeout:
+        if not semaphore.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            raise QueryDeadlineExceededError(f"Deadline exceeded while waiting: {message}")
+    elif not semaphore.acquire(timeout=timeout):
+        raise QueryQueueTimeoutError(message)
+
+
+@contextmanager
+def _slot(semaphore, timeout, deadline=None):
+    _acquire(semaphore, timeout, deadline, "No free query slot")
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+def acquire_connection_slot(blocking=True, deadline=None):
+    """Take one slot of the worker's connection budget.
+
+    Args:
+        blocking (bool): Wait up to `INFLIGHT_QUEUE_TIMEOUT` seconds for a slot
+            (request connections), or give up at once (borrowed connections).
+        deadline (float | None): Deadline of the caller on the
+            `time.monotonic()` clock, bounding the wait.
+
+    Returns:
+        bool: Whether a slot was taken (always true when blocking).
+
+    Raises:
+        QueryQueueTimeoutError: If blocking and no slot frees up in time.
+        QueryDeadlineExceededError: If the deadline passes while waiting.
+    """
+    if not blocking:
+        return _connection_slots.acquire(blocking=False)
+    _acquire(_connection_slots, INFLIGHT_QUEUE_TIMEOUT, deadline, "No free database connection")
+    return True
+
+
+def release_connection_slot():
+    """Give back a slot taken with `acquire_connection_slot`."""
+    _connection_slots.release()
+
+
+def heavy_query_slot(deadline=None):
+    """Hold one of the `MAX_HEAVY_QUERIES` slots for over-budget queries.
+
+    Args:
+        deadline (float | None): Deadline of the query on the
+            `time.monotonic()` clock, bounding the wait.
+
+    Raises:
+        QueryQueueTimeoutError: If no slot frees up within `ADMISSION_QUEUE_TIMEOUT`.
+        QueryDeadlineExceededError: If the deadline passes while waiting.
+    """
+    return _slot(_heavy_queries, ADMISSION_QUEUE_TIMEOUT, deadline)
@@ -0,0 +1,108 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from queue import SimpleQueue
+from flask import g
+from .admission import QueryDeadlineExceededError
+from .database import pooled_connections
+
+"""
+Concurrent execution of the items of a `/run-spot-query/batch` request.
+
+`run_batch` spreads the items over the request connection plus connections
+borrowed from the pool (up to `BATCH_WORKERS` in total) and yields every item
+as soon as it finishes. Each item runs in its own application context with
+its connection in `g.db`, so the regular request helpers work unchanged.
+
+All items share one deadline: an item that has not started when the deadline
+passes is not run (`BatchDeadlineExceededError`), and running items get the
+remaining time as their statement timeout and as the longest they may wait
+for an admission slot (`QueryDeadlineExceededError`).
+"""
+
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 16))
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", 4))
+
+
+class BatchDeadlineExceededError(QueryDeadlineExceededError):
+    """
+    Raised for batch items that could not start before the batch deadline.
+    """
+    pass
+
+
+def batch_deadline(requested=None):
+    """Compute the monotonic deadline of a batch.
+
+    Args:
+        requested (int | float | None): Deadline requested by the client, in
+            milliseconds. It cannot exceed `BATCH_TIMEOUT` (defaults to `TIMEOUT`).
+
+    Returns:
+        float: Deadline on the `time.monotonic()` clock.
+
+    Raises:
+        ValueError: If `requested` is not a positive number.
+    """
+    limit = int(os.getenv("BATCH_TIMEOUT", os.getenv("TIMEOUT", 20000)))
+    if requested is None:
+        return time.monotonic() + limit / 1000
+
+    if isinstance(requested, bool) or not isinstance(requested, (int, float)) or not 0 < requested < float("inf"):
+        raise ValueError("The batch deadline must be a positive number of milliseconds")
+    timeout = min(requested, limit)
+    return time.monotonic() + timeout / 1000
+
+
+def area_key(spot_query):
+    """Key under which batch items with equal areas share the area computation."""
+    return json.dumps(spot_query["area"], sort_keys=True)
+
+
+def run_batch(app, db, tasks, deadline):
+    """Run the tasks of a batch concurrently and yield them as they finish.
+
+    Args:
+        app (flask.Flask): Application, used to push a context per task.
+        db (psycopg2.extensions.connection): Request connection, used as one
+            of the workers.
+        tasks (dict[int, Callable[[int], Any]]): Tasks keyed by item index.
+            Every task receives its statement timeout in milliseconds and finds
+            its connection in `g.db`.
+        deadline (float): Batch deadline, see `batch_deadline`.
+
+    Yields:
+        tuple[int, concurrent.futures.Future]: The item index and the finished
+        future holding the task result or exception.
+    """
+    if not tasks:
+        return
+
+    with pooled_connections(min(len(tasks), BATCH_WORKERS) - 1) as borrowed:
+        connections = SimpleQueue()
+        for connection in [db, *borrowed]:
+            connections.put(connection)
+
+        def run(task):
+            connection = connections.get()
+            try:
+                remaining = round((deadline - time.monotonic()) * 1000)
+                if remaining <= 0:
+                    raise BatchDeadlineExceededError("Batch deadline exceeded before the query started")
+
+                with app.app_context():
+                    g.db = connection
+                    try:
+                        return task(remaining)
+                    finally:
+                        # The connection is returned by the batch, not by the teardown
+                        g.pop("db", None)
+            finally:
+                connection.rollback()
+                connections.put(connection)
+
+        with ThreadPoolExecutor(max_workers=len(borrowed) + 1) as executor:
+            futures = {executor.submit(run, task): index for index, task in tasks.items()}
+            for future in as_completed(futures):
+                yield futures[future], future
@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+
+"""
+Small in-process caching helpers.
+
+The `LRUCache` class is a thread-safe, bounded mapping that evicts the least
+recently used entry once `maxsize` is reached. Entries can optionally expire
+after a time-to-live (in seconds), either set globally or per entry.
+"""
+
+
+class LRUCache:
+    """A bounded, thread-safe LRU cache with optional expiry.
+
+    Example:
+        cache = LRUCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.get("a")  # 1
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        """Initialize the cache.
+
+        Args:
+            maxsize (int): Maximum number of entries kept in memory. A value of
+                0 disables the cache (every `get` misses).
+            ttl (float | None): Default time-to-live in seconds, `None` for no expiry.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for `key`, or `default` if missing or expired.
+
+        Args:
+            key (Hashable): Cache key.
+            default (Any): Value returned on a miss.
+
+        Returns:
+            Any: The cached value or `default`.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store `value` under `key`, evicting the least recently used entry if full.
+
+        Args:
+            key (Hashable): Cache key.
+            value (Any): Value to store.
+            ttl (float | None): Entry-specific time-to-live in seconds. Falls back
+                to the cache default when `None`.
+        """
+        if self.maxsize <= 0:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,257 @@
+import os
+import re
+import select
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import psycopg2
+from flask import g, has_app_context
+from psycopg2.extensions import QueryCanceledError
+
+from .metrics import increment
+
+"""
+Cancellation of the database queries of a request.
+
+Every request gets an id (`X-Request-ID`, taken from the request when it is a
+plain token of 8 to 64 characters, generated otherwise) and an `Inflight`
+entry in a per-worker registry. While queries run, their connections are
+attached to the entry (`cancellable`), and the entry can be canceled:
+
+- when the client disconnects: a watchdog thread polls the client sockets of
+  requests with running queries every `CANCEL_POLL_INTERVAL` seconds
+  (default 0.5). This needs the socket in the WSGI environment, which
+  gunicorn provides (`gunicorn.socket`) and the Flask development server does
+  not. Behind a proxy, the proxy must close the upstream connection when its
+  client goes away (nginx does unless `proxy_ignore_client_abort` is on).
+- explicitly, with `POST /cancel/<request_id>` (`cancel_request`). Requests
+  running in another worker are found through `pg_stat_activity`: connections
+  are tagged with `application_name = spot:<request_id>` along with their
+  statement timeout (see `application_name`).
+
+Canceling calls `connection.cancel()` on every attached connection, which
+makes PostgreSQL abort the running statement; `cancellable` turns the
+resulting `QueryCanceledError` into `QueryAbortedError` so that it is not
+reported as a timeout, and later queries of the request fail before starting.
+Set `CANCEL_ON_DISCONNECT=false` to keep queries of disconnected clients
+running. Cancellations are counted in `lib.metrics`.
+"""
+
+CANCEL_POLL_INTERVAL = float(os.getenv("CANCEL_POLL_INTERVAL", 0.5))
+APPLICATION_NAME = "spot"
+
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9_.-]{8,64}$")
+
+_registry = {}
+_registry_lock = threading.Lock()
+_watchdog = None
+
+
+class QueryAbortedError(Exception):
+    """
+    Raised when the queries of a request were canceled, because the client
+    disconnected ("disconnect") or the request was canceled ("request").
+    """
+
+    def __init__(self, reason):
+        super().__init__(f"Query canceled ({reason})")
+        self.reason = reason
+
+
+def cancel_on_disconnect():
+    return os.getenv("CANCEL_ON_DISCONNECT", "true").lower() in ["true", "1", "yes"]
+
+
+class Inflight:
+    """Connections running queries for one request.
+
+    Args:
+        request_id (str): The request id.
+        client_socket (socket.socket | None): The client connection, if the
+            server exposes it.
+    """
+
+    def __init__(self, request_id, client_socket=None):
+        self.request_id = request_id
+        self.client_socket = client_socket
+        self.connections = []
+        self.canceled = None
+        self.lock = threading.Lock()
+
+    def attach(self, connections):
+        with self.lock:
+            if self.canceled is not None:
+                raise QueryAbortedError(self.canceled)
+            self.connections.extend(connections)
+
+    def detach(self, connections):
+        with self.lock:
+            for connection in connections:
+                self.connections.remove(connection)
+
+    def cancel(self, reason):
+        """Cancel the running queries, and the queries the request would run next.
+
+        Args:
+            reason (str): "disconnect" or "request".
+
+        Returns:
+            int: Number of connections a cancel was sent to.
+        """
+        with self.lock:
+            if self.canceled is not None:
+                return 0
+            self.canceled = reason
+            # Under the lock: connections are never canceled after being detached
+            for connection in self.connections:
+                try:
+                    connection.cancel()
+                except psycopg2.Error:
+                    pass
+            return len(self.connections)
+
+
+def request_id_from(header):
+    """Return the request id to use for a request with the `X-Request-ID` header value."""
+    if header and _REQUEST_ID.match(header):
+        with _registry_lock:
+            if header not in _registry:
+                return header
+    return uuid.uuid4().hex
+
+
+def register_request(request_id, environ):
+    """Add a request to the registry of this worker.
+
+    Args:
+        request_id (str): See `request_id_from`.
+        environ (dict): WSGI environment of the request.
+
+    Returns:
+        Inflight: The registry entry.
+    """
+    inflight = Inflight(request_id, environ.get("gunicorn.socket"))
+    with _registry_lock:
+        _registry[request_id] = inflight
+    return inflight
+
+
+def unregister_request(inflight):
+    with _registry_lock:
+        if _registry.get(inflight.request_id) is inflight:
+            del _registry[inflight.request_id]
+
+
+def application_name():
+    """Return the `application_name` tagging the connection of the current request."""
+    inflight = g.get("inflight") if has_app_context() else None
+    return f"{APPLICATION_NAME}:{inflight.request_id}" if inflight is not None else APPLICATION_NAME
+
+
+@contextmanager
+def cancellable(*connections):
+    """Attach connections to the request's `Inflight` entry while they run queries.
+
+    Outside of a request (or without an entry in `g.inflight`), this is a no-op.
+
+    Args:
+        *connections (psycopg2.extensions.connection): The connections.
+
+    Raises:
+        QueryAbortedError: If the request was canceled, before or while the
+            queries run.
+    """
+    inflight = g.get("inflight") if has_app_context() else None
+    if inflight is None:
+        yield
+        return
+
+    inflight.attach(connections)
+    if inflight.client_socket is not None and cancel_on_disconnect():
+        _start_watchdog()
+    try:
+        yield
+    except QueryCanceledError as e:
+        # A cancel sent by another worker (see `cancel_backends`) is not in `inflight.canceled`
+        if inflight.canceled is None and "user request" not in str(e):
+            raise
+        raise QueryAbortedError(inflight.canceled or "request") from e
+    finally:
+        inflight.detach(connections)
+
+
+def cancel_request(request_id):
+    """Cancel the queries of a request running in this worker.
+
+    Args:
+        request_id (str): The request id.
+
+    Returns:
+        bool: Whether the request was found in this worker.
+    """
+    with _registry_lock:
+        inflight = _registry.get(request_id)
+    if inflight is None:
+        return False
+
+    inflight.cancel("request")
+    return True
+
+
+def cancel_backends(db, request_id):
+    """Cancel the running queries of a request served by another worker.
+
+    Args:
+        db (psycopg2.extensions.connection): Open database connection.
+        request_id (str): The request id.
+
+    Returns:
+        int: Number of backends signaled.
+    """
+    cursor = db.cursor()
+    cursor.execute(
+        "SELECT count(*) FILTER (WHERE pg_cancel_backend(pid)) FROM pg_stat_activity "
+        "WHERE application_name = %s AND state = 'active' AND pid <> pg_backend_pid()",
+        (f"{APPLICATION_NAME}:{request_id}",),
+    )
+    signaled = cursor.fetchone()[0]
+    db.commit()
+    return signaled
+
+
+def _disconnected(client_socket):
+    """Whether the client closed its connection (without consuming pending data)."""
+    try:
+        readable, _, _ = select.select([client_socket], [], [], 0)
+        if not readable:
+            return False
+        return client_socket.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+    except BlockingIOError:
+        return False
+    except (OSError, ValueError):
+        return True
+
+
+def _watch():
+    while True:
+        with _registry_lock:
+            running = [inflight for inflight in _registry.values() if inflight.connections and inflight.client_socket]
+
+        for inflight in running:
+            if inflight.canceled is None and _disconnected(inflight.client_socket):
+                if inflight.cancel("disconnect"):
+                    increment("queries_canceled_on_disconnect")
+
+        time.sleep(CANCEL_POLL_INTERVAL)
+
+
+def _start_watchdog():
+    global _watchdog
+    if _watchdog is None:
+        with _registry_lock:
+            if _watchdog is None:
+                _watchdog = threading.Thread(target=_watch, name="cancel-watchdog", daemon=True)
+                _watchdog.start()
@@ -0,0 +1,142 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import shapely
+
+"""
+In-process DBSCAN for cluster nodes.
+
+`dbscan` labels 2D points (projected coordinates, in meters) the same way
+PostGIS `ST_ClusterDBSCAN` does: a point is a core point when at least
+`min_points` points (itself included) lie within `eps`; core points within
+`eps` of each other share a cluster, and border points join the cluster of
+one of their core neighbours.
+
+Neighbour pairs come from a `shapely.STRtree` `dwithin` query over numpy
+coordinate arrays. With `CLUSTER_WORKERS` > 1 the points are split into
+vertical strips (each strip's tree also holds the points within `eps` of its
+edges) and the strips are queried in parallel worker processes. Clusters are
+then formed with a vectorized connected-components pass over the pairs.
+"""
+
+_executor = None
+_executor_workers = None
+
+
+def _get_executor(workers):
+    """Return the process pool used for partitioned neighbour queries."""
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers != workers:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ProcessPoolExecutor(max_workers=workers)
+        _executor_workers = workers
+    return _executor
+
+
+def _strip_pairs(coords, query_indexes, tree_indexes, eps):
+    """Find all (query, tree) index pairs within `eps` for one strip."""
+    tree = shapely.STRtree(shapely.points(coords[tree_indexes]))
+    pairs = tree.query(shapely.points(coords[query_indexes]), predicate="dwithin", distance=eps)
+    return np.vstack([query_indexes[pairs[0]], tree_indexes[pairs[1]]])
+
+
+def neighbour_pairs(coords, eps, workers=1):
+    """Find all pairs of points within `eps` of each other (self-pairs included).
+
+    Args:
+        coords (numpy.ndarray): `(n, 2)` array of projected coordinates.
+        eps (float): Neighbourhood radius.
+        workers (int): Number of worker processes; 1 queries in-process.
+
+    Returns:
+        numpy.ndarray: `(2, m)` array of point index pairs.
+    """
+    n = len(coords)
+    all_indexes = np.arange(n)
+
+    if workers <= 1 or n < 10000:
+        return _strip_pairs(coords, all_indexes, all_indexes, eps)
+
+    order = np.argsort(coords[:, 0], kind="stable")
+    sorted_x = coords[order, 0]
+
+    tasks = []
+    for strip in np.array_split(np.arange(n), workers):
+        low, high = sorted_x[strip[0]], sorted_x[strip[-1]]
+        start = np.searchsorted(sorted_x, low - eps, side="left")
+        stop = np.searchsorted(sorted_x, high + eps, side="right")
+        tasks.append((order[strip], order[start:stop]))
+
+    executor = _get_executor(workers)
+    futures = [
+        executor.submit(_strip_pairs, coords, query_indexes, tree_indexes, eps)
+        for query_indexes, tree_indexes in tasks
+    ]
+    return np.hstack([future.result() for future in futures])
+
+
+def _connected_components(n, source, target):
+    """Label nodes with the smallest node index of their connected component.
+
+    Args:
+        n (int): Number of nodes.
+        source (numpy.ndarray): Edge sources.
+        target (numpy.ndarray): Edge targets (edges must be symmetric).
+
+    Returns:
+        numpy.ndarray: Component label for every node.
+    """
+    labels = np.arange(n)
+
+    while True:
+        updated = labels.copy()
+        np.minimum.at(updated, source, labels[target])
+        updated = updated[updated]
+
+        if np.array_equal(updated, labels):
+            return labels
+
+        labels = updated
+
+
+def dbscan(coords, eps, min_points, workers=None):
+    """Cluster points with DBSCAN.
+
+    Args:
+        coords (numpy.ndarray): `(n, 2)` array of projected coordinates (meters).
+        eps (float): Maximum distance between neighbours.
+        min_points (int): Minimum neighbourhood size (point included) of a core point.
+        workers (int | None): Worker processes for the neighbour search;
+            defaults to `CLUSTER_WORKERS` (1).
+
+    Returns:
+        numpy.ndarray: Cluster label per point, numbered from 0; -1 marks noise.
+    """
+    coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+    n = len(coords)
+
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+
+    if workers is None:
+        workers = int(os.getenv("CLUSTER_WORKERS", 1))
+
+    source, target = neighbour_pairs(coords, eps, workers)
+    core = np.bincount(source, minlength=n) >= min_points
+
+    core_edges = core[source] & core[target]
+    components = _connected_components(n, source[core_edges], target[core_edges])
+
+    labels = np.full(n, -1, dtype=np.int64)
+    labels[core] = components[core]
+
+    border_edges = ~core[source] & core[target]
+    border, first = np.unique(source[border_edges], return_index=True)
+    labels[border] = components[target[border_edges][first]]
+
+    clustered = labels >= 0
+    labels[clustered] = np.unique(labels[clustered], return_inverse=True)[1]
+
+    return labels
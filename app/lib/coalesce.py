@@ -0,0 +1,209 @@
+import fcntl
+import glob
+import os
+import threading
+import time
+
+from .cancellation import QueryAbortedError
+from .metrics import increment
+
+"""
+Single-flight coalescing of identical in-flight spot queries.
+
+`single_flight(key, fn)` makes concurrent callers with the same key share one
+call of `fn`:
+
+- Within a worker, the first caller (the leader) runs `fn`; the others wait
+  for it and receive the same result (or exception).
+- Across the workers of a host, leaders additionally take an exclusive
+  `flock` on `<COALESCE_DIR>/<key>.lock` while running `fn`. A leader that
+  finds the lock taken marks itself as waiting, blocks until the lock is
+  released and then reuses the result the other worker wrote to
+  `<key>.result`, provided it was written after it started waiting;
+  otherwise it runs `fn` itself. Results are only written when someone is
+  waiting for them, so uncontended queries never touch the disk.
+
+The key is the hash of the cleaned spot query, which includes its area.
+Results shared across workers must be `bytes`. Coalescing is controlled by
+`COALESCE` and `COALESCE_ACROSS_WORKERS` (both enabled by default); waiting
+is bounded by the statement timeout plus a margin, after which the caller
+runs `fn` on its own, as it does when the leader's queries were canceled
+(see `lib.cancellation`). Shared calls are counted in `lib.metrics`
+(`coalesced_in_worker`, `coalesced_across_workers`).
+"""
+
+# Files in COALESCE_DIR untouched for longer than this are removed
+COALESCE_FILE_MAX_AGE = 3600
+COALESCE_CLEANUP_INTERVAL = 600
+
+_flights = {}
+_flights_lock = threading.Lock()
+_last_cleanup = 0.0
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _enabled(name):
+    return os.getenv(name, "true").lower() in ["true", "1", "yes"]
+
+
+def _wait_timeout():
+    """Longest time to wait for another execution (statement timeout + 5 s)."""
+    return int(os.getenv("TIMEOUT", 20000)) / 1000 + 5
+
+
+def _coalesce_dir():
+    path = os.getenv("COALESCE_DIR", "/tmp/spot-coalesce")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _cleanup(directory):
+    """Remove stale lock, marker and result files, at most every few minutes."""
+    global _last_cleanup
+    now = time.time()
+
+    if now - _last_cleanup < COALESCE_CLEANUP_INTERVAL:
+        return
+    _last_cleanup = now
+
+    for path in glob.glob(os.path.join(directory, "*")):
+        try:
+            if now - os.path.getmtime(path) > COALESCE_FILE_MAX_AGE:
+                os.unlink(path)
+        except OSError:
+            pass
+
+
+def _acquire(lock_file, waiting_path, deadline):
+    """Take the exclusive lock, waiting until `deadline`.
+
+    Returns:
+        tuple[bool, bool]: Whether the lock was acquired, and whether another
+        worker held it when we arrived.
+    """
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True, False
+    except BlockingIOError:
+        pass
+
+    with open(waiting_path, "a"):
+        pass
+
+    while time.time() < deadline:
+        time.sleep(0.02)
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True, True
+        except BlockingIOError:
+            continue
+
+    return False, True
+
+
+def _read_result(result_path, since):
+    try:
+        if os.path.getmtime(result_path) < since:
+            return None
+        with open(result_path, "rb") as file:
+            return file.read()
+    except OSError:
+        return None
+
+
+def _write_result(result_path, result):
+    temporary_path = f"{result_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(result)
+    os.replace(temporary_path, result_path)
+
+
+def _run_across_workers(key, fn):
+    directory = _coalesce_dir()
+    _cleanup(directory)
+
+    base_path = os.path.join(directory, key)
+    lock_path, waiting_path, result_path = f"{base_path}.lock", f"{base_path}.waiting", f"{base_path}.result"
+    started = time.time()
+
+    with open(lock_path, "a") as lock_file:
+        os.utime(lock_path)
+        acquired, contended = _acquire(lock_file, waiting_path, started + _wait_timeout())
+
+        if not acquired:
+            return fn(), None
+
+        try:
+            if contended:
+                result = _read_result(result_path, started)
+                if result is not None:
+                    increment("coalesced_across_workers")
+                    return result, "host"
+
+            result = fn()
+
+            if os.path.exists(waiting_path) and isinstance(result, bytes):
+                _write_result(result_path, result)
+                os.unlink(waiting_path)
+
+            return result, None
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def single_flight(key, fn):
+    """Run `fn`, sharing one execution among concurrent callers with `key`.
+
+    Args:
+        key (str): Identifier of the computation (e.g. a spot query hash).
+        fn (Callable[[], bytes]): The computation.
+
+    Returns:
+        tuple[bytes, str | None]: The result and where it was shared from:
+        `None` when this caller ran `fn`, `"worker"` when it came from another
+        request of this worker, `"host"` when it came from another worker.
+
+    Raises:
+        Exception: Whatever `fn` raised, for the leader and its followers.
+    """
+    if not _enabled("COALESCE"):
+        return fn(), None
+
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        if not flight.done.wait(_wait_timeout()):
+            return fn(), None
+        # The leader's client went away: its cancellation is not ours
+        if isinstance(flight.error, QueryAbortedError):
+            return fn(), None
+        if flight.error is not None:
+            raise flight.error
+        increment("coalesced_in_worker")
+        return flight.result, "worker"
+
+    try:
+        if _enabled("COALESCE_ACROSS_WORKERS"):
+            flight.result, shared = _run_across_workers(key, fn)
+        else:
+            flight.result, shared = fn(), None
+        return flight.result, shared
+    except Exception as e:
+        flight.error = e
+        raise
+    finally:
+        with _flights_lock:
+            _flights.pop(key, None)
+        flight.done.set()
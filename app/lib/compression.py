@@ -0,0 +1,374 @@
+import os
+import struct
+import time
+import zlib
+from flask import Response
+
+from .cache import LRUCache
+from .serializer import dumps
+from .timer import stage
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+"""
+Size-aware response compression and a cache of pre-compressed responses.
+
+Large spot query responses are compressed here instead of by Flask-Compress,
+so that the algorithm and level can follow the payload size:
+
+- bodies smaller than `COMPRESS_MIN_SIZE` bytes are sent uncompressed,
+- Brotli (when accepted) is used up to `COMPRESS_BROTLI_MAX_SIZE` bytes,
+- gzip is used above that, with a lower level the bigger the body gets.
+
+A body is encoded in two parts: the payload without its `"timing"` entry
+(the head, `EncodedHead`), then the timing tail, which is appended to the
+encoded head without compressing it again (see `EncodedHead.complete`).
+Encoded heads are stored in `response_cache`, keyed by the spot query hash,
+one per content encoding: a hit is served without running the query or
+compressing the payload, with the timings of the hit itself in `"timing"`
+(and in the `Server-Timing` header). A missing encoding is compressed once,
+by the first hit that needs it, so hits answer with the same encoding as a
+miss would, and Flask-Compress never compresses them.
+
+The cache lives in each worker process and entries only expire after
+`RESULT_CACHE_TTL` seconds (or when evicted): nothing invalidates them when
+the OSM data is re-imported, so results can be that much older than the
+database.
+"""
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+COMPRESS_BROTLI_MAX_SIZE = int(os.getenv("COMPRESS_BROTLI_MAX_SIZE", 2 * 1024 * 1024))
+
+# (upper size bound in bytes, level), checked in order
+BROTLI_LEVELS = [(256 * 1024, 5), (None, 4)]
+GZIP_LEVELS = [(1024 * 1024, 6), (8 * 1024 * 1024, 4), (None, 1)]
+
+response_cache = LRUCache(
+    maxsize=int(os.getenv("RESULT_CACHE_SIZE", 32)),
+    ttl=int(os.getenv("RESULT_CACHE_TTL", 600)),
+)
+RESULT_CACHE_MAX_ENTRY_SIZE = int(os.getenv("RESULT_CACHE_MAX_ENTRY_SIZE", 8 * 1024 * 1024))
+
+
+class _Compressor:
+    """Incremental compressor with a uniform interface for gzip and Brotli."""
+
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        self.level = level
+
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=level)
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == "br":
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """Emit all pending output without ending the stream."""
+        if self.encoding == "br":
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def _level_for(size, levels):
+    for bound, level in levels:
+        if bound is None or size <= bound:
+            return level
+
+
+def accepted_encodings(accept_encodings):
+    """List the encodings a client accepts, most preferred first.
+
+    Args:
+        accept_encodings (werkzeug.datastructures.Accept): `request.accept_encodings`.
+
+    Returns:
+        list[str | None]: Subset of `["br", "gzip"]`, followed by `None` (identity).
+    """
+    encodings = []
+    if brotli is not None and accept_encodings.quality("br") > 0:
+        encodings.append("br")
+    if accept_encodings.quality("gzip") > 0:
+        encodings.append("gzip")
+    encodings.append(None)
+    return encodings
+
+
+def choose_compression(size, accept_encodings):
+    """Pick the content encoding and level for a body of `size` bytes.
+
+    Args:
+        size (int): Uncompressed body size in bytes.
+        accept_encodings (werkzeug.datastructures.Accept): `request.accept_encodings`.
+
+    Returns:
+        tuple[str | None, int | None]: `(encoding, level)`, or `(None, None)`
+        when the body should be sent uncompressed.
+    """
+    if size < COMPRESS_MIN_SIZE:
+        return None, None
+
+    encodings = accepted_encodings(accept_encodings)
+
+    if "br" in encodings and size <= COMPRESS_BROTLI_MAX_SIZE:
+        return "br", _level_for(size, BROTLI_LEVELS)
+
+    if "gzip" in encodings:
+        return "gzip", _level_for(size, GZIP_LEVELS)
+
+    return None, None
+
+
+def serialize_payload(payload):
+    """Serialize a response payload without its `"timing"` entry.
+
+    Args:
+        payload (dict): Response payload.
+
+    Returns:
+        bytes: The JSON object, to be completed by `encode_serialized`.
+    """
+    with stage("serialize"):
+        return dumps({key: value for key, value in payload.items() if key != "timing"})
+
+
+def encode_response(payload, accept_encodings, timer):
+    """Serialize and compress a response payload, recording timings in it.
+
+    The payload is serialized without its `"timing"` entry and compressed
+    incrementally; the timing checkpoints (including `"serialize"`,
+    `"compress"` and `"compression_ratio"`) are appended at the end, so they
+    reflect the work done for this very response.
+
+    Args:
+        payload (dict): Response payload. Any `"timing"` key is replaced.
+        accept_encodings (werkzeug.datastructures.Accept): `request.accept_encodings`.
+        timer (Timer): Request timer.
+
+    Returns:
+        tuple[bytes, str | None]: The (possibly compressed) body and its
+        content encoding (`None` for identity).
+    """
+    body = serialize_payload(payload)
+    timer.add_checkpoint("serialize")
+    return encode_serialized(body, accept_encodings, timer)
+
+
+def _head(body):
+    """Replace the closing brace of a serialized payload by a comma (unless it is empty)."""
+    return body[:-1] + (b"," if len(body) > 2 else b"")
+
+
+def _brotli_uncompressed(data):
+    """Encode `data` as uncompressed Brotli meta-blocks (RFC 7932, section 9.2)."""
+    blocks = []
+    for start in range(0, len(data), 1 << 24):
+        chunk = data[start:start + (1 << 24)]
+        length = len(chunk) - 1
+        nibbles = max(4, (length.bit_length() + 3) // 4)
+        # ISLAST = 0, MNIBBLES, MLEN - 1, ISUNCOMPRESSED = 1, then padding to a byte
+        header = ((nibbles - 4) << 1) | (length << 3) | (1 << (3 + 4 * nibbles))
+        blocks.append(header.to_bytes((4 + 4 * nibbles + 7) // 8, "little") + chunk)
+    return b"".join(blocks)
+
+
+# Brotli meta-block with ISLAST and ISLASTEMPTY set
+_BROTLI_END = b"\x03"
+
+
+class EncodedHead:
+    """A serialized payload without its timing tail, encoded once.
+
+    The head is the JSON object of `serialize_payload` with its closing brace
+    replaced by a comma. It is compressed and flushed to a byte boundary
+    without ending the stream, so that `complete` can append any tail:
+    further deflate blocks and a new trailer for gzip, an uncompressed
+    meta-block for Brotli.
+
+    Args:
+        head (bytes): The head.
+        encoding (str | None): "br", "gzip" or `None` (identity).
+        level (int | None): Compression level.
+    """
+
+    def __init__(self, head, encoding, level):
+        self.encoding = encoding
+        self.level = level
+        self.size = len(head)
+
+        if encoding is None:
+            self.data = head
+        else:
+            compressor = _Compressor(encoding, level)
+            self.data = compressor.compress(head) + compressor.flush()
+            self.crc = zlib.crc32(head)
+
+        self.ratio = round(self.size / max(len(self.data), 1), 2)
+
+    def complete(self, tail):
+        """Return the full encoded body of the head followed by `tail`."""
+        if self.encoding is None:
+            return self.data + tail
+
+        if self.encoding == "br":
+            return self.data + _brotli_uncompressed(tail) + _BROTLI_END
+
+        deflate = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        trailer = struct.pack("<II", zlib.crc32(tail, self.crc), (self.size + len(tail)) & 0xFFFFFFFF)
+        return self.data + deflate.compress(tail) + deflate.flush() + trailer
+
+
+def encode_head(body, accept_encodings, timer):
+    """Compress a payload serialized by `serialize_payload`, without its timings.
+
+    Args:
+        body (bytes): Output of `serialize_payload`.
+        accept_encodings (werkzeug.datastructures.Accept): `request.accept_encodings`.
+        timer (Timer): Request timer.
+
+    Returns:
+        EncodedHead: The encoded head, to be finished with `complete_response`.
+    """
+    head = _head(body)
+    encoding, level = choose_compression(len(body), accept_encodings)
+
+    if encoding is None:
+        return EncodedHead(head, None, None)
+
+    with stage("compress"):
+        encoded = EncodedHead(head, encoding, level)
+    timer.add_checkpoint("compress")
+    return encoded
+
+
+def complete_response(encoded, timer):
+    """Append the timing checkpoints to an encoded head.
+
+    Args:
+        encoded (EncodedHead): Output of `encode_head` or `get_cached_response`.
+        timer (Timer): Request timer; the compression ratio and level of the
+            head are added to its checkpoints.
+
+    Returns:
+        bytes: The complete encoded body.
+    """
+    if encoded.encoding is not None:
+        timer.checkpoints["compression_ratio"] = encoded.ratio
+        timer.checkpoints["compression_level"] = encoded.level
+
+    return encoded.complete(b'"timing":' + dumps(timer.get_all_checkpoints()) + b"}")
+
+
+def encode_serialized(body, accept_encodings, timer):
+    """Compress a payload serialized by `serialize_payload`, appending timings.
+
+    Args:
+        body (bytes): Output of `serialize_payload`.
+        accept_encodings (werkzeug.datastructures.Accept): `request.accept_encodings`.
+        timer (Timer): Request timer.
+
+    Returns:
+        tuple[bytes, str | None]: The (possibly compressed) body and its
+        content encoding (`None` for identity).
+    """
+    encoded = encode_head(body, accept_encodings, timer)
+    return complete_response(encoded, timer), encoded.encoding
+
+
+def get_cached_response(query_hash, accept_encodings, timer):
+    """Look up the cached head of a spot query, in the encoding a miss would use.
+
+    The encoding is chosen by `choose_compression`; a variant that is not
+    cached yet is compressed once from the identity head and added to the
+    entry.
+
+    Args:
+        query_hash (str): Hash of the cleaned spot query.
+        accept_encodings (werkzeug.datastructures.Accept): `request.accept_encodings`.
+        timer (Timer): Request timer.
+
+    Returns:
+        EncodedHead | None: The encoded head, to be finished with
+        `complete_response`, or `None` on a miss.
+    """
+    entry = response_cache.get(query_hash)
+    if entry is None:
+        return None
+
+    identity = entry[None]
+    encoding, level = choose_compression(identity.size, accept_encodings)
+    encoded = entry.get(encoding)
+    if encoded is None:
+        with stage("compress"):
+            encoded = entry[encoding] = EncodedHead(identity.data, encoding, level)
+        timer.add_checkpoint("compress")
+    return encoded
+
+
+def cache_response(query_hash, body, encoded):
+    """Store a serialized payload and its encoded head for later reuse.
+
+    Args:
+        query_hash (str): Hash of the cleaned spot query.
+        body (bytes): Output of `serialize_payload`, i.e. without timings.
+        encoded (EncodedHead): Output of `encode_head` for `body`.
+    """
+    if len(body) <= RESULT_CACHE_MAX_ENTRY_SIZE:
+        identity = encoded if encoded.encoding is None else EncodedHead(_head(body), None, None)
+        entry = {None: identity, encoded.encoding: encoded}
+        response_cache.set(query_hash, entry)
+
+
+def server_timing(checkpoints):
+    """Format timing checkpoints as a `Server-Timing` header value.
+
+    Args:
+        checkpoints (dict): Output of `Timer.get_all_checkpoints`; only the
+            top-level durations are reported.
+
+    Returns:
+        str: E.g. `"authentication;dur=0.1, clean;dur=0.2"`.
+    """
+    return ", ".join(
+        f"{name};dur={value}" for name, value in checkpoints.items() if isinstance(value, (int, float))
+    )
+
+
+def encoded_response(body, encoding, status=200, cache_status=None, timing=None):
+    """Wrap an already encoded JSON body in a Flask response.
+
+    Args:
+        body (bytes): Encoded response body.
+        encoding (str | None): Content encoding of `body`.
+        status (int): HTTP status code.
+        cache_status (str | None): Value for the `X-Cache` header (`"hit"`/`"miss"`).
+        timing (dict | None): Checkpoints for the `Server-Timing` header.
+
+    Returns:
+        flask.Response: The response. Flask-Compress leaves it alone: compressed
+        bodies carry `Content-Encoding`, and identity bodies are either below
+        `COMPRESS_MIN_SIZE` or sent to clients accepting neither br nor gzip.
+    """
+    response = Response(body, status=status, mimetype="application/json")
+    response.headers["Vary"] = "Accept-Encoding"
+
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    if cache_status is not None:
+        response.headers["X-Cache"] = cache_status
+    if timing:
+        response.headers["Server-Timing"] = server_timing(timing)
+
+    return response
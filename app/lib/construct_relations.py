@@ -3,7 +3,7 @@ from .utils import distance_to_meters
 from psycopg2 import sql
 
 
-def construct_relations(spot_query):
+def construct_relations(spot_query, binary_geometry=True):
     """Build a composed SQL query from a graph of spatial relations.
 
     This function turns a lightweight graph specification into a single
@@ -17,10 +17,13 @@ def construct_relations(spot_query):
 
     The output query:
     - Produces a UNION of per-node SELECTs.
-    - Includes `set_name`, `osm_ids`, `geom`, `tags`, `primitive_type`.
+    - Includes `set_name`, `osm_ids`, `geom`, `tags`, `primitive_type`; `geom`
+      is WKB (`ST_AsBinary`, fetched with `lib.database.wkb_cursor`) unless
+      `binary_geometry` is false.
     - Adds `primary_osm_id` when a node participates in a relation (derived from
       the first node in the provided `nodes` list), otherwise `NULL`.
-    - Groups final results to deduplicate identical rows.
+    - Groups final results to deduplicate identical rows, collecting the distinct
+      primary OSM ids of each row (joined with `,`) into `primary_osm_ids`.
 
     Args:
       spot_query (dict):
@@ -47,6 +50,10 @@ def construct_relations(spot_query):
           clauses (cast to text).
         - Each `nodes[i]["name"]` becomes the SQL table alias for that node.
 
+      binary_geometry (bool):
+        Whether to return `geom` as WKB `bytea` (for the executors) rather than
+        as a geometry (for queries wrapping this one, e.g. vector tiles).
+
     Returns:
       psycopg2.sql.Composed:
         A fully composed and parameter-safe SQL object that can be passed to
@@ -205,7 +212,7 @@ def construct_relations(spot_query):
                     {name_alias}.geom, 
                     {name_alias}.tags,
                     {name_alias}.primitive_type,
-                    NULL AS primary_osm_id
+                    NULL::text[] AS primary_osm_id
                 FROM {id} {name_alias}
                 """
             ).format(
@@ -223,11 +230,16 @@ def construct_relations(spot_query):
             SELECT 
                 subquery.set_name, 
                 subquery.osm_ids, 
-                subquery.geom, 
+                {geom} AS geom, 
                 subquery.tags, 
-                subquery.primitive_type
+                subquery.primitive_type,
+                ARRAY_AGG(DISTINCT ARRAY_TO_STRING(subquery.primary_osm_id, ','))
+                    FILTER (WHERE subquery.primary_osm_id IS NOT NULL) AS primary_osm_ids
             FROM ({query}) AS subquery
-            GROUP BY subquery.set_name, subquery.osm_ids, subquery.geom, subquery.tags, subquery.primitive_type;"""
-    ).format(query=union)
+            GROUP BY subquery.set_name, subquery.osm_ids, subquery.geom, subquery.tags, subquery.primitive_type"""
+    ).format(
+        query=union,
+        geom=sql.SQL("ST_AsBinary(subquery.geom)" if binary_geometry else "subquery.geom"),
+    )
 
     return final_query
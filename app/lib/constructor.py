@@ -1,7 +1,9 @@
-from .ctes.construct import construct_ctes
+from .ctes.construct import construct_ctes, construct_cte
+from .ctes.construct_search_area import construct_search_area_cte
 from .construct_relations import construct_relations
 from psycopg2 import sql
 from flask import g
+from .timer import stage
 
 """
 Build a complete SQL query (WITH CTEs + JOINed relations) from a graph spec.
@@ -11,9 +13,16 @@ This module orchestrates two steps:
 2) `construct_relations(spot_query)` generates the main SELECT + JOINs across those nodes.
 
 The result is a single `psycopg2.sql` composed query ready for execution.
+`construct_node_query` builds the standalone query of a single node, for
+executors that evaluate the node filters or the relations separately, and
+`construct_query_from_tables` runs the relations over prefetched node tables.
 """
 
-def construct_query_from_graph(spot_query):
+# Columns of a node CTE that the relation stage reads
+NODE_COLUMNS = ["osm_ids", "geom", "tags", "primitive_type", "transformed_geom"]
+GEOMETRY_COLUMNS = {"geom", "transformed_geom"}
+
+def construct_query_from_graph(spot_query, binary_geometry=True):
     """Compose a full SQL query from a graph-like `spot_query`.
 
     This function delegates to:
@@ -29,33 +38,91 @@ def construct_query_from_graph(spot_query):
         - edges: list of {"source": <node_id>, "target": <node_id>, "type": <str>, ...}
         The exact schema must satisfy the expectations of `construct_ctes` and
         `construct_relations`.
+      binary_geometry (bool): Return `geom` as WKB (see `construct_relations`).
 
     Returns:
-      psycopg2.sql.Composed | None: The composed SQL query if successful; otherwise
-      `None` if an exception is raised during construction (the error is printed).
+      psycopg2.sql.Composed: The composed SQL query.
+
+    Raises:
+      ValueError: If a node cannot be translated (e.g. an invalid distance or
+        an unknown cluster strategy); handled by the calling route.
 
     Notes:
-      - Exceptions are caught and printed, and the function returns `None`. If you
-        prefer failures to propagate to callers, remove the try/except.
+      - Never queries the database; cluster tables of the "python" strategy are
+        filled by the executors (see `lib.executors.python_cluster_tables`).
       - The import `flask.g` is present if you intend to use request-scoped context,
         but it is not referenced in this function.
     """
-    try:
-        # Construct the node CTEs based on the intermediate representation
+    # Construct the node CTEs based on the intermediate representation
+    with stage("ctes"):
         ctes = construct_ctes(spot_query)
 
-        # Combine the node constructed CTEs with the SQL WITH clause
-        combined_ctes = sql.SQL("WITH ") + sql.SQL(", ").join(ctes)
+    # Combine the node constructed CTEs with the SQL WITH clause
+    combined_ctes = sql.SQL("WITH ") + sql.SQL(", ").join(ctes)
+
+    # Construct the relations (JOINs) based on the intermediate representation
+    with stage("relations"):
+        relations = construct_relations(spot_query, binary_geometry)
+
+    # Combine CTEs and relations to form the final query
+    final_query = sql.SQL(" ").join([combined_ctes, relations])
+
+    # Return the final SQL query
+    return final_query
 
-        # Construct the relations (JOINs) based on the intermediate representation
-        relations = construct_relations(spot_query)
 
-        # Combine CTEs and relations to form the final query
-        final_query = sql.SQL(" ").join([combined_ctes, relations])
+def construct_node_query(node, binary_geometry=False):
+    """Compose a standalone query returning the filtered rows of one node.
 
-        # Return the final SQL query
-        return final_query
+    The query contains the envelope CTE and the node's own CTE, and selects
+    the columns used by the relation stage (`NODE_COLUMNS`).
+
+    Args:
+      node (dict): A node of a cleaned spot query.
+      binary_geometry (bool): Select `geom` and `transformed_geom` as WKB
+        (`ST_AsBinary`), for rows fetched into Python.
+
+    Returns:
+      psycopg2.sql.Composed: The node query.
+    """
+    envelope_cte = construct_search_area_cte(g.area["type"])
+    node_cte = construct_cte(node)
+
+    return sql.SQL("WITH {envelope}, {node} SELECT {columns} FROM {name}").format(
+        envelope=envelope_cte,
+        node=node_cte,
+        columns=sql.SQL(", ").join(
+            sql.SQL("ST_AsBinary({column}) AS {column}").format(column=sql.Identifier(column))
+            if binary_geometry and column in GEOMETRY_COLUMNS
+            else sql.Identifier(column)
+            for column in NODE_COLUMNS
+        ),
+        name=sql.Identifier(str(node["id"])),
+    )
+
+
+def construct_query_from_tables(spot_query, tables):
+    """Compose the relation query over already materialized node tables.
+
+    Each node CTE is replaced by a plain `SELECT *` from the table holding
+    its prefetched rows, so `construct_relations` can be reused unchanged.
+
+    Args:
+      spot_query (dict): A cleaned spot query.
+      tables (dict): Table name for every node id.
+
+    Returns:
+      psycopg2.sql.Composed: The relation query.
+    """
+    ctes = [
+        sql.SQL("{name} AS (SELECT * FROM {table})").format(
+            name=sql.Identifier(str(node["id"])),
+            table=sql.Identifier(tables[node["id"]]),
+        )
+        for node in spot_query["nodes"]
+    ]
 
-    except Exception as e:
-        print(f"An error occurred in constructor.py: {e}")
-        return None
+    return sql.SQL("WITH {ctes} {relations}").format(
+        ctes=sql.SQL(", ").join(ctes),
+        relations=construct_relations(spot_query),
+    )
@@ -2,6 +2,7 @@ from flask import g
 from .construct_search_area import construct_search_area_cte
 from .construct_nwrs import construct_nwr_cte
 from .construct_cluster import construct_cluster_cte
+from .construct_shared import plan_shared_bases
 
 
 def construct_ctes(spot_query):
@@ -11,6 +12,8 @@ def construct_ctes(spot_query):
 
     This includes:
       - An envelope CTE based on the global area.
+      - Materialized base CTEs for filters shared by several nodes
+        (see `plan_shared_bases`).
       - Additional CTEs for each node in the SPOT query.
 
     Args:
@@ -31,10 +34,14 @@ def construct_ctes(spot_query):
     envelope_cte = construct_search_area_cte(g.area["type"])
 
     ctes.append(envelope_cte)
-    
+
+    # Construct base CTEs shared by nodes with common filters
+    base_ctes, sources = plan_shared_bases(nodes)
+    ctes.extend(base_ctes)
+
     # Iterate over the nodes to construct each CTE
     for i in range(len(nodes)):
-        cte = construct_cte(nodes[i])
+        cte = construct_cte(nodes[i], sources.get(nodes[i]["id"]))
 
         # Append the CTE to the list
         ctes.append(cte)
@@ -42,13 +49,15 @@ def construct_ctes(spot_query):
     return ctes
 
 
-def construct_cte(node):
+def construct_cte(node, source=None):
     """
     Constructs a specific Common Table Expressions (CTE) based on the node type.
 
     Args:
         node (dict): A dictionary describing a node in the SPOT query graph.
             Must include a "type" key, which determines how the CTE is constructed.
+        source (tuple | None): Shared base CTE the node reads from ("nwr" only),
+            as planned by `plan_shared_bases`.
 
     Returns:
         SQL object or string: A Common Table Expression corresponding
@@ -65,4 +74,4 @@ def construct_cte(node):
         return construct_cluster_cte(node)
 
     elif type == "nwr":
-        return construct_nwr_cte(node)
+        return construct_nwr_cte(node, source)
@@ -1,9 +1,55 @@
+import logging
 import os
+import uuid
 from flask import g
 from ..utils import distance_to_meters
+from .construct_search_area import construct_search_area_cte
 from .construct_where_clause import construct_cte_where_clause
+from ..layers import route_to_layer
 from psycopg2 import sql
 
+logger = logging.getLogger(__name__)
+
+# Cluster strategies selectable with the `CLUSTER_STRATEGY` environment variable
+CLUSTER_STRATEGIES = ("grid", "dbscan", "python")
+
+# Prefix of the unlogged tables holding the clusters of the "python" strategy.
+# They are dropped after every query; leftovers (e.g. after a crash) can be removed safely.
+CLUSTER_TABLE_PREFIX = "spot_cluster_"
+
+
+def cluster_params(node):
+    """
+    Builds the SQL fragments shared by all cluster strategies.
+
+    Args:
+        node (dict): Cluster node (see `construct_cluster_cte`).
+
+    Returns:
+        dict: `utm`, `eps`, `min_pts`, `cluster_name`, `table_view`, `filters`,
+        `set_id` and `set_name` fragments.
+    """
+    eps_in_meters = distance_to_meters(node.get("maxDistance", "50"))
+    min_points = node.get("minPoints", 2)
+    set_id = node.get("id", "id")
+    set_name = node.get("name", "name")
+    cluster_name = f"cluster_{set_id}_{set_name}".replace(" ", "_")
+
+    logger.debug(
+        "Cluster %s (%s): utm=%s eps=%s min_points=%s", set_id, set_name, g.utm, eps_in_meters, min_points
+    )
+
+    return dict(
+        utm=sql.Literal(g.utm),
+        eps=sql.Literal(eps_in_meters),
+        min_pts=sql.Literal(min_points),
+        cluster_name=sql.Literal(cluster_name),
+        table_view=route_to_layer(node.get("filters", []))[0],
+        filters=construct_cte_where_clause(node.get("filters", [])),
+        set_id=sql.Literal(set_id),
+        set_name=sql.Literal(set_name),
+    )
+
 
 def construct_cluster_cte(node):
     """
@@ -13,7 +59,10 @@ def construct_cluster_cte(node):
     This function:
       - Converts clustering parameters to meters.
       - Constructs a SQL CTE that clusters spatial features using PostGIS's
-        `ST_ClusterDBSCAN`.
+        `ST_ClusterDBSCAN`, with the strategy chosen by `CLUSTER_STRATEGY`:
+          - "grid" (default): see `construct_grid_cluster_query`.
+          - "dbscan": see `construct_dbscan_cluster_query`.
+          - "python": see `construct_python_cluster_query`.
       - Computes centroids and collects relevant metadata for each cluster.
 
     Args:
@@ -28,68 +77,240 @@ def construct_cluster_cte(node):
         psycopg2.sql.Composed: A SQL statement defining the CTE for clustering.
 
     Raises:
-        None explicitly, but any errors during SQL generation are caught and printed.
+        ValueError: If `CLUSTER_STRATEGY` is unknown or a parameter is invalid.
 
     Notes:
         - Uses the current UTM zone from `flask.g.utm`.
-        - The resulting clusters are grouped by DBSCAN cluster ID, with geometry
-          centroids and associated metadata.
-        - Returns None if an exception is raised during construction.
+        - Never queries the database.
+    """
+    params = cluster_params(node)
+    strategy = cluster_strategy()
+
+    if strategy == "dbscan":
+        query = construct_dbscan_cluster_query(params)
+    elif strategy == "grid":
+        query = construct_grid_cluster_query(params)
+    else:
+        query = construct_python_cluster_query(params, cluster_table(node))
+
+    return sql.SQL("{set_id} AS ({q})").format(
+        set_id=sql.Identifier(str(node.get("id", "id"))),
+        q=query,
+    )
+
+
+def cluster_strategy():
+    """Return the configured `CLUSTER_STRATEGY` ("grid" if unset)."""
+    strategy = os.getenv("CLUSTER_STRATEGY", "grid")
+    if strategy not in CLUSTER_STRATEGIES:
+        raise ValueError(f"Unknown cluster strategy: {strategy}")
+    return strategy
+
+
+def cluster_table(node):
+    """
+    Name of the table holding the clusters of a node with the "python" strategy.
+
+    Names are unique per request (or app context), so that concurrent requests
+    never share a table.
+
+    Args:
+        node (dict): Cluster node.
+
+    Returns:
+        str: The table name, starting with `CLUSTER_TABLE_PREFIX`.
+    """
+    run_id = g.setdefault("cluster_run_id", uuid.uuid4().hex[:16])
+    return f"{CLUSTER_TABLE_PREFIX}{run_id}_{node.get('id', 'id')}"
+
+
+def construct_dbscan_cluster_query(params):
     """
-    try:
-        eps = node.get("maxDistance", "50")
-        eps_in_meters = distance_to_meters(eps)
-        min_points = node.get("minPoints", 2)
-        set_id = node.get("id", "id")
-        set_name = node.get("name", "name")
-        cluster_name = f"cluster_{set_id}_{set_name}".replace(" ", "_")
-
-        print(g.utm,eps_in_meters, min_points, set_id, set_name)
-        filters = construct_cte_where_clause(node.get("filters", []))
-
-        query = sql.SQL(
-            """WITH clusters AS (
+    Builds the original clustering query: `ST_ClusterDBSCAN` over every filtered
+    row, grouped by cluster ID together with each row's tags and geometry.
+
+    Args:
+        params (dict): SQL fragments shared by all strategies (see `cluster_params`).
+
+    Returns:
+        psycopg2.sql.Composed: The clustering query (without the CTE name).
+
+    Notes:
+        Grouping by `tags` and `transformed_geom` yields one row per clustered
+        feature rather than one row per cluster.
+    """
+    return sql.SQL(
+        """WITH clusters AS (
+                            SELECT
+                                ST_ClusterDBSCAN(ST_Transform(geom, {utm}), eps := {eps}, minpoints := {min_pts}) OVER () AS cluster_id,
+                                node_id,
+                                ST_Transform(geom, {utm}) AS transformed_geom,
+                                geom,
+                                tags,
+                                primitive_type
+                            FROM {table_view}
+                            WHERE
+                                {filters}
+                        )
+                        SELECT
+                            'cluster_' || {cluster_name} || cluster_id AS id,
+                            ST_Centroid(ST_Collect(geom)) AS geom,
+                            ARRAY_AGG(primitive_type || '/' || node_id::text) AS osm_ids,
+                            {set_id} AS set_id,
+                            {set_name} AS set_name,
+                            transformed_geom,
+                            tags,
+                            primitive_type
+                        FROM clusters
+                        WHERE cluster_id IS NOT NULL
+                        GROUP BY cluster_id, tags, primitive_type, transformed_geom"""
+    ).format(**params)
+
+
+def construct_grid_cluster_query(params):
+    """
+    Builds a clustering query that shrinks the DBSCAN input with a grid prefilter
+    and aggregates one row per cluster.
+
+    Steps:
+      - Filter rows (envelope + tags) once and transform their centroids to UTM.
+      - Bucket the points into a grid of `eps`-sized cells and sum the point
+        counts of every 5x5 cell neighbourhood.
+      - Drop points whose neighbourhood holds fewer than `minPoints` points: no
+        core point can lie within `eps` of them, so DBSCAN would label them
+        noise anyway.
+      - Run `ST_ClusterDBSCAN` on the remaining points only and aggregate per
+        cluster ID.
+
+    Args:
+        params (dict): SQL fragments shared by all strategies (see `cluster_params`).
+
+    Returns:
+        psycopg2.sql.Composed: The clustering query (without the CTE name).
+
+    Notes:
+        - Features are clustered by their centroids.
+        - `transformed_geom` is the collection of member centroids, so relations
+          match when any member satisfies them; `tags` and `primitive_type`
+          are taken from one member.
+    """
+    return sql.SQL(
+        """WITH points AS (
+                            SELECT
+                                node_id,
+                                primitive_type,
+                                geom,
+                                tags,
+                                transformed_geom,
+                                FLOOR(ST_X(transformed_geom) / {eps}) AS cell_x,
+                                FLOOR(ST_Y(transformed_geom) / {eps}) AS cell_y
+                            FROM (
                                 SELECT
-                                    ST_ClusterDBSCAN(ST_Transform(geom, {utm}), eps := {eps}, minpoints := {min_pts}) OVER () AS cluster_id,
                                     node_id,
-                                    ST_Transform(geom, {utm}) AS transformed_geom,
+                                    primitive_type,
                                     geom,
                                     tags,
-                                    primitive_type
+                                    ST_Centroid(ST_Transform(geom, {utm})) AS transformed_geom
                                 FROM {table_view}
                                 WHERE
                                     {filters}
-                            )
+                            ) AS filtered
+                        ),
+                        cells AS (
+                            SELECT cell_x, cell_y, COUNT(*) AS points
+                            FROM points
+                            GROUP BY cell_x, cell_y
+                        ),
+                        dense_cells AS (
+                            SELECT cells.cell_x + dx AS cell_x, cells.cell_y + dy AS cell_y
+                            FROM cells, generate_series(-2, 2) AS dx, generate_series(-2, 2) AS dy
+                            GROUP BY 1, 2
+                            HAVING SUM(cells.points) >= {min_pts}
+                        ),
+                        clusters AS (
                             SELECT
-                                'cluster_' || {cluster_name} || cluster_id AS id,
-                                ST_Centroid(ST_Collect(geom)) AS geom,
-                                ARRAY_AGG(primitive_type || '/' || node_id::text) AS osm_ids,
-                                {set_id} AS set_id,
-                                {set_name} AS set_name,
-                                transformed_geom,
-                                tags,
-                                primitive_type
-                            FROM clusters
-                            WHERE cluster_id IS NOT NULL
-                            GROUP BY cluster_id, tags, primitive_type, transformed_geom"""
-        ).format(
-            utm=sql.Literal(g.utm),
-            eps=sql.Literal(eps_in_meters),
-            min_pts=sql.Literal(min_points),
-            cluster_name=sql.Literal(cluster_name),
-            table_view=sql.Identifier(os.getenv("TABLE_VIEW")),
-            filters=filters,
-            set_id=sql.Literal(set_id),
-            set_name=sql.Literal(set_name),
-        )
-
-        cte = sql.SQL("{set_id} AS ({q})").format(
-            set_id=sql.Identifier(str(set_id)),
-            q=query,
-        )
-
-        return cte
-
-    except Exception as e:
-        print(f"An error occurred in cluster.py: {e}")
-        return None
+                                ST_ClusterDBSCAN(points.transformed_geom, eps := {eps}, minpoints := {min_pts}) OVER () AS cluster_id,
+                                points.*
+                            FROM points
+                            JOIN dense_cells USING (cell_x, cell_y)
+                        )
+                        SELECT
+                            'cluster_' || {cluster_name} || cluster_id AS id,
+                            ST_Centroid(ST_Collect(geom)) AS geom,
+                            ARRAY_AGG(primitive_type || '/' || node_id::text) AS osm_ids,
+                            {set_id} AS set_id,
+                            {set_name} AS set_name,
+                            ST_Collect(transformed_geom) AS transformed_geom,
+                            (ARRAY_AGG(tags))[1] AS tags,
+                            (ARRAY_AGG(primitive_type))[1] AS primitive_type
+                        FROM clusters
+                        WHERE cluster_id IS NOT NULL
+                        GROUP BY cluster_id"""
+    ).format(**params)
+
+
+def construct_python_cluster_query(params, table):
+    """
+    Reads the clusters computed in Python for a node.
+
+    The table is filled before the query runs (see
+    `lib.executors.python_cluster_tables`): the rows selected by
+    `construct_python_cluster_fetch_query` are clustered with
+    `lib.clustering.dbscan`, one row per cluster carrying its member OSM ids
+    and the collection of member centroids, so the relation stage consumes it
+    like any other node CTE.
+
+    Args:
+        params (dict): SQL fragments shared by all strategies (see `cluster_params`).
+        table (str): Name of the cluster table (see `cluster_table`).
+
+    Returns:
+        psycopg2.sql.Composed: The clustering query (without the CTE name).
+
+    Notes:
+        Features are clustered by their centroids, like the "grid" strategy.
+    """
+    return sql.SQL(
+        """SELECT
+                            'cluster_' || {cluster_name} || cluster_id AS id,
+                            ST_Transform(ST_Centroid(transformed_geom), 4326) AS geom,
+                            osm_ids,
+                            {set_id} AS set_id,
+                            {set_name} AS set_name,
+                            transformed_geom,
+                            tags,
+                            primitive_type
+                        FROM {table}"""
+    ).format(table=sql.Identifier(table), **params)
+
+
+def construct_python_cluster_fetch_query(node):
+    """
+    Selects the input of the in-process clustering of a node.
+
+    Args:
+        node (dict): Cluster node.
+
+    Returns:
+        psycopg2.sql.Composed: A query returning `osm_id`, `primitive_type`,
+        `tags` and the UTM centroid coordinates (`x`, `y`) of every filtered feature.
+    """
+    return sql.SQL(
+        """WITH {envelope}
+            SELECT
+                primitive_type || '/' || node_id::text AS osm_id,
+                primitive_type,
+                tags,
+                ST_X(transformed_geom),
+                ST_Y(transformed_geom)
+            FROM (
+                SELECT
+                    node_id,
+                    primitive_type,
+                    tags,
+                    ST_Centroid(ST_Transform(geom, {utm})) AS transformed_geom
+                FROM {table_view}
+                WHERE
+                    {filters}
+            ) AS filtered"""
+    ).format(envelope=construct_search_area_cte(g.area["type"]), **cluster_params(node))
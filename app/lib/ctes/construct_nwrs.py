@@ -1,10 +1,10 @@
 from psycopg2 import sql
-import os
 from flask import g
 from .construct_where_clause import construct_cte_where_clause
+from ..layers import route_to_layer, transformed_geometry
 
 
-def construct_nwr_cte(node):
+def construct_nwr_cte(node, source=None):
     """
     Constructs a SQL Common Table Expression (CTE) to select and transform
     Node/Way/Relation (NWR) data from an OSM-derived table based on given filters.
@@ -19,23 +19,32 @@ def construct_nwr_cte(node):
             - "id" (str or int): Identifier for the resulting dataset (used as CTE name and set_id).
             - "name" (str): Human-readable name of the set.
             - "filters" (list): A list of filter clauses used in the WHERE condition.
+        source (tuple | None): `(table, layer_key, residual_filters)` when the
+            node reads from a shared base CTE (see `plan_shared_bases`).
 
     Returns:
         psycopg2.sql.Composed: A SQL CTE expression for retrieving and filtering NWR features.
 
     Notes:
         - Uses the UTM projection zone from `flask.g.utm` to transform geometries.
-        - Reads the target table name from the `TABLE_VIEW` environment variable.
+        - Reads the target table name from the `TABLE_VIEW` environment variable,
+          or the precomputed layer covering the filters (see `lib.layers`).
     """
     set_id = node.get("id", 0)
     set_name = node.get("name", "name")
-    filters = construct_cte_where_clause(node.get("filters", []))
+
+    if source is not None:
+        table_view, layer_key, residual_filters = source
+        filters = construct_cte_where_clause(residual_filters, area_filter=False)
+    else:
+        filters = construct_cte_where_clause(node.get("filters", []))
+        table_view, layer_key = route_to_layer(node.get("filters", []))
 
     query = sql.SQL(
         """
         SELECT 
             {set_id} AS set_id,
-            ST_Transform(geom, {utm}) AS transformed_geom,
+            {transformed_geom} AS transformed_geom,
             geom,
             ARRAY[primitive_type || '/' || node_id] AS osm_ids,
             {set_id} AS set_id,
@@ -49,9 +58,9 @@ def construct_nwr_cte(node):
         """
     ).format(
         set_id=sql.Literal(str(set_id)),
-        utm=sql.Literal(g.utm),
+        transformed_geom=transformed_geometry(layer_key, g.utm),
         set_name=sql.Literal(set_name),
-        table_view=sql.Identifier(os.getenv("TABLE_VIEW")),
+        table_view=table_view,
         filters=filters
     )
 
@@ -0,0 +1,88 @@
+import json
+import os
+from psycopg2 import sql
+from .construct_where_clause import construct_cte_where_clause
+from ..layers import route_to_layer
+
+"""
+Shared base CTEs for filters common to several nodes.
+
+When several `nwr` nodes of a spot query have top-level filter conditions in
+common (e.g. two nodes filtering `building=*` plus different names), every
+node CTE would scan `TABLE_VIEW` on its own. `plan_shared_bases` groups such
+nodes and emits one `MATERIALIZED` base CTE per group, holding the rows within
+the envelope that satisfy the common conditions; the node CTEs then select
+from their base and only apply their remaining conditions.
+
+Groups are formed greedily: the condition shared by the most remaining nodes
+starts a group, which takes every node carrying it and the conditions all of
+them share. Sharing is enabled by default and can be turned off with
+`SHARE_NODE_FILTERS=false`. Cluster nodes are left alone (the "python"
+cluster strategy queries its input on its own).
+"""
+
+
+def _signature(filter):
+    return json.dumps(filter, sort_keys=True)
+
+
+def share_node_filters_enabled():
+    return os.getenv("SHARE_NODE_FILTERS", "true").lower() in ["true", "1", "yes"]
+
+
+def plan_shared_bases(nodes):
+    """Find groups of nodes with common top-level filter conditions.
+
+    Args:
+        nodes (list): Nodes of a cleaned spot query.
+
+    Returns:
+        tuple[list, dict]:
+            - The base CTEs (`psycopg2.sql.Composed`), to be placed after the
+              envelope CTE and before the node CTEs.
+            - For every node reading from a base, keyed by node id, a tuple
+              `(source, layer_key, residual_filters)` for `construct_cte`.
+    """
+    if not share_node_filters_enabled():
+        return [], {}
+
+    remaining = {
+        node["id"]: {_signature(f): f for f in node.get("filters", [])}
+        for node in nodes
+        if node.get("type") == "nwr" and node.get("filters")
+    }
+
+    bases = []
+    sources = {}
+
+    while True:
+        counts = {}
+        for conditions in remaining.values():
+            for signature in conditions:
+                counts[signature] = counts.get(signature, 0) + 1
+
+        shared = [signature for signature, count in counts.items() if count >= 2]
+        if not shared:
+            break
+
+        best = max(shared, key=lambda signature: (counts[signature], signature))
+        members = [id for id, conditions in remaining.items() if best in conditions]
+        common = set.intersection(*(set(remaining[id]) for id in members))
+
+        common_filters = [remaining[members[0]][signature] for signature in sorted(common)]
+        name = f"base_{len(bases) + 1}"
+        table_view, layer_key = route_to_layer(common_filters)
+
+        bases.append(
+            sql.SQL("{name} AS MATERIALIZED (SELECT * FROM {table_view} WHERE {filters})").format(
+                name=sql.Identifier(name),
+                table_view=table_view,
+                filters=construct_cte_where_clause(common_filters),
+            )
+        )
+
+        for id in members:
+            residual = [f for signature, f in remaining.pop(id).items() if signature not in common]
+            sources[id] = (sql.Identifier(name), layer_key, residual)
+
+    return bases, sources
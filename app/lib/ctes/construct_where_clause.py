@@ -3,7 +3,7 @@ from psycopg2 import sql
 
 from ..utils import distance_to_meters
 
-def construct_cte_where_clause(filters):
+def construct_cte_where_clause(filters, area_filter=True):
     """
     Constructs a SQL WHERE clause for filtering OSM features based on tag conditions
     and spatial intersection with the defined envelope.
@@ -12,6 +12,9 @@ def construct_cte_where_clause(filters):
         filters (list): A list of dictionaries representing filter conditions.
                         Each filter can use logical operators ("and", "or") or
                         direct key/operator/value conditions.
+        area_filter (bool): Whether to add the envelope filter. Disabled for
+                        nodes reading from a shared base CTE, which already
+                        applies it.
 
     Returns:
         psycopg2.sql.Composed: A composed SQL WHERE clause combining the envelope
@@ -19,9 +22,13 @@ def construct_cte_where_clause(filters):
 
     Notes:
         - Always adds a spatial envelope filter: `geom && (SELECT geom FROM envelope)`.
-        - Returns an empty string if no filters are provided.
+        - Returns an empty string if no filters are provided (`TRUE` without
+          the envelope filter).
     """
 
+    if not area_filter:
+        return sql.SQL(" AND ").join([construct_filter(f) for f in filters]) if filters else sql.SQL("TRUE")
+
     if not filters:
         return ""
 
@@ -69,9 +76,18 @@ def construct_filter(filter):
     Notes:
         - Converts distance units for numeric comparisons involving tags like "height".
         - Translates `***any***` value to `tags ? key` (tag presence).
+        - Compiles the internal `in` operator (a list of accepted values) to `IN`,
+          and the empty `and` / `or` groups to `TRUE` / `FALSE`.
         - Regex values are sanitized before being embedded in the query.
         - Supports numeric filtering with type casting.
     """
+    # Constant groups, as produced by `lib.filters.normalize_filters`
+    if filter.get("and") == []:
+        return sql.SQL("TRUE")
+
+    if filter.get("or") == []:
+        return sql.SQL("FALSE")
+
     if "and" in filter:
         return sql.SQL("({})").format(
             sql.SQL(" AND ").join([construct_filter(f) for f in filter["and"]])
@@ -92,7 +108,13 @@ def construct_filter(filter):
     if value == "***any***":
         return sql.SQL("tags ? {key}").format(key=sql.Literal(key))
 
-    if operator == "~":
+    if operator == "in":
+        sql_template = sql.SQL("tags->> {key} IN ({values})").format(
+            key=sql.Literal(key),
+            values=sql.SQL(", ").join(sql.Literal(v) for v in value)
+        )
+
+    elif operator == "~":
         value = sanitize_for_regex(value)
         sql_template = sql.SQL(
             "LOWER(REGEXP_REPLACE(tags->>{key}, '[^A-Za-z0-9]', '', 'g')) ~ LOWER({value})"
@@ -1,18 +1,30 @@
+import os
+import threading
+from contextlib import contextmanager
 import psycopg2
 import psycopg2.extras
 import psycopg2.pool
+import psycopg2.sql
 from flask import g
+from .admission import acquire_connection_slot, release_connection_slot
+from .cancellation import application_name
 
 """
 Database connection pool utilities using psycopg2 and Flask `g`.
 
 This module provides functions to:
-- Initialize a PostgreSQL threaded connection pool.
+- Initialize a PostgreSQL threaded connection pool, lazily on first use or
+  eagerly (with warm-up queries) when a worker starts.
 - Retrieve a connection from the pool (Flask request context).
-- Return the connection to the pool when the request ends.
+- Return the connection to the pool when the request ends, with its session
+  settings (statement timeout, request tag) reset.
+- Borrow extra connections for work spread over several backends.
+- Fetch PostGIS geometries (`ST_AsBinary`) as raw WKB bytes.
 """
 
 db_pool = None
+_db_pool_lock = threading.Lock()
+_database_config = None
 
 
 def initialize_connection_pool(database_config):
@@ -28,15 +40,16 @@ def initialize_connection_pool(database_config):
 
     Side Effects:
         Initializes a global `db_pool` with a `ThreadedConnectionPool`
-        (minconn=1, maxconn=10).
+        (`DB_POOL_MINCONN`, default 1, to `DB_POOL_MAXCONN`, default 10
+        connections).
 
     Raises:
         psycopg2.DatabaseError: If the connection fails during pool initialization.
     """
     global db_pool
     db_pool = psycopg2.pool.ThreadedConnectionPool(
-        minconn=1,
-        maxconn=10,
+        minconn=int(os.getenv("DB_POOL_MINCONN", 1)),
+        maxconn=int(os.getenv("DB_POOL_MAXCONN", 10)),
         user=database_config["user"],
         password=database_config["password"],
         host=database_config["host"],
@@ -45,17 +58,101 @@ def initialize_connection_pool(database_config):
     )
 
 
-def get_db():
+def configure_connection_pool(database_config):
+    """Remember the database configuration for lazy pool initialization.
+
+    No connection is opened here, so this is safe to call before gunicorn
+    forks its workers (`preload_app`); the pool is created in each worker by
+    `initialize_connection_pool` or on the first `get_db` call.
+
+    Args:
+        database_config (dict): See `initialize_connection_pool`.
+    """
+    global _database_config
+    _database_config = database_config
+
+
+def ensure_connection_pool():
+    """Create the connection pool if it does not exist yet (thread-safe)."""
+    if db_pool is None:
+        with _db_pool_lock:
+            if db_pool is None:
+                initialize_connection_pool(_database_config)
+
+
+def warm_up_connection_pool(table_view):
+    """Open the idle connections of the pool and prime them.
+
+    Every connection up to `DB_POOL_MINCONN` runs a trivial query and plans a
+    query on `table_view`, which loads the catalog entries of the table and
+    of PostGIS into the backend caches before the first user request.
+
+    Args:
+        table_view (str): Name of the OSM table or view queried by spot queries.
+    """
+    ensure_connection_pool()
+
+    with pooled_connections(int(os.getenv("DB_POOL_MINCONN", 1))) as connections:
+        for db in connections:
+            cursor = db.cursor()
+            cursor.execute("SELECT 1")
+            cursor.execute(
+                psycopg2.sql.SQL("EXPLAIN SELECT ST_Transform(geom, 3857) FROM {} LIMIT 1").format(
+                    psycopg2.sql.Identifier(table_view)
+                )
+            )
+            cursor.fetchall()
+
+
+def wkb_cursor(db):
+    """Open a cursor that returns `bytea` values as `bytes`.
+
+    Queries select geometries with `ST_AsBinary` (see `construct_relations`),
+    which PostgreSQL sends as `bytea`; psycopg2 unescapes them in C and, with
+    the `BYTES` typecaster registered on this cursor only, returns `bytes`
+    that `shapely.from_wkb` reads directly (instead of `memoryview`).
+
+    Args:
+        db (psycopg2.extensions.connection): Open database connection.
+
+    Returns:
+        psycopg2.extensions.cursor: The cursor.
+    """
+    cursor = db.cursor()
+    psycopg2.extensions.register_type(psycopg2.extensions.BYTES, cursor)
+    return cursor
+
+
+def get_db(deadline=None):
     """Retrieve a database connection from the connection pool.
 
     This function is designed for use within a Flask request context. The
     connection is stored in `flask.g` so that it's reused throughout the request.
 
+    The pool is created on first use if the worker did not initialize it. A
+    slot of the worker's connection budget is taken before the connection
+    leaves the pool (see `lib.admission`), and released by `close_db`.
+
+    Args:
+        deadline (float | None): Deadline of the caller on the
+            `time.monotonic()` clock, bounding the wait for a slot.
+
     Returns:
         psycopg2.extensions.connection: A connection object from the pool.
+
+    Raises:
+        QueryQueueTimeoutError: If no slot frees up within `INFLIGHT_QUEUE_TIMEOUT`.
+        QueryDeadlineExceededError: If the deadline passes while waiting.
+        psycopg2.pool.PoolError: If the pool has no connection left.
     """
     if "db" not in g:
-        g.db = db_pool.getconn()
+        ensure_connection_pool()
+        acquire_connection_slot(deadline=deadline)
+        try:
+            g.db = db_pool.getconn()
+        except Exception:
+            release_connection_slot()
+            raise
     return g.db
 
 
@@ -67,9 +164,89 @@ def close_db(e=None):
         if the request encountered an error. It is unused here.
 
     Side Effects:
-        Removes the connection from `flask.g` and returns it to the pool
-        using `db_pool.putconn()`.
+        Removes the connection from `flask.g`, returns it to the pool
+        (see `return_connection`) and releases its connection slot.
     """
     db = g.pop("db", None)
     if db is not None:
+        try:
+            return_connection(db)
+        finally:
+            release_connection_slot()
+
+
+def return_connection(db):
+    """Hand a connection back to the pool in a clean state.
+
+    The open transaction is rolled back and the session settings of the
+    request (`statement_timeout` and `application_name`, see
+    `apply_statement_timeout`) are reset, so that the next request does not
+    inherit its timeout and cannot be canceled under its request id. A
+    connection that fails to reset is closed instead.
+
+    Args:
+        db (psycopg2.extensions.connection): A connection taken from `db_pool`.
+    """
+    try:
+        db.rollback()
+        db.cursor().execute("RESET ALL")
+        db.commit()
         db_pool.putconn(db)
+    except psycopg2.Error:
+        db_pool.putconn(db, close=True)
+
+
+@contextmanager
+def pooled_connections(count):
+    """Borrow up to `count` additional connections from the pool.
+
+    Connections are taken while the worker's connection budget (see
+    `lib.admission`) has a free slot and the pool has some left, without
+    waiting, so fewer than `count` (possibly none) may be returned. On exit,
+    every connection is handed back to the pool (`return_connection`) and its
+    slot is released.
+
+    Args:
+        count (int): Maximum number of connections to borrow.
+
+    Yields:
+        list[psycopg2.extensions.connection]: The borrowed connections.
+    """
+    connections = []
+    try:
+        while len(connections) < count and acquire_connection_slot(blocking=False):
+            try:
+                connections.append(db_pool.getconn())
+            except psycopg2.pool.PoolError:
+                release_connection_slot()
+                break
+        yield connections
+    finally:
+        for db in connections:
+            try:
+                return_connection(db)
+            finally:
+                release_connection_slot()
+
+
+def apply_statement_timeout(db, timeout=None):
+    """Set the PostgreSQL `statement_timeout` for the given connection.
+
+    The connection is also tagged with the request id (`application_name`, see
+    `lib.cancellation`), so that the request can be canceled from any worker.
+    Both settings last until the connection goes back to the pool, where they
+    are reset (`return_connection`).
+
+    Args:
+        db (psycopg2.extensions.connection): Open database connection.
+        timeout (int | None): Timeout in milliseconds. Defaults to the `TIMEOUT`
+            environment variable (20000 if unset).
+    """
+    if timeout is None:
+        timeout = int(os.getenv("TIMEOUT", 20000))
+
+    cursor = db.cursor()
+    cursor.execute(
+        "SET statement_timeout = %s; SET application_name = %s", (timeout, application_name())
+    )
+    db.commit()
@@ -0,0 +1,434 @@
+import os
+import queue
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import shapely
+from flask import g
+from psycopg2 import sql
+from psycopg2.extras import Json, execute_values
+
+from .cancellation import cancellable
+from .clustering import dbscan
+from .constructor import construct_node_query, construct_query_from_tables
+from .database import apply_statement_timeout, pooled_connections, wkb_cursor
+from .ctes.construct_cluster import (
+    cluster_strategy,
+    cluster_table,
+    construct_python_cluster_fetch_query,
+)
+from .timer import stage
+from .utils import distance_to_meters
+
+"""
+Execution strategies for spot queries.
+
+- "sql": runs the full `WITH ... SELECT` query from `construct_query_from_graph`
+  and lets PostgreSQL evaluate the spatial joins.
+- "hybrid": fetches the filtered rows of every node separately (see
+  `construct_node_query`) and evaluates the `distance` / `contains` edges
+  in-process with `shapely.STRtree` on the projected geometries, producing the
+  same rows as the SQL path.
+- "prefetch": runs every node's filter query concurrently on its own pooled
+  connection (up to `PREFETCH_WORKERS`) into an unlogged table, indexes it,
+  and runs the relations of `construct_relations` over those tables.
+- "auto": picks "hybrid" when the planner estimates every node to be small
+  (`HYBRID_MAX_ROWS`) and the query has edges, "prefetch" for queries with at
+  least `PREFETCH_MIN_NODES` nodes, "sql" otherwise.
+
+The default comes from the `EXECUTOR` environment variable ("sql").
+
+With `CLUSTER_STRATEGY=python`, the clusters are computed once per query by
+`python_cluster_tables`, before any executor (or `EXPLAIN`) reads them.
+"""
+
+EXECUTORS = ("sql", "hybrid", "prefetch", "auto")
+
+# Prefix of the unlogged tables created by the "prefetch" executor. They are
+# dropped after every query; leftovers (e.g. after a crash) can be removed safely.
+PREFETCH_TABLE_PREFIX = "spot_prefetch_"
+
+# Columns of the rows returned by every executor, matching `construct_relations`
+RESULT_COLUMNS = ["set_name", "osm_ids", "geom", "tags", "primitive_type", "primary_osm_ids"]
+
+
+@contextmanager
+def python_cluster_tables(db, spot_query):
+    """Compute the clusters of the "python" cluster strategy for a query.
+
+    For every cluster node, the filtered features are fetched on `db`
+    (`construct_python_cluster_fetch_query`), clustered with
+    `lib.clustering.dbscan` and loaded into the unlogged table the node CTE
+    reads (`cluster_table`). The tables are committed, so that the pooled
+    connections of the "prefetch" executor see them, and dropped on exit.
+    Without cluster nodes or with another strategy, this is a no-op.
+
+    Args:
+        db (psycopg2.extensions.connection): Request connection.
+        spot_query (dict): Cleaned spot query (with `g.area` / `g.utm` set).
+
+    Raises:
+        ValueError, psycopg2 errors: Handled by the calling route.
+    """
+    nodes = [node for node in spot_query["nodes"] if node.get("type") == "cluster"]
+    if not nodes or cluster_strategy() != "python":
+        yield
+        return
+
+    cursor = db.cursor()
+    tables = []
+
+    try:
+        with stage("clusters"):
+            for node in nodes:
+                cursor.execute(construct_python_cluster_fetch_query(node))
+                rows = cursor.fetchall()
+
+                coords = np.array([row[3:5] for row in rows], dtype=float).reshape(-1, 2)
+                eps = float(distance_to_meters(node.get("maxDistance", "50")))
+                labels = dbscan(coords, eps, node.get("minPoints", 2))
+
+                members = {}
+                for row_index, label in enumerate(labels.tolist()):
+                    if label >= 0:
+                        members.setdefault(label, []).append(row_index)
+
+                table = sql.Identifier(cluster_table(node))
+                cursor.execute(
+                    sql.SQL(
+                        "CREATE UNLOGGED TABLE {table} "
+                        "(cluster_id integer, osm_ids text[], tags jsonb, primitive_type text, transformed_geom geometry)"
+                    ).format(table=table)
+                )
+                tables.append(table)
+
+                execute_values(
+                    cursor,
+                    sql.SQL("INSERT INTO {table} VALUES %s").format(table=table).as_string(cursor),
+                    [
+                        (
+                            label,
+                            [rows[index][0] for index in indexes],
+                            Json(rows[indexes[0]][2]) if rows[indexes[0]][2] is not None else None,
+                            rows[indexes[0]][1],
+                            shapely.to_wkb(shapely.multipoints(coords[indexes])),
+                        )
+                        for label, indexes in sorted(members.items())
+                    ],
+                    template=sql.SQL("(%s, %s, %s, %s, ST_GeomFromWKB(%s, {utm}))")
+                    .format(utm=sql.Literal(g.utm))
+                    .as_string(cursor),
+                )
+            db.commit()
+
+        yield
+
+    finally:
+        if tables:
+            db.rollback()
+            cursor.execute(sql.SQL("DROP TABLE IF EXISTS {tables}").format(tables=sql.SQL(", ").join(tables)))
+            db.commit()
+
+
+def choose_executor(db, spot_query, requested=None):
+    """Resolve the executor to use for a spot query.
+
+    Args:
+        db (psycopg2.extensions.connection): Open database connection.
+        spot_query (dict): Cleaned spot query (with `g.area` / `g.utm` set).
+        requested (str | None): Executor requested by the client; defaults to
+            the `EXECUTOR` environment variable.
+
+    Returns:
+        str: "sql", "hybrid" or "prefetch".
+
+    Raises:
+        ValueError: If the requested executor is unknown.
+    """
+    executor = requested or os.getenv("EXECUTOR", "sql")
+
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unknown executor: {executor}")
+
+    if executor != "auto":
+        return executor
+
+    nodes = spot_query["nodes"]
+    fallback = "prefetch" if len(nodes) >= int(os.getenv("PREFETCH_MIN_NODES", 4)) else "sql"
+
+    if not spot_query.get("edges"):
+        return fallback
+
+    max_rows = int(os.getenv("HYBRID_MAX_ROWS", 20000))
+    cursor = db.cursor()
+
+    for node in nodes:
+        cursor.execute(b"EXPLAIN (FORMAT JSON) " + construct_node_query(node).as_bytes(cursor))
+        if cursor.fetchone()[0][0]["Plan"]["Plan Rows"] > max_rows:
+            return fallback
+
+    return "hybrid"
+
+
+def execute_sql(db, query):
+    """Execute the full spot query in PostgreSQL.
+
+    Args:
+        db (psycopg2.extensions.connection): Open database connection.
+        query (psycopg2.sql.Composed): Output of `construct_query_from_graph`.
+
+    Returns:
+        tuple[list[str], list[tuple]]: Column names and result rows.
+    """
+    cursor = wkb_cursor(db)
+    with stage("query"):
+        cursor.execute(query)
+    columns = [column.name for column in cursor.description]
+    with stage("fetch"):
+        return columns, cursor.fetchall()
+
+
+def _join_plan(spot_query):
+    """Mirror the JOIN structure built by `construct_relations`.
+
+    Returns:
+        tuple[list[str], dict[str, list[tuple]]]: Names of the nodes taking part
+        in relations, and for every joined target node (in join order) its
+        conditions as `(source_name, type, distance_in_meters)`.
+    """
+    id_to_name = {node["id"]: node["name"] for node in spot_query["nodes"]}
+    referenced_nodes = set()
+    join_conditions = {}
+
+    for edge in spot_query.get("edges", []):
+        if edge["source"] == edge["target"]:
+            raise ValueError("selfReferencingEdge")
+
+        source_name = id_to_name[edge["source"]]
+        target_name = id_to_name[edge["target"]]
+        referenced_nodes.update([source_name, target_name])
+
+        distance = float(distance_to_meters(edge["value"])) if edge["type"] == "distance" else None
+        join_conditions.setdefault(target_name, []).append((source_name, edge["type"], distance))
+
+    return referenced_nodes, join_conditions
+
+
+def _expand(left, pairs_input, pairs_tree, unique_count):
+    """Expand tuple rows with the tree matches of their (deduplicated) inputs.
+
+    Args:
+        left (numpy.ndarray): For every tuple row, the index of its input in the
+            deduplicated query array.
+        pairs_input (numpy.ndarray): Input indexes of the matches (sorted).
+        pairs_tree (numpy.ndarray): Tree indexes of the matches.
+        unique_count (int): Length of the deduplicated query array.
+
+    Returns:
+        tuple[numpy.ndarray, numpy.ndarray]: Tuple row index and matched tree
+        index for every output row.
+    """
+    counts = np.bincount(pairs_input, minlength=unique_count)
+    starts = np.cumsum(counts) - counts
+
+    repeats = counts[left]
+    tuple_rows = np.repeat(np.arange(len(left)), repeats)
+    offsets = np.arange(len(tuple_rows)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+
+    return tuple_rows, pairs_tree[starts[left][tuple_rows] + offsets]
+
+
+def _matches(type, source_geoms, target_geoms, distance):
+    if type == "distance":
+        return shapely.dwithin(source_geoms, target_geoms, distance)
+    return shapely.intersects(source_geoms, target_geoms)
+
+
+def execute_hybrid(db, spot_query):
+    """Execute a spot query by evaluating its relations in-process.
+
+    Every node's filtered rows are fetched with `construct_node_query`. Starting
+    from the first node, each joined node is matched with an STRtree query
+    (`dwithin` for distance edges, `intersects` for contains edges) on the
+    projected geometries; further conditions on the same node are checked
+    vectorized. The resulting tuples are turned into the rows the SQL path
+    returns, deduplicated the same way.
+
+    Args:
+        db (psycopg2.extensions.connection): Open database connection.
+        spot_query (dict): Cleaned spot query (with `g.area` / `g.utm` set).
+
+    Returns:
+        tuple[list[str], list[tuple]]: Column names (`RESULT_COLUMNS`) and rows.
+
+    Raises:
+        ValueError: If a relation references a node that is not joined before it,
+            or targets an already joined node (the SQL path cannot run such
+            graphs either).
+    """
+    nodes = spot_query["nodes"]
+    referenced_nodes, join_conditions = _join_plan(spot_query)
+    cursor = wkb_cursor(db)
+
+    node_rows = {}
+    node_geoms = {}
+    for node in nodes:
+        cursor.execute(construct_node_query(node, binary_geometry=True))
+        rows = cursor.fetchall()
+        node_rows[node["name"]] = rows
+        node_geoms[node["name"]] = shapely.from_wkb([row[4] for row in rows])
+
+    first_name = nodes[0]["name"]
+    bound = {first_name: np.arange(len(node_rows[first_name]))}
+
+    for target_name, conditions in join_conditions.items():
+        source_name, type, distance = conditions[0]
+        if source_name not in bound or target_name in bound:
+            raise ValueError("edgeSourceNotJoined")
+
+        unique_left, left = np.unique(bound[source_name], return_inverse=True)
+        tree = shapely.STRtree(node_geoms[target_name])
+        pairs = tree.query(
+            node_geoms[source_name][unique_left],
+            predicate="dwithin" if type == "distance" else "intersects",
+            distance=distance,
+        )
+        order = np.argsort(pairs[0], kind="stable")
+        tuple_rows, target_rows = _expand(left, pairs[0][order], pairs[1][order], len(unique_left))
+
+        bound = {name: indexes[tuple_rows] for name, indexes in bound.items()}
+        bound[target_name] = target_rows
+
+        for source_name, type, distance in conditions[1:]:
+            if source_name not in bound:
+                raise ValueError("edgeSourceNotJoined")
+
+            mask = _matches(
+                type,
+                node_geoms[source_name][bound[source_name]],
+                node_geoms[target_name][bound[target_name]],
+                distance,
+            )
+            bound = {name: indexes[mask] for name, indexes in bound.items()}
+
+    first_osm_ids = [",".join(row[0]) for row in node_rows[first_name]]
+    results = []
+
+    for node in nodes:
+        name = node["name"]
+        rows = node_rows[name]
+
+        if name not in referenced_nodes:
+            results.extend((name, row[0], row[1], row[2], row[3], None) for row in rows)
+            continue
+
+        if name not in bound:
+            raise ValueError("edgeSourceNotJoined")
+
+        primaries = {}
+        for row_index, primary_index in set(zip(bound[name].tolist(), bound[first_name].tolist())):
+            primaries.setdefault(row_index, set()).add(first_osm_ids[primary_index])
+
+        for row_index in sorted(primaries):
+            row = rows[row_index]
+            results.append((name, row[0], row[1], row[2], row[3], sorted(primaries[row_index])))
+
+    return list(RESULT_COLUMNS), results
+
+
+def _prefetch_worker(db, statements, failed):
+    """Run queued node statements on one connection until the queue is empty."""
+    cursor = db.cursor()
+
+    while not failed.is_set():
+        try:
+            node_statements = statements.get_nowait()
+        except queue.Empty:
+            return
+
+        try:
+            for statement in node_statements:
+                cursor.execute(statement)
+            db.commit()
+        except Exception:
+            failed.set()
+            raise
+
+
+def execute_prefetch(db, spot_query, timeout=None):
+    """Execute a spot query with the node filters evaluated concurrently.
+
+    PostgreSQL evaluates all CTEs of one query on a single backend. Here every
+    node's filter query (`construct_node_query`) is materialized into its own
+    unlogged table instead, with a GiST index on `transformed_geom` and fresh
+    statistics; the statements are spread over the request connection and up
+    to `PREFETCH_WORKERS` - 1 connections borrowed from the pool. Borrowing
+    never waits: only connections with a free slot in the worker's connection
+    budget are taken (see `pooled_connections`), and without any the
+    statements run one after the other on the request connection. The
+    relation query then reads the node tables
+    (`construct_query_from_tables`) on the request connection, and the tables
+    are dropped.
+
+    Args:
+        db (psycopg2.extensions.connection): Request connection.
+        spot_query (dict): Cleaned spot query (with `g.area` / `g.utm` set).
+        timeout (int | None): Statement timeout of the borrowed connections in
+            milliseconds, e.g. what is left of a batch deadline; defaults to
+            `TIMEOUT` (see `apply_statement_timeout`).
+
+    Returns:
+        tuple[list[str], list[tuple]]: Column names and result rows.
+    """
+    nodes = spot_query["nodes"]
+    cursor = db.cursor()
+    run_id = uuid.uuid4().hex[:16]
+    tables = {node["id"]: f"{PREFETCH_TABLE_PREFIX}{run_id}_{index}" for index, node in enumerate(nodes)}
+
+    # Statements are composed here, in the request context (node CTEs read `g`)
+    statements = queue.SimpleQueue()
+    for node in nodes:
+        table = sql.Identifier(tables[node["id"]])
+        statements.put(
+            [
+                sql.SQL("CREATE UNLOGGED TABLE {table} AS {query}")
+                .format(table=table, query=construct_node_query(node))
+                .as_bytes(cursor),
+                sql.SQL("CREATE INDEX ON {table} USING GIST (transformed_geom)").format(table=table).as_bytes(cursor),
+                sql.SQL("ANALYZE {table}").format(table=table).as_bytes(cursor),
+            ]
+        )
+
+    workers = min(len(nodes), int(os.getenv("PREFETCH_WORKERS", 4)))
+    failed = threading.Event()
+
+    try:
+        with pooled_connections(workers - 1) as borrowed:
+            if not borrowed:
+                # No connection to spare: prefetch sequentially on the request connection
+                _prefetch_worker(db, statements, failed)
+            else:
+                for connection in borrowed:
+                    apply_statement_timeout(connection, timeout)
+
+                with cancellable(*borrowed), ThreadPoolExecutor(max_workers=len(borrowed) + 1) as executor:
+                    futures = [
+                        executor.submit(_prefetch_worker, connection, statements, failed)
+                        for connection in [db, *borrowed]
+                    ]
+                    for future in futures:
+                        future.result()
+
+        return execute_sql(db, construct_query_from_tables(spot_query, tables))
+
+    finally:
+        db.rollback()
+        cursor.execute(
+            sql.SQL("DROP TABLE IF EXISTS {tables}").format(
+                tables=sql.SQL(", ").join(sql.Identifier(table) for table in tables.values())
+            )
+        )
+        db.commit()
@@ -0,0 +1,246 @@
+import json
+
+from .utils import distance_to_meters
+
+"""
+Normalization of node filter trees before SQL generation.
+
+`normalize_filters` rewrites the `and`/`or` filter tree of a node into an
+equivalent, simpler one:
+
+- nested groups of the same kind are flattened and single-member groups are
+  replaced by their member,
+- duplicate conditions are removed,
+- `=` conditions on the same key inside an `or` are folded into one internal
+  `in` condition (`{"key": k, "operator": "in", "value": [v1, v2, ...]}`),
+- a presence condition (`"***any***"`) inside an `and` is dropped when another
+  condition on the same key already requires the tag, and inside an `or` it
+  absorbs the other conditions on its key,
+- contradictions (two different values for one key, an empty range for a
+  numeric comparison) make the group always false,
+- conditions are ordered cheapest first (presence, equality, lists, numeric
+  comparisons, regular expressions, groups).
+
+An always-true group is represented as `{"and": []}` and an always-false one
+as `{"or": []}`; `construct_filter` compiles them to `TRUE` and `FALSE`.
+Dimension keys (`height`, `width`, `length`) have their values converted to
+meters when compiled, so their conditions are only deduplicated and ordered.
+"""
+
+TRUE = {"and": []}
+FALSE = {"or": []}
+
+ANY_VALUE = "***any***"
+
+# Keys whose values are converted to meters by `construct_filter`
+DIMENSION_KEYS = ("height", "width", "length")
+
+_OPERATOR_COSTS = {"=": 1, "in": 2, ">": 3, "<": 3, "~": 4}
+
+
+def _is_presence(filter):
+    return filter.get("value") == ANY_VALUE and filter.get("key") not in DIMENSION_KEYS
+
+
+def _is_equality(filter):
+    """Whether a condition is a plain (string) equality or list membership."""
+    if filter.get("key") in DIMENSION_KEYS or _is_presence(filter):
+        return False
+    return filter.get("operator") in ("=", "in")
+
+
+def _values(filter):
+    """Set of values accepted by an equality or list condition."""
+    if filter["operator"] == "in":
+        return set(filter["value"])
+    return {filter["value"]}
+
+
+def _equality(key, values):
+    values = sorted(values)
+    if len(values) == 1:
+        return {"key": key, "operator": "=", "value": values[0]}
+    return {"key": key, "operator": "in", "value": values}
+
+
+def _number(value):
+    try:
+        return float(distance_to_meters(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _cost(filter):
+    if "and" in filter or "or" in filter:
+        return 5
+    if _is_presence(filter):
+        return 0
+    return _OPERATOR_COSTS.get(filter.get("operator"), 1)
+
+
+def _signature(filter):
+    """Canonical representation used to deduplicate and order conditions."""
+    if "and" in filter or "or" in filter:
+        return json.dumps(filter, sort_keys=True)
+    return json.dumps([filter.get("key"), filter.get("operator"), filter.get("value")])
+
+
+def _dedupe_and_sort(filters):
+    unique = {}
+    for filter in filters:
+        unique.setdefault(_signature(filter), filter)
+    return sorted(unique.values(), key=lambda filter: (_cost(filter), _signature(filter)))
+
+
+def _group(kind, filters):
+    if len(filters) == 1:
+        return filters[0]
+    return {kind: _dedupe_and_sort(filters)}
+
+
+def _flatten(kind, filters):
+    flat = []
+    for filter in filters:
+        if kind in filter:
+            flat.extend(filter[kind])
+        else:
+            flat.append(filter)
+    return flat
+
+
+def _simplify_and(filters):
+    if FALSE in filters:
+        return FALSE
+    filters = [filter for filter in filters if filter != TRUE]
+
+    # Intersect the accepted values of every key with equality conditions
+    allowed = {}
+    for filter in filters:
+        if _is_equality(filter):
+            key = filter["key"]
+            allowed[key] = allowed[key] & _values(filter) if key in allowed else _values(filter)
+
+    if any(not values for values in allowed.values()):
+        return FALSE
+
+    # Numeric comparisons on one key must leave a non-empty range
+    lower, upper = {}, {}
+    for filter in filters:
+        if "key" in filter and filter.get("operator") in (">", "<"):
+            number = _number(filter.get("value"))
+            if number is None:
+                continue
+            bounds, pick = (lower, max) if filter["operator"] == ">" else (upper, min)
+            key = filter["key"]
+            bounds[key] = pick(bounds[key], number) if key in bounds else number
+
+    if any(key in upper and upper[key] <= lower[key] for key in lower):
+        return FALSE
+
+    required = {filter["key"] for filter in filters if "key" in filter and not _is_presence(filter)}
+    simplified = [_equality(key, values) for key, values in allowed.items()]
+
+    for filter in filters:
+        if _is_equality(filter):
+            continue
+        if _is_presence(filter) and filter["key"] in required:
+            continue
+        simplified.append(filter)
+
+    return _group("and", simplified) if simplified else TRUE
+
+
+def _simplify_or(filters):
+    if TRUE in filters:
+        return TRUE
+    filters = [filter for filter in filters if filter != FALSE]
+
+    present = {filter["key"] for filter in filters if "key" in filter and _is_presence(filter)}
+
+    accepted = {}
+    simplified = []
+    for filter in filters:
+        if "key" in filter and filter["key"] in present and not _is_presence(filter):
+            continue
+        if _is_equality(filter):
+            accepted.setdefault(filter["key"], set()).update(_values(filter))
+            continue
+        simplified.append(filter)
+
+    simplified.extend(_equality(key, values) for key, values in accepted.items())
+
+    return _group("or", simplified) if simplified else FALSE
+
+
+def normalize_filter(filter):
+    """Normalize a single filter node (condition or group).
+
+    Args:
+        filter (dict): A condition or an `and` / `or` group.
+
+    Returns:
+        dict: An equivalent, normalized filter node; `TRUE` / `FALSE` for
+        constant groups.
+    """
+    if "and" in filter:
+        members = [normalize_filter(member) for member in filter["and"]]
+        return _simplify_and(_flatten("and", members))
+
+    if "or" in filter:
+        members = [normalize_filter(member) for member in filter["or"]]
+        return _simplify_or(_flatten("or", members))
+
+    return filter
+
+
+def normalize_filters(filters):
+    """Normalize the filter list of a node.
+
+    Args:
+        filters (list): Node filters (an implicit `and` of its items).
+
+    Returns:
+        list: Equivalent filters. `[FALSE]` when the node can never match,
+        `[TRUE]` when it matches everything.
+    """
+    normalized = normalize_filter({"and": filters})
+
+    if "and" in normalized and normalized["and"]:
+        return normalized["and"]
+    return [normalized]
+
+
+def is_always_false(filters):
+    """Whether a normalized filter list can never match."""
+    return filters == [FALSE]
+
+
+def spot_query_is_empty(spot_query):
+    """Check whether a normalized spot query can only return no rows.
+
+    Isolated nodes are returned as they are, and the rows of related nodes all
+    come from one join of the first node with every edge target
+    (see `construct_relations`): the query is empty when every isolated node
+    is empty and, if there are edges, one of the joined nodes is.
+
+    Args:
+        spot_query (dict): A cleaned spot query.
+
+    Returns:
+        bool: True if the query is guaranteed to return no rows.
+    """
+    nodes = spot_query["nodes"]
+    edges = spot_query.get("edges", [])
+    empty = {node["id"] for node in nodes if is_always_false(node.get("filters", []))}
+
+    referenced = {edge["source"] for edge in edges} | {edge["target"] for edge in edges}
+    isolated = [node["id"] for node in nodes if node["id"] not in referenced]
+
+    if any(id not in empty for id in isolated):
+        return False
+
+    if not edges:
+        return True
+
+    joined = {nodes[0]["id"]} | {edge["target"] for edge in edges}
+    return bool(joined & empty)
@@ -0,0 +1,198 @@
+import argparse
+import os
+import psycopg2
+from psycopg2 import sql
+
+"""
+Precomputed layers for frequent tag filters.
+
+A layer is a materialized view holding the rows of `TABLE_VIEW` that carry a
+given tag key (e.g. every feature with an `amenity` tag), with a GiST index on
+its geometry and, for every SRID listed in `LAYER_SRIDS`, a pre-transformed
+and indexed `geom_<srid>` column.
+
+Layers are enabled with the `LAYERS` environment variable (comma-separated tag
+keys, e.g. `amenity,building,shop,highway,name`). When a node's filters can
+only match features carrying one of these keys (see `filters_require_key`),
+its CTE reads the layer instead of `TABLE_VIEW`; the node's own filters are
+still applied, so results are unchanged. Layers are checked in the order
+listed, so the most selective ones should come first.
+
+The views are managed from the command line, and must be refreshed whenever
+the OSM import is updated:
+
+    python -m lib.layers create [--keys amenity shop]
+    python -m lib.layers refresh
+    python -m lib.layers drop
+"""
+
+DEFAULT_LAYER_KEYS = ["amenity", "building", "shop", "highway", "name"]
+
+
+def layer_keys():
+    """Tag keys of the enabled layers, in routing order (`LAYERS`)."""
+    return [key.strip() for key in os.getenv("LAYERS", "").split(",") if key.strip()]
+
+
+def layer_srids():
+    """SRIDs with a pre-transformed geometry column in every layer (`LAYER_SRIDS`)."""
+    return [int(srid) for srid in os.getenv("LAYER_SRIDS", "").split(",") if srid.strip()]
+
+
+def layer_name(key):
+    """Name of the materialized view of the layer for `key`."""
+    return f"{os.getenv('TABLE_VIEW')}_layer_{key}"
+
+
+def filters_require_key(filters, key):
+    """Check whether a filter tree can only match features carrying `key`.
+
+    Every leaf condition on `key` (whatever its operator) requires the tag to
+    be present. An "and" group requires the key when any of its members does,
+    an "or" group when all of its members do. The top-level filter list is a
+    conjunction.
+
+    Args:
+        filters (list): Node filters, as in the spot query.
+        key (str): Tag key.
+
+    Returns:
+        bool: True if every matching feature has the `key` tag.
+    """
+
+    def requires(filter):
+        if "and" in filter:
+            return any(requires(f) for f in filter["and"])
+        if "or" in filter:
+            return bool(filter["or"]) and all(requires(f) for f in filter["or"])
+        return filter.get("key") == key
+
+    return any(requires(f) for f in filters)
+
+
+def route_to_layer(filters):
+    """Pick the table a node with these filters should read.
+
+    Args:
+        filters (list): Node filters.
+
+    Returns:
+        tuple[psycopg2.sql.Identifier, str | None]: The table to read (a layer
+        or `TABLE_VIEW`) and the key of the matched layer (`None` when the
+        node reads `TABLE_VIEW`), to be passed to `transformed_geometry`.
+    """
+    for key in layer_keys():
+        if filters and filters_require_key(filters, key):
+            return sql.Identifier(layer_name(key)), key
+
+    return sql.Identifier(os.getenv("TABLE_VIEW")), None
+
+
+def transformed_geometry(layer_key, utm):
+    """SQL expression of the geometry projected to `utm`.
+
+    Uses the layer's pre-transformed column when one exists for this SRID.
+
+    Args:
+        layer_key (str | None): Key of the routed layer (`route_to_layer`).
+        utm (int | str): Target SRID.
+
+    Returns:
+        psycopg2.sql.Composable: The geometry expression.
+    """
+    if layer_key is not None and int(utm) in layer_srids():
+        return sql.Identifier(f"geom_{int(utm)}")
+
+    return sql.SQL("ST_Transform(geom, {utm})").format(utm=sql.Literal(utm))
+
+
+def create_layer(cursor, key, srids):
+    """Create (or recreate) the materialized view and indexes of one layer."""
+    name = layer_name(key)
+    transformed = [
+        sql.SQL("ST_Transform(geom, {srid}) AS {column}").format(
+            srid=sql.Literal(srid), column=sql.Identifier(f"geom_{srid}")
+        )
+        for srid in srids
+    ]
+
+    cursor.execute(sql.SQL("DROP MATERIALIZED VIEW IF EXISTS {}").format(sql.Identifier(name)))
+    cursor.execute(
+        sql.SQL(
+            """
+            CREATE MATERIALIZED VIEW {name} AS
+            SELECT node_id, primitive_type, geom, tags{transformed}
+            FROM {table_view}
+            WHERE tags ? {key}
+            """
+        ).format(
+            name=sql.Identifier(name),
+            transformed=sql.SQL("").join(sql.SQL(", ") + column for column in transformed),
+            table_view=sql.Identifier(os.getenv("TABLE_VIEW")),
+            key=sql.Literal(key),
+        )
+    )
+
+    # The unique index allows `REFRESH MATERIALIZED VIEW CONCURRENTLY`
+    cursor.execute(
+        sql.SQL("CREATE UNIQUE INDEX ON {} (primitive_type, node_id)").format(sql.Identifier(name))
+    )
+    for column in ["geom"] + [f"geom_{srid}" for srid in srids]:
+        cursor.execute(
+            sql.SQL("CREATE INDEX ON {} USING GIST ({})").format(sql.Identifier(name), sql.Identifier(column))
+        )
+    cursor.execute(sql.SQL("CREATE INDEX ON {} USING GIN (tags)").format(sql.Identifier(name)))
+    cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(name)))
+
+
+def refresh_layer(cursor, key):
+    """Refresh one layer without blocking readers."""
+    name = sql.Identifier(layer_name(key))
+    cursor.execute(sql.SQL("REFRESH MATERIALIZED VIEW CONCURRENTLY {}").format(name))
+    cursor.execute(sql.SQL("ANALYZE {}").format(name))
+
+
+def drop_layer(cursor, key):
+    cursor.execute(sql.SQL("DROP MATERIALIZED VIEW IF EXISTS {}").format(sql.Identifier(layer_name(key))))
+
+
+def main():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Manage the precomputed tag layers.")
+    parser.add_argument("command", choices=["create", "refresh", "drop"])
+    parser.add_argument(
+        "--keys",
+        nargs="+",
+        help="Tag keys of the layers (default: LAYERS, or %s)" % ",".join(DEFAULT_LAYER_KEYS),
+    )
+    args = parser.parse_args()
+
+    keys = args.keys or layer_keys() or DEFAULT_LAYER_KEYS
+    db = psycopg2.connect(
+        dbname=os.getenv("DATABASE_NAME"),
+        user=os.getenv("DATABASE_USER"),
+        password=os.getenv("DATABASE_PASSWORD"),
+        host=os.getenv("DATABASE_HOST"),
+        port=os.getenv("DATABASE_PORT"),
+    )
+    # CONCURRENTLY refreshes cannot run inside a transaction block
+    db.autocommit = True
+    cursor = db.cursor()
+
+    for key in keys:
+        if args.command == "create":
+            create_layer(cursor, key, layer_srids())
+        elif args.command == "refresh":
+            refresh_layer(cursor, key)
+        else:
+            drop_layer(cursor, key)
+        print(f"{args.command}: {layer_name(key)}")
+
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import os
+import threading
+import time
+from collections import Counter
+
+"""
+In-process counters exposed by the `/metrics` endpoint.
+
+Counters are kept per worker process (gunicorn workers do not share memory);
+every snapshot carries the worker pid and uptime so that scrapers can tell
+workers apart and detect restarts.
+"""
+
+_counters = Counter()
+_lock = threading.Lock()
+_started = time.time()
+
+
+def increment(name, value=1):
+    """Add `value` to the counter `name`.
+
+    Args:
+        name (str): Counter name.
+        value (int): Increment.
+    """
+    with _lock:
+        _counters[name] += value
+
+
+def snapshot():
+    """Return the current counters of this worker.
+
+    Returns:
+        dict: `{"pid": ..., "uptime": <seconds>, "counters": {name: value}}`.
+    """
+    with _lock:
+        counters = dict(_counters)
+
+    return {"pid": os.getpid(), "uptime": round(time.time() - _started), "counters": counters}
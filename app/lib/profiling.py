@@ -0,0 +1,196 @@
+import cProfile
+import glob
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+
+"""
+Opt-in profiling of single requests.
+
+With `PROFILING_ENABLED=true`, a request carrying an `X-Profile` header with a
+comma-separated list of modes is profiled:
+
+- "cprofile": deterministic profile of the request thread, saved as a
+  `.prof` artifact (`pstats` / snakeviz format),
+- "sample": statistical profile of the request thread, sampling its stack
+  every `PROFILE_SAMPLE_INTERVAL` seconds (default 0.005), saved as a
+  `.folded` artifact (collapsed stacks, as read by flamegraph.pl/speedscope),
+- "cpu": CPU versus wall time of the request thread, reported in a
+  `Server-Timing` header, and per-stage CPU time in `timing.stages_cpu`,
+- "alloc": memory allocations traced with `tracemalloc` (peak size and
+  number of blocks in `X-Profile-Allocations`, the top allocation sites as a
+  `.alloc.txt` artifact). `tracemalloc` is process-wide, so only one request
+  at a time is traced; other requests skip this mode.
+
+Artifacts are written to `PROFILE_DIR` (default `/tmp/spot-profiles`),
+announced in the `X-Profile-Artifacts` response header and downloadable from
+`GET /profiles/<name>`; they are removed after an hour.
+"""
+
+PROFILE_MODES = ("cprofile", "sample", "cpu", "alloc")
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005))
+PROFILE_ARTIFACT_MAX_AGE = 3600
+
+_alloc_lock = threading.Lock()
+
+
+def profiling_enabled():
+    return os.getenv("PROFILING_ENABLED", "false").lower() in ["true", "1", "yes"]
+
+
+def profile_dir():
+    path = os.getenv("PROFILE_DIR", "/tmp/spot-profiles")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def parse_profile_modes(header):
+    """Return the known profiling modes requested in an `X-Profile` header value."""
+    requested = {mode.strip().lower() for mode in (header or "").split(",")}
+    return [mode for mode in PROFILE_MODES if mode in requested]
+
+
+def _cleanup(directory):
+    now = time.time()
+    for path in glob.glob(os.path.join(directory, "*")):
+        try:
+            if now - os.path.getmtime(path) > PROFILE_ARTIFACT_MAX_AGE:
+                os.unlink(path)
+        except OSError:
+            pass
+
+
+class SamplingProfiler:
+    """Periodically samples the stack of one thread from a background thread.
+
+    Args:
+        thread_id (int): `threading.get_ident()` of the sampled thread.
+        interval (float): Seconds between samples.
+    """
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self):
+        """Return the samples in collapsed stack format (`frame;frame;... count`)."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class RequestProfile:
+    """Profilers running for one request, see the module documentation.
+
+    Args:
+        modes (list[str]): Requested modes, a subset of `PROFILE_MODES`.
+    """
+
+    def __init__(self, modes):
+        self.modes = list(modes)
+        self.id = uuid.uuid4().hex
+        self._profiler = None
+        self._sampler = None
+        self._alloc = False
+
+    def start(self):
+        if "alloc" in self.modes and _alloc_lock.acquire(blocking=False):
+            self._alloc = True
+            tracemalloc.start()
+
+        self._wall_start = time.perf_counter_ns()
+        self._cpu_start = time.thread_time_ns()
+
+        if "sample" in self.modes:
+            self._sampler = SamplingProfiler(threading.get_ident())
+            self._sampler.start()
+
+        if "cprofile" in self.modes:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def _artifact(self, extension):
+        name = f"{self.id}.{extension}"
+        return name, os.path.join(profile_dir(), name)
+
+    def stop(self, write=True):
+        """Stop all profilers and write their artifacts.
+
+        Args:
+            write (bool): Whether to write artifacts (`False` to just stop).
+
+        Returns:
+            dict[str, str]: Response headers describing the profile.
+        """
+        if self._profiler is not None:
+            self._profiler.disable()
+        cpu = time.thread_time_ns() - self._cpu_start
+        wall = time.perf_counter_ns() - self._wall_start
+        if self._sampler is not None:
+            self._sampler.stop()
+
+        snapshot, traced = None, None
+        if self._alloc:
+            traced = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot() if write else None
+            tracemalloc.stop()
+            _alloc_lock.release()
+
+        if not write:
+            return {}
+
+        _cleanup(profile_dir())
+        headers = {}
+        artifacts = []
+
+        if self._profiler is not None:
+            name, path = self._artifact("prof")
+            self._profiler.dump_stats(path)
+            artifacts.append(name)
+
+        if self._sampler is not None:
+            name, path = self._artifact("folded")
+            with open(path, "w") as file:
+                file.write(self._sampler.folded())
+            artifacts.append(name)
+
+        if "cpu" in self.modes:
+            headers["Server-Timing"] = f"cpu;dur={cpu / 1_000_000:.3f}, wall;dur={wall / 1_000_000:.3f}"
+
+        if snapshot is not None:
+            statistics = snapshot.statistics("lineno")
+            headers["X-Profile-Allocations"] = (
+                f"peak={traced[1]}, current={traced[0]}, blocks={sum(stat.count for stat in statistics)}"
+            )
+            name, path = self._artifact("alloc.txt")
+            with open(path, "w") as file:
+                file.write("".join(f"{stat}\n" for stat in statistics[:50]))
+            artifacts.append(name)
+
+        if artifacts:
+            headers["X-Profile-Artifacts"] = ", ".join(f"/profiles/{name}" for name in artifacts)
+
+        return headers
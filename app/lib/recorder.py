@@ -0,0 +1,72 @@
+import fcntl
+import os
+import time
+
+from .serializer import dumps
+
+"""
+Opt-in recorder of served spot queries.
+
+When `QUERY_LOG_PATH` is set, every `/run-spot-query` request appends one JSON
+line to that file with the query as received (replayable, see
+`benchmarks/replay.py`), the cleaned query and its hash, the area, the HTTP
+status and error type, the `timing` checkpoints, the result size and whether
+the response came from the cache or a coalesced execution.
+
+Workers of a host append to the same file under an exclusive `flock` on
+`<QUERY_LOG_PATH>.lock`. Once the file exceeds `QUERY_LOG_MAX_BYTES`
+(default 50 MiB), it is rotated to `.1`, `.2`, ... keeping
+`QUERY_LOG_BACKUPS` (default 5) old files. Recording errors are swallowed so
+that they never fail a request.
+"""
+
+QUERY_LOG_MAX_BYTES = int(os.getenv("QUERY_LOG_MAX_BYTES", 50 * 1024 * 1024))
+QUERY_LOG_BACKUPS = int(os.getenv("QUERY_LOG_BACKUPS", 5))
+
+
+def query_log_path():
+    """Return the configured `QUERY_LOG_PATH`, `None` when recording is off."""
+    return os.getenv("QUERY_LOG_PATH") or None
+
+
+def _rotate(path):
+    for index in range(QUERY_LOG_BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{path}.{index}"):
+            os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+
+    if QUERY_LOG_BACKUPS > 0:
+        os.replace(path, f"{path}.1")
+    else:
+        os.unlink(path)
+
+
+def record_query(entry):
+    """Append a spot query record to the query log.
+
+    Args:
+        entry (dict): JSON-serializable record; a `"ts"` (Unix time) is added.
+
+    Returns:
+        bool: Whether the record was written.
+    """
+    path = query_log_path()
+    if path is None:
+        return False
+
+    line = dumps({"ts": round(time.time(), 3), **entry}) + b"\n"
+
+    try:
+        with open(f"{path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(path) and os.path.getsize(path) + len(line) > QUERY_LOG_MAX_BYTES:
+                    _rotate(path)
+
+                with open(path, "ab") as file:
+                    file.write(line)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    except OSError:
+        return False
+
+    return True
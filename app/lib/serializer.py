@@ -0,0 +1,133 @@
+import datetime
+import decimal
+import json
+import os
+from flask import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+"""
+Fast JSON serialization for large responses.
+
+`dumps` encodes a payload with a pluggable backend (`orjson` when installed,
+the standard library otherwise; override with `JSON_SERIALIZER`). Values
+wrapped in `JSONFragment` are already-encoded JSON (e.g. PostGIS
+`ST_AsGeoJSON` or `shapely.to_geojson` output) and are spliced into the output
+verbatim instead of being parsed and re-encoded.
+
+Splicing works by letting the backend emit a NUL placeholder string for each
+fragment and replacing the placeholders afterwards, in document order.
+PostgreSQL text and jsonb values cannot contain NUL characters, so the
+placeholder can never collide with data coming from the database.
+"""
+
+_PLACEHOLDER = "\x00"
+_ENCODED_PLACEHOLDER = b'"\\u0000"'
+
+
+class JSONFragment:
+    """Already-encoded JSON text that is written to the output as-is.
+
+    Args:
+        text (str | bytes): A complete, valid JSON value.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, text):
+        self.data = text.encode("utf-8") if isinstance(text, str) else bytes(text)
+
+    def __repr__(self):
+        return f"JSONFragment({self.data!r})"
+
+
+def _default(fragments):
+    """Build a `default` hook that records fragments and converts extra types."""
+
+    def default(obj):
+        if isinstance(obj, JSONFragment):
+            fragments.append(obj.data)
+            return _PLACEHOLDER
+        if isinstance(obj, decimal.Decimal):
+            return float(obj)
+        if isinstance(obj, (datetime.date, datetime.datetime)):
+            return obj.isoformat()
+        if isinstance(obj, (bytes, memoryview)):
+            return bytes(obj).hex()
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    return default
+
+
+def _dumps_stdlib(obj, default):
+    return json.dumps(obj, default=default, separators=(",", ":")).encode("utf-8")
+
+
+def _dumps_orjson(obj, default):
+    return orjson.dumps(obj, default=default)
+
+
+SERIALIZERS = {"json": _dumps_stdlib}
+if orjson is not None:
+    SERIALIZERS["orjson"] = _dumps_orjson
+
+
+def get_serializer(name=None):
+    """Return the name of the serializer backend to use.
+
+    Args:
+        name (str | None): Requested backend. Defaults to `JSON_SERIALIZER`, then
+            to `orjson` when available.
+
+    Returns:
+        str: A key of `SERIALIZERS`.
+
+    Raises:
+        ValueError: If the requested backend is unknown or not installed.
+    """
+    name = name or os.getenv("JSON_SERIALIZER") or ("orjson" if orjson else "json")
+    if name not in SERIALIZERS:
+        raise ValueError(f"Unknown JSON serializer: {name}")
+    return name
+
+
+def dumps(obj, serializer=None):
+    """Serialize `obj` to UTF-8 encoded JSON, splicing in any `JSONFragment`s.
+
+    Args:
+        obj (Any): JSON-compatible payload, optionally containing `JSONFragment`s.
+        serializer (str | None): Backend name, see `get_serializer`.
+
+    Returns:
+        bytes: The encoded JSON document.
+    """
+    fragments = []
+    encoded = SERIALIZERS[get_serializer(serializer)](obj, _default(fragments))
+
+    if not fragments:
+        return encoded
+
+    parts = encoded.split(_ENCODED_PLACEHOLDER)
+    output = [parts[0]]
+    for fragment, part in zip(fragments, parts[1:]):
+        output.append(fragment)
+        output.append(part)
+
+    return b"".join(output)
+
+
+def json_response(payload, status=200, serializer=None):
+    """Build a Flask JSON response using the fast serializer.
+
+    Args:
+        payload (Any): Response payload.
+        status (int): HTTP status code.
+        serializer (str | None): Backend name, see `get_serializer`.
+
+    Returns:
+        flask.Response: Response with an `application/json` body.
+    """
+    return Response(dumps(payload, serializer), status=status, mimetype="application/json")
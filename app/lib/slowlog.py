@@ -0,0 +1,158 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+
+import psycopg2
+from psycopg2 import sql
+
+from .serializer import dumps
+
+"""
+Structured log of slow spot queries.
+
+A `/run-spot-query` request taking longer than `SLOW_QUERY_MS` milliseconds
+(default 1000; "off" disables the log, 0 logs every query) is written as one
+JSON line to the `spot.slow_query` logger: by default to stderr, or to
+`SLOW_QUERY_LOG_PATH` when set. An entry contains:
+
+- "fingerprint": digest of the query shape, i.e. the cleaned query with its
+  literals (tag values, names, distances, cluster parameters, area
+  coordinates) stripped (`"shape"`), so that slow queries of the same graph
+  shape group together,
+- "sql": the generated SQL,
+- "timing": the `Timer` checkpoints and stages, "elapsed" and "rows",
+- with `SLOW_QUERY_EXPLAIN=true`, the plan of the SQL (`EXPLAIN`, without
+  `ANALYZE`, so the query is not run again) and a digest of its node types
+  and relations (`"planFingerprint"`).
+"""
+
+# Keys whose values are literals rather than part of the query shape
+LITERAL_KEYS = {"value", "name", "bbox", "geometry", "maxDistance", "minPoints"}
+
+logger = logging.getLogger("spot.slow_query")
+
+
+def _configure_logger():
+    path = os.getenv("SLOW_QUERY_LOG_PATH")
+    handler = logging.FileHandler(path) if path else logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+_configure_logger()
+
+
+def slow_query_threshold():
+    """Return the configured `SLOW_QUERY_MS`, `None` when the log is off."""
+    value = os.getenv("SLOW_QUERY_MS", "1000").strip().lower()
+    if value in ["", "off", "false"]:
+        return None
+    return float(value)
+
+
+def explain_enabled():
+    return os.getenv("SLOW_QUERY_EXPLAIN", "false").lower() in ["true", "1", "yes"]
+
+
+def _strip_literals(value):
+    if isinstance(value, dict):
+        return {key: "?" if key in LITERAL_KEYS else _strip_literals(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_strip_literals(item) for item in value]
+    return value
+
+
+def _digest(value):
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def query_fingerprint(cleaned_spot_query):
+    """Strip the literals of a cleaned spot query and digest the remaining shape.
+
+    Args:
+        cleaned_spot_query (dict): Output of `clean_spot_query`.
+
+    Returns:
+        tuple[str, dict]: The fingerprint and the stripped query.
+    """
+    shape = _strip_literals(cleaned_spot_query)
+    return _digest(shape), shape
+
+
+def plan_fingerprint(plan):
+    """Digest the node types, join types and relations of an `EXPLAIN` plan.
+
+    Costs and row estimates are left out, so that the fingerprint only changes
+    with the plan shape.
+
+    Args:
+        plan (dict): The `"Plan"` node of `EXPLAIN (FORMAT JSON)`.
+
+    Returns:
+        str: The fingerprint.
+    """
+    def shape(node):
+        return [
+            node.get("Node Type"),
+            node.get("Join Type"),
+            node.get("Relation Name"),
+            node.get("Index Name"),
+            [shape(child) for child in node.get("Plans", [])],
+        ]
+
+    return _digest(shape(plan))
+
+
+def explain_query(db, query):
+    """Return the `EXPLAIN (FORMAT JSON)` plan of a query, without running it.
+
+    The connection is rolled back first, since the query may have failed (e.g.
+    canceled by the statement timeout).
+
+    Args:
+        db (psycopg2.extensions.connection): Open database connection.
+        query (psycopg2.sql.Composed): The query.
+
+    Returns:
+        dict: The `"Plan"` node.
+    """
+    db.rollback()
+    cursor = db.cursor()
+    cursor.execute(sql.SQL("EXPLAIN (FORMAT JSON) {}").format(query))
+    plan = cursor.fetchone()[0][0]["Plan"]
+    db.rollback()
+    return plan
+
+
+def log_slow_query(entry, db=None, query=None):
+    """Write a slow query entry, adding the SQL and its plan.
+
+    Args:
+        entry (dict): JSON-serializable fields of the entry; should contain
+            "cleaned", the cleaned spot query, which is replaced by its
+            fingerprint and shape.
+        db (psycopg2.extensions.connection | None): Connection used to render
+            and explain the SQL.
+        query (psycopg2.sql.Composed | None): The generated SQL, if the request
+            constructed one.
+    """
+    cleaned = entry.pop("cleaned", None)
+    if cleaned is not None:
+        entry["fingerprint"], entry["shape"] = query_fingerprint(cleaned)
+
+    if query is not None and db is not None:
+        try:
+            entry["sql"] = query.as_string(db)
+            if explain_enabled():
+                plan = explain_query(db, query)
+                entry["planFingerprint"] = plan_fingerprint(plan)
+                entry["plan"] = plan
+        except psycopg2.Error as e:
+            entry["explainError"] = str(e).strip()
+
+    logger.warning(dumps(entry).decode("utf-8"))
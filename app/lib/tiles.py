@@ -0,0 +1,304 @@
+import copy
+import json
+import os
+import time
+from math import atan, cos, degrees, pi, radians, sinh
+from flask import g
+from psycopg2 import sql
+from shapely.geometry import box, mapping, shape
+
+from .cache import LRUCache
+from .constructor import construct_query_from_graph
+from .utils import distance_to_meters, hash_spot_query
+
+"""
+Mapbox Vector Tile (MVT) rendering of Spot query results.
+
+A cleaned Spot query is registered once and addressed by its hash. Individual
+tiles then re-run the query restricted to the tile envelope (plus a margin for
+distance relations) and encode the result with PostGIS `ST_AsMVT`. Queries
+with cluster nodes are not restricted: a DBSCAN cluster can chain across any
+distance, so only the whole query area yields the same clusters in every
+tile.
+
+Registered queries are written to `TILE_QUERY_DIR` so that every gunicorn
+worker on the host can resolve a hash; rendered tiles are kept in a per-worker
+LRU cache so that panning back over a tile does not hit the database again.
+Registrations not used for `TILE_QUERY_TTL` seconds (default 7 days, 0 keeps
+them forever) are removed from the directory.
+"""
+
+TILE_LAYER_NAME = "spot"
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+MAX_ZOOM = 22
+
+tile_cache = LRUCache(
+    maxsize=int(os.getenv("TILE_CACHE_SIZE", 2048)),
+    ttl=int(os.getenv("TILE_CACHE_TTL", 3600)),
+)
+TILE_QUERY_TTL = int(os.getenv("TILE_QUERY_TTL", 7 * 24 * 3600))
+# How often a worker looks for expired registrations, in seconds
+TILE_QUERY_PRUNE_INTERVAL = 3600
+
+# Entries expire before the registration does, so that reading the file again
+# keeps a query in use from being pruned
+_query_cache = LRUCache(maxsize=256, ttl=TILE_QUERY_TTL / 2 if TILE_QUERY_TTL else None)
+_last_prune = 0.0
+
+
+class TileQueryNotFoundError(Exception):
+    """
+    Raised when a tile is requested for a query hash that was never registered
+    (or whose registration has been removed from `TILE_QUERY_DIR`).
+    """
+    pass
+
+
+class TileInvalidError(Exception):
+    """
+    Raised when the requested z/x/y triple does not address a valid tile.
+    """
+    pass
+
+
+def _tile_query_dir():
+    """Return the directory holding registered tile queries, creating it if needed."""
+    path = os.getenv("TILE_QUERY_DIR", "/tmp/spot-tile-queries")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def prune_tile_queries(now=None):
+    """Remove the registrations not used for `TILE_QUERY_TTL` seconds.
+
+    A registration counts as used when it is registered again or read by a
+    worker (see `load_tile_query`). Runs at most once per
+    `TILE_QUERY_PRUNE_INTERVAL` per worker.
+
+    Args:
+        now (float | None): Current time (`time.time()`), for testing.
+    """
+    global _last_prune
+
+    now = time.time() if now is None else now
+    if not TILE_QUERY_TTL or now - _last_prune < TILE_QUERY_PRUNE_INTERVAL:
+        return
+    _last_prune = now
+
+    directory = _tile_query_dir()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > TILE_QUERY_TTL:
+                os.remove(path)
+        except FileNotFoundError:
+            # Removed by another worker
+            pass
+
+
+def register_tile_query(spot_query):
+    """Register a cleaned Spot query for tile rendering.
+
+    Args:
+        spot_query (dict): Output of `clean_spot_query`.
+
+    Returns:
+        str: The query hash used to address tiles of this query.
+    """
+    query_hash = hash_spot_query(spot_query)
+    path = os.path.join(_tile_query_dir(), f"{query_hash}.json")
+
+    try:
+        # Registering again renews the registration
+        os.utime(path)
+    except FileNotFoundError:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(spot_query, file)
+        os.replace(tmp_path, path)
+
+    # Copied, so that the caller can keep modifying its query
+    _query_cache.set(query_hash, copy.deepcopy(spot_query))
+    prune_tile_queries()
+
+    return query_hash
+
+
+def load_tile_query(query_hash):
+    """Resolve a registered Spot query by its hash.
+
+    Args:
+        query_hash (str): Hash returned by `register_tile_query`.
+
+    Returns:
+        dict: The cleaned Spot query, a copy the caller may modify.
+
+    Raises:
+        TileQueryNotFoundError: If the hash is unknown.
+    """
+    spot_query = _query_cache.get(query_hash)
+    if spot_query is not None:
+        return copy.deepcopy(spot_query)
+
+    if not all(c in "0123456789abcdef" for c in query_hash):
+        raise TileQueryNotFoundError(query_hash)
+
+    path = os.path.join(_tile_query_dir(), f"{query_hash}.json")
+    try:
+        with open(path, "r") as file:
+            spot_query = json.load(file)
+    except FileNotFoundError:
+        raise TileQueryNotFoundError(query_hash)
+
+    try:
+        # Reading a registration renews it
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+    _query_cache.set(query_hash, spot_query)
+    return copy.deepcopy(spot_query)
+
+
+def tile_to_bbox(z, x, y):
+    """Convert a Web Mercator tile address into lon/lat bounds.
+
+    Args:
+        z (int): Zoom level.
+        x (int): Tile column.
+        y (int): Tile row (XYZ scheme, origin top-left).
+
+    Returns:
+        list[float]: `[min_lon, min_lat, max_lon, max_lat]`.
+
+    Raises:
+        TileInvalidError: If the tile address is out of range.
+    """
+    if not 0 <= z <= MAX_ZOOM or not 0 <= x < 2**z or not 0 <= y < 2**z:
+        raise TileInvalidError(f"{z}/{x}/{y}")
+
+    n = 2**z
+
+    def lat(row):
+        return degrees(atan(sinh(pi * (1 - 2 * row / n))))
+
+    return [x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)]
+
+
+def tile_margin(spot_query):
+    """Compute how far (in meters) features outside a tile can affect it.
+
+    Distance edges relate features that may sit on both sides of a tile
+    border, and chained edges add up, so the search area is widened by the sum
+    of the distances involved. Cluster nodes are not bounded by any margin
+    (see `restrict_area_to_tile`).
+
+    Args:
+        spot_query (dict): Cleaned Spot query.
+
+    Returns:
+        float: Margin in meters.
+    """
+    return sum(
+        float(distance_to_meters(edge["value"]))
+        for edge in spot_query.get("edges", [])
+        if edge.get("type") == "distance"
+    )
+
+
+def restrict_area_to_tile(spot_query, z, x, y):
+    """Narrow `g.area` to the part of the query area covered by a tile.
+
+    `set_area` must have been called for `spot_query` beforehand; `g.utm` is
+    left untouched so that distances stay consistent across tiles. Queries
+    with cluster nodes keep the whole area: DBSCAN chains clusters through
+    any number of members, so features far outside the tile can still decide
+    which clusters reach into it.
+
+    Args:
+        spot_query (dict): Cleaned Spot query.
+        z (int): Zoom level.
+        x (int): Tile column.
+        y (int): Tile row.
+
+    Returns:
+        bool: False if the tile does not overlap the query area at all.
+    """
+    min_lon, min_lat, max_lon, max_lat = tile_to_bbox(z, x, y)
+
+    margin = tile_margin(spot_query)
+    margin_lat = margin / 111000.0
+    margin_lon = margin / (111000.0 * max(cos(radians(max(abs(min_lat), abs(max_lat)))), 0.01))
+
+    tile = box(
+        min_lon - margin_lon,
+        min_lat - margin_lat,
+        max_lon + margin_lon,
+        max_lat + margin_lat,
+    )
+
+    if g.area["type"] == "bbox":
+        area = box(*g.area["bbox"])
+    else:
+        area = shape(json.loads(g.area["geometry"]))
+
+    restricted = area.intersection(tile)
+    if restricted.is_empty:
+        return False
+
+    if any(node.get("type") == "cluster" for node in spot_query.get("nodes", [])):
+        return True
+
+    g.area = {
+        "type": "area",
+        "geometry": json.dumps(mapping(restricted)),
+        "center": g.area["center"],
+    }
+    return True
+
+
+def construct_tile_query(spot_query, z, x, y):
+    """Wrap the Spot query SQL so that it returns a single MVT tile.
+
+    Args:
+        spot_query (dict): Cleaned Spot query; `g.area` should already be
+            restricted with `restrict_area_to_tile`.
+        z (int): Zoom level.
+        x (int): Tile column.
+        y (int): Tile row.
+
+    Returns:
+        psycopg2.sql.Composed: A query yielding one `bytea` row with the tile.
+    """
+    query = construct_query_from_graph(spot_query, binary_geometry=False)
+
+    return sql.SQL(
+        """
+        SELECT ST_AsMVT(tile, {layer}, {extent}, 'geom')
+        FROM (
+            SELECT
+                spot.set_name,
+                ARRAY_TO_STRING(spot.osm_ids, ',') AS osm_ids,
+                spot.primitive_type,
+                spot.tags::text AS tags,
+                ST_AsMVTGeom(
+                    ST_Transform(spot.geom, 3857),
+                    ST_TileEnvelope({z}, {x}, {y}),
+                    {extent},
+                    {buffer},
+                    true
+                ) AS geom
+            FROM ({query}) AS spot
+            WHERE spot.geom && ST_Transform(ST_TileEnvelope({z}, {x}, {y}), 4326)
+        ) AS tile
+        WHERE tile.geom IS NOT NULL"""
+    ).format(
+        layer=sql.Literal(TILE_LAYER_NAME),
+        extent=sql.Literal(TILE_EXTENT),
+        buffer=sql.Literal(TILE_BUFFER),
+        z=sql.Literal(z),
+        x=sql.Literal(x),
+        y=sql.Literal(y),
+        query=query,
+    )
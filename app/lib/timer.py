@@ -1,4 +1,6 @@
 import time
+from contextlib import contextmanager, nullcontext
+from flask import g, has_app_context
 
 """
 Simple timing utility for measuring elapsed time between checkpoints.
@@ -6,28 +8,51 @@ Simple timing utility for measuring elapsed time between checkpoints.
 The `Timer` class allows tracking the time (in milliseconds) between named
 checkpoints. Useful for lightweight performance logging or profiling of code
 sections. Checkpoints are cumulative, not overlapping.
+
+Within checkpoints, `Timer.stage` (or the module-level `stage`, which uses the
+request timer in `flask.g`) measures nested stages such as the construction of
+the CTEs or the fetching of rows. Stages are reported under `"stages"` with
+dotted names for nesting (e.g. `"execute.fetch"`); optionally, the CPU time
+of the calling thread is recorded per stage as well (`"stages_cpu"`).
 """
 
+
+def _ms(nanoseconds):
+    return round(nanoseconds / 1_000_000, 3)
+
+
 class Timer:
     """A timer for measuring elapsed time between checkpoints in milliseconds.
 
     This class provides a way to track the time between named checkpoints in
-    your code. It uses wall-clock time (`time.time()`) and stores durations
-    in milliseconds.
+    your code. It uses the monotonic high-resolution clock
+    (`time.perf_counter_ns()`) and stores durations in milliseconds with
+    microsecond precision.
 
     Example:
         timer = Timer()
         ...  # do something
         timer.add_checkpoint("load_data")
-        ...  # do more
+        with timer.stage("process"):
+            with timer.stage("parse"):
+                ...  # recorded as "process.parse"
         timer.add_checkpoint("process")
-        print(timer.get_all_checkpoints())  # {'load_data': ..., 'process': ...}
+        print(timer.get_all_checkpoints())
+        # {'load_data': ..., 'process': ..., 'stages': {'process.parse': ..., 'process': ...}}
     """
-    def __init__(self):
-        """Initialize the timer and start the first checkpoint timer."""
+    def __init__(self, track_cpu=False):
+        """Initialize the timer and start the first checkpoint timer.
+
+        Args:
+            track_cpu (bool): Also record the thread CPU time of every stage.
+        """
         # Dictionary to store the checkpoints with their respective elapsed times in ms.
         self.checkpoints = {}
-        self.last_checkpoint_time = time.time()
+        self.stages = {}
+        self.stages_cpu = {}
+        self.track_cpu = track_cpu
+        self._stack = []
+        self.start_time = self.last_checkpoint_time = time.perf_counter_ns()
 
     def add_checkpoint(self, checkpoint_name):
         """Add a named checkpoint and record the time since the last one.
@@ -36,16 +61,36 @@ class Timer:
             checkpoint_name (str): The name of the checkpoint to record.
 
         Returns:
-            int: Elapsed time in milliseconds since the last checkpoint.
+            float: Elapsed time in milliseconds since the last checkpoint.
         """
-        current_time = time.time()
+        current_time = time.perf_counter_ns()
 
-        # Convert to milliseconds and round to the nearest integer
-        elapsed_time = round((current_time - self.last_checkpoint_time) * 1000)
+        elapsed_time = _ms(current_time - self.last_checkpoint_time)
         self.last_checkpoint_time = current_time  # Update the last checkpoint time
         self.checkpoints[checkpoint_name] = elapsed_time
         return elapsed_time
 
+    @contextmanager
+    def stage(self, name):
+        """Measure a (possibly nested) stage; repeated stages add up.
+
+        Args:
+            name (str): Stage name, prefixed with the names of enclosing stages.
+        """
+        path = ".".join([*self._stack, name])
+        self._stack.append(name)
+        cpu_start = time.thread_time_ns() if self.track_cpu else None
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter_ns() - start
+            self._stack.pop()
+            self.stages[path] = round(self.stages.get(path, 0) + _ms(elapsed), 3)
+            if cpu_start is not None:
+                cpu = time.thread_time_ns() - cpu_start
+                self.stages_cpu[path] = round(self.stages_cpu.get(path, 0) + _ms(cpu), 3)
+
     def get_checkpoint(self, checkpoint_name):
         """Get the elapsed time for a specific checkpoint.
 
@@ -53,19 +98,50 @@ class Timer:
             checkpoint_name (str): The name of the checkpoint to retrieve.
 
         Returns:
-            int | None: Elapsed time in milliseconds, or `None` if not found.
+            float | None: Elapsed time in milliseconds, or `None` if not found.
         """
         return self.checkpoints.get(checkpoint_name, None)
 
+    def elapsed(self):
+        """Get the time since the timer was started (or reset).
+
+        Returns:
+            float: Elapsed time in milliseconds.
+        """
+        return _ms(time.perf_counter_ns() - self.start_time)
+
     def reset(self):
-        """Reset the timer and clear all existing checkpoints."""
-        self.last_checkpoint_time = time.time()
+        """Reset the timer and clear all existing checkpoints and stages."""
+        self.start_time = self.last_checkpoint_time = time.perf_counter_ns()
         self.checkpoints = {}
+        self.stages = {}
+        self.stages_cpu = {}
 
     def get_all_checkpoints(self):
-        """Get all recorded checkpoints.
+        """Get all recorded checkpoints, and the stages if any were measured.
 
         Returns:
-            dict[str, int]: Dictionary of {checkpoint_name: elapsed_time_ms}.
+            dict: `{checkpoint_name: elapsed_time_ms}`, plus `"stages"`
+            (`{dotted_stage_name: elapsed_time_ms}`) and `"stages_cpu"` when recorded.
         """
-        return self.checkpoints
+        if not self.stages:
+            return self.checkpoints
+
+        timing = {**self.checkpoints, "stages": dict(self.stages)}
+        if self.stages_cpu:
+            timing["stages_cpu"] = dict(self.stages_cpu)
+        return timing
+
+
+def stage(name):
+    """Measure a stage with the request timer (`g.timer`), if there is one.
+
+    Args:
+        name (str): Stage name, see `Timer.stage`.
+
+    Returns:
+        contextlib.AbstractContextManager: The stage context (a no-op outside
+        of a request or without a timer).
+    """
+    timer = g.get("timer") if has_app_context() else None
+    return timer.stage(name) if timer is not None else nullcontext()
@@ -1,25 +1,24 @@
+import hashlib
 import json
+import logging
 import re
 from flask import g
-import requests
+import numpy as np
+import shapely
 from shapely import wkb
-from shapely.wkb import loads as wkb_loads
 from shapely.geometry import (
-    MultiPolygon,
-    Polygon,
-    MultiPoint,
-    LineString,
     Point,
     mapping,
     shape,
 )
-from math import cos, radians
 from psycopg2 import sql
-from collections import defaultdict
+from collections import Counter
+from operator import itemgetter
 import os
 
 
 from .ctes.construct_search_area import AreaInvalidError
+from .serializer import JSONFragment
 
 """
 Geospatial utilities for Spot:
@@ -32,11 +31,18 @@ The functions here are designed to work with Flask's request context (`flask.g`)
 and PostGIS-enabled queries (via `psycopg2.sql`).
 """
 
+logger = logging.getLogger(__name__)
+
+# Result columns that are not exposed as GeoJSON feature properties
+NON_PROPERTY_COLUMNS = {"geom", "primary_osm_ids"}
+
+
 def geom_bin_to_geojson(geom_bin):
-    """Convert a PostGIS hex‑WKB geometry to a GeoJSON geometry mapping.
+    """Convert a PostGIS WKB geometry to a GeoJSON geometry mapping.
 
     Args:
-        geom_bin (str | bytes): Hex-encoded WKB string (or bytes) returned by PostGIS.
+        geom_bin (str | bytes): Raw WKB bytes (`ST_AsBinary`, fetched with
+            `lib.database.wkb_cursor`) or a hex-encoded WKB string.
 
     Returns:
         dict: A GeoJSON geometry mapping (as produced by `shapely.geometry.mapping`).
@@ -44,7 +50,7 @@ def geom_bin_to_geojson(geom_bin):
     Raises:
         shapely.errors.ReadingError: If the geometry cannot be parsed.
     """
-    geom_wkt = wkb.loads(geom_bin, hex=True)  # Convert binary geometry to WKT
+    geom_wkt = wkb.loads(geom_bin, hex=isinstance(geom_bin, str))  # Convert binary geometry to WKT
     return mapping(geom_wkt)  # Convert WKT to GeoJSON
 
 
@@ -66,50 +72,80 @@ def add_center_to_geojson(geojson_feature):
     geojson_feature["properties"]["center"] = center_point
 
 
-def results_to_geojson(results):
-    """Convert a sequence of DB result rows into a GeoJSON FeatureCollection.
-
-    Each row is expected to contain a PostGIS geometry (under key `"geom"`) and
-    any additional attributes that will be placed under `properties`. The geometry
-    is converted from hex‑WKB to a GeoJSON geometry. A centroid is added to each
-    feature under `properties.center`.
+def decode_geometries(rows, columns):
+    """Decode the `"geom"` column of all rows in one vectorized call.
 
     Args:
-        results (list[dict]): Iterable of row dicts where `"geom"` is a hex‑WKB.
+        rows (list[tuple]): Result rows where the `"geom"` column is WKB
+            (raw bytes or hex-encoded).
+        columns (list[str]): Column names, in row order.
 
     Returns:
-        dict: A GeoJSON FeatureCollection mapping.
-
-    Notes:
-        The `"geom"` key is removed from each row before it is assigned to
-        `properties`.
+        numpy.ndarray: Array of Shapely geometries, one per row.
     """
-    features = []
+    geom_index = columns.index("geom")
+    return shapely.from_wkb([row[geom_index] for row in rows])
 
-    for result in results:
-        geom_geojson = geom_bin_to_geojson(
-            result["geom"]
-        )  # Convert geometry to GeoJSON
 
-        # Remove 'geom' key from the result before assigning to properties since it's not needed in the properties
-        del result["geom"]
+def results_to_geojson(rows, columns, geometries=None):
+    """Convert DB result rows into a GeoJSON FeatureCollection and set statistics.
 
-        feature = {
-            "type": "Feature",
-            "geometry": geom_geojson,
-            "properties": result,
-        }
+    Rows are plain tuples as returned by a default psycopg2 cursor. All
+    geometries (column `"geom"`) are decoded in one vectorized
+    `shapely.from_wkb` call and encoded with `shapely.to_geojson`; the encoded
+    geometries are kept as `JSONFragment`s so the serializer splices them in
+    without building coordinate lists. Every other column becomes a feature
+    property, and a centroid is added under `properties.center`.
 
-        add_center_to_geojson(feature)  # Add center point to the feature
+    Features and the per-set counts are built in a single pass over the rows,
+    without intermediate per-row dicts.
 
-        features.append(feature)
+    Args:
+        rows (list[tuple]): Result rows where the `"geom"` column is WKB
+            (raw bytes or hex-encoded).
+        columns (list[str]): Column names, in row order. Must include `"geom"`
+            and `"set_name"`. `"primary_osm_ids"` is not copied to the properties.
+        geometries (numpy.ndarray | None): Geometries already decoded with
+            `decode_geometries`; decoded here when omitted.
+
+    Returns:
+        tuple[dict, dict]: A GeoJSON FeatureCollection mapping, and a mapping of
+        `{set_name: number_of_features}`.
+    """
+    set_name_index = columns.index("set_name")
+    property_names = [column for column in columns if column not in NON_PROPERTY_COLUMNS]
+    get_properties = itemgetter(*[columns.index(column) for column in property_names])
+
+    if geometries is None:
+        geometries = decode_geometries(rows, columns)
+    geometries_geojson = shapely.to_geojson(geometries)
+
+    centroids = shapely.centroid(geometries)
+    center_x = shapely.get_x(centroids).tolist()
+    center_y = shapely.get_y(centroids).tolist()
+
+    features = []
+    set_name_counts = Counter()
+
+    for row, geom_geojson, x, y in zip(rows, geometries_geojson, center_x, center_y):
+        properties = dict(zip(property_names, get_properties(row)))
+        properties["center"] = {"type": "Point", "coordinates": (x, y)}
+        set_name_counts[row[set_name_index]] += 1
+
+        features.append(
+            {
+                "type": "Feature",
+                "geometry": JSONFragment(geom_geojson),
+                "properties": properties,
+            }
+        )
 
     geojson = {
         "type": "FeatureCollection",
         "features": features,
     }
 
-    return geojson
+    return geojson, dict(set_name_counts)
 
 
 def distance_to_meters(distance_str: str) -> str:
@@ -249,7 +285,7 @@ def set_area(data: str) -> None:
             g.area["center"] = [centroid.x, centroid.y]
             g.utm = get_utm(centroid.x, centroid.y)
     except Exception as e:
-        print(f"An error occurred in area.py: {e}")
+        logger.warning("Invalid area: %s", e)
         raise AreaInvalidError(e)
 
 
@@ -313,85 +349,83 @@ def calculate_area_size(db) -> float:
     return cursor.fetchone()[0]
 
 
-def get_spots(results):
-    """Aggregate raw geometry rows into "spots" grouped by primary OSM ID.
+def get_spots(rows, columns, geometries):
+    """Aggregate result rows into "spots" grouped by primary OSM ID.
 
-    For each record, geometries are decoded from WKB and their coordinates
-    are accumulated per primary OSM ID. A small lat/lon buffer (~100 m)
-    is applied to build a bbox around all coordinates for that spot.
+    Every row lists the primary OSM IDs it belongs to (`"primary_osm_ids"`,
+    as produced by `construct_relations`). Row bounds are computed in one
+    vectorized `shapely.bounds` call and reduced per spot with a numpy
+    group-by; a small lat/lon buffer (~100 m) is then applied around each
+    spot's bbox.
 
     Args:
-        results (list[dict]): Rows expected to include:
-            - "primary_osm_ids" (iterable[int|str]): One or more primary OSM IDs.
-            - "osm_ids" (int|str): The row's OSM ID.
-            - "geom" (bytes): WKB geometry (NOT hex-encoded).
-            - "tags" (dict | None): Optional tag mapping.
+        rows (list[tuple]): Result rows with `"osm_ids"`, `"tags"` and
+            `"primary_osm_ids"` columns.
+        columns (list[str]): Column names, in row order.
+        geometries (numpy.ndarray): Row geometries from `decode_geometries`.
 
     Returns:
         list[dict]: Each item has:
             - "bbox": [minx, miny, maxx, maxy]
-            - "id": primary OSM ID
-            - "tags": tags (from the row where `osm_ids == primary_osm_id`, if any)
+            - "id": primary OSM ID (member IDs joined with `,` for clusters)
+            - "tags": tags of the primary feature itself, if it is in the results
             - "nodes": unique list of member OSM IDs
 
     Notes:
-        - Supports Point, LineString, Polygon, and MultiPolygon. Others are ignored.
+        - Rows without primary OSM IDs (isolated nodes) do not form spots.
         - Buffer uses a crude degrees approximation (sufficient for small extents).
     """
-    grouped = defaultdict(lambda: {"coords": [], "tags": None, "nodes": []})
-    spots = []
-
-    for record in results:
-        primary_osm_id = record["primary_osm_ids"]  # Assuming this is an array
+    primary_index = columns.index("primary_osm_ids")
+    osm_ids_index = columns.index("osm_ids")
+    tags_index = columns.index("tags")
 
-        for primary_osm_id in primary_osm_id:
-            if record["osm_ids"] == primary_osm_id:
-                grouped[primary_osm_id]["tags"] = record["tags"]
+    row_indexes = []
+    spot_ids = []
 
-            grouped[primary_osm_id]["nodes"].append(record["osm_ids"])
+    for i, row in enumerate(rows):
+        for primary_osm_id in row[primary_index] or ():
+            row_indexes.append(i)
+            spot_ids.append(primary_osm_id)
 
-            geom = wkb_loads(record["geom"], hex=False)
-            coords = []
+    if not row_indexes:
+        return []
 
-            if isinstance(geom, Point):
-                coords = [geom.coords[0]]
-            elif isinstance(geom, LineString):
-                coords = list(geom.coords)
-            elif isinstance(geom, Polygon):
-                coords = list(geom.exterior.coords)
-            elif isinstance(geom, MultiPolygon):
-                for (
-                    polygon
-                ) in (
-                    geom.geoms
-                ):  # Corrected iteration over each Polygon in a MultiPolygon
-                    coords.extend(list(polygon.exterior.coords))
+    unique_ids, groups = np.unique(np.array(spot_ids, dtype=object), return_inverse=True)
+    row_bounds = shapely.bounds(geometries)[np.asarray(row_indexes)]
 
-            else:
-                pass
-
-            grouped[primary_osm_id]["coords"].extend(coords)
+    minx = np.full(len(unique_ids), np.inf)
+    miny = np.full(len(unique_ids), np.inf)
+    maxx = np.full(len(unique_ids), -np.inf)
+    maxy = np.full(len(unique_ids), -np.inf)
+    np.fmin.at(minx, groups, row_bounds[:, 0])
+    np.fmin.at(miny, groups, row_bounds[:, 1])
+    np.fmax.at(maxx, groups, row_bounds[:, 2])
+    np.fmax.at(maxy, groups, row_bounds[:, 3])
 
     buffer_meters = 100
     buffer_lat = buffer_meters / 111000.0
+    buffer_lon = buffer_meters / (111000.0 * np.cos(np.radians(miny)))
+
+    bboxes = np.column_stack(
+        [minx - buffer_lon, miny - buffer_lat, maxx + buffer_lon, maxy + buffer_lat]
+    ).tolist()
 
-    for primary_osm_id, data in grouped.items():
-        multi_point = MultiPoint(data["coords"])
-        minx, miny, maxx, maxy = multi_point.bounds
-        buffer_lon = buffer_meters / (111000.0 * cos(radians(miny)))
+    tags = [None] * len(unique_ids)
+    nodes = [set() for _ in unique_ids]
 
-        minx -= buffer_lon
-        miny -= buffer_lat
-        maxx += buffer_lon
-        maxy += buffer_lat
+    for row_index, group in zip(row_indexes, groups.tolist()):
+        row = rows[row_index]
+        osm_ids = row[osm_ids_index]
 
-        bbox = [minx, miny, maxx, maxy]
-        tags = data["tags"]
-        nodes = list(set(data["nodes"]))  # Remove duplicates """
+        if ",".join(osm_ids) == unique_ids[group]:
+            tags[group] = row[tags_index]
 
-        spots.append({"bbox": bbox, "id": primary_osm_id, "tags": tags, "nodes": nodes})
+        nodes[group].update(osm_ids)
 
-    return spots
+    return [
+        {"bbox": bbox, "id": spot_id, "tags": spot_tags, "nodes": list(spot_nodes)}
+        for bbox, spot_id, spot_tags, spot_nodes in zip(bboxes, unique_ids.tolist(), tags, nodes)
+    ]
 
 
 def validate_spot_query(spot_query):
@@ -494,6 +528,8 @@ def clean_spot_query(spot_query):
     - For each edge, if `source >= target`, the endpoints are swapped so that
       `source < target` (normalization helps detect duplicates).
     - Edges are then sorted by `(source, target)`.
+    - Node filters are normalized (see `lib.filters.normalize_filters`), so
+      equivalent filter trees produce the same query.
 
     Args:
         spot_query (dict): A graph specification with `nodes` and `edges`.
@@ -501,12 +537,20 @@ def clean_spot_query(spot_query):
     Returns:
         dict: The same dict instance, mutated in place and returned for convenience.
     """
+    # Imported here: `lib.filters` uses `distance_to_meters` from this module
+    from .filters import normalize_filters
+
     nodes, edges = spot_query.get("nodes", []), spot_query.get("edges", [])
 
     # Sort nodes by 'id'
     sorted_nodes = sorted(nodes, key=lambda x: x["id"])
     spot_query["nodes"] = sorted_nodes
 
+    # Normalize filter trees
+    for node in sorted_nodes:
+        if "filters" in node:
+            node["filters"] = normalize_filters(node["filters"])
+
     # Invert 'source' and 'target' where 'target' is not greater than 'source' and sort edges
     for edge in edges:
         source, target = edge.get("source"), edge.get("target")
@@ -517,3 +561,19 @@ def clean_spot_query(spot_query):
     spot_query["edges"] = sorted_edges
 
     return spot_query
+
+
+def hash_spot_query(spot_query) -> str:
+    """Compute a stable digest of a (cleaned) Spot query.
+
+    The query is serialized with sorted keys and compact separators, so two
+    canonicalized queries that are structurally equal always share a digest.
+
+    Args:
+        spot_query (dict): A Spot query, ideally the output of `clean_spot_query`.
+
+    Returns:
+        str: Hex-encoded SHA-256 digest.
+    """
+    canonical = json.dumps(spot_query, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
@@ -0,0 +1,186 @@
+from jsonschema import Draft7Validator
+from jsonschema.exceptions import best_match
+from .utils import validate_spot_query
+
+"""
+Validation of incoming spot queries.
+
+`jsonschema.validate` checks the schema itself and builds a new validator on
+every call, and the `oneOf` alternatives of `NestedCondition` make it try
+every filter against both branches. Routes therefore validate with
+`validate_spot_query_request`, which uses a validator compiled once at
+startup (`compile_spot_query_schema`) and, before that, a single walk over
+the query that checks the structure required by `schemas/spot_query.json`
+and collects what the semantic checks of `validate_spot_query` need
+(node ids and names, whether every node has a filter, edge endpoints).
+
+The walk only accepts the unambiguous shapes the schema describes. Whenever
+it meets anything else (including invalid input), it steps aside and the
+compiled validator plus `validate_spot_query` decide, so error messages and
+edge cases stay exactly those of the full validation.
+"""
+
+CONDITION_OPERATORS = ("=", "<", ">", "~")
+AREA_TYPES = ("bbox", "area")
+
+
+class _Unsure(Exception):
+    """Raised by the fast path when it cannot decide on its own."""
+    pass
+
+
+def compile_spot_query_schema(schema):
+    """Check the spot query schema and build a reusable validator.
+
+    Args:
+        schema (dict): Contents of `schemas/spot_query.json`.
+
+    Returns:
+        jsonschema.Draft7Validator: Compiled validator.
+
+    Raises:
+        jsonschema.exceptions.SchemaError: If the schema itself is invalid.
+    """
+    Draft7Validator.check_schema(schema)
+    return Draft7Validator(schema)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _check(condition):
+    if not condition:
+        raise _Unsure()
+
+
+def _walk_filters(filters):
+    """Check a list of `NestedCondition`s without recursion.
+
+    Returns:
+        bool: Whether the tree contains at least one condition (`key` predicate).
+    """
+    _check(isinstance(filters, list))
+
+    has_condition = False
+    stack = [filters]
+
+    while stack:
+        for filter in stack.pop():
+            _check(isinstance(filter, dict))
+            groups = [operator for operator in ("and", "or") if operator in filter]
+
+            if groups:
+                # A group must not also look like a condition (both `oneOf` branches)
+                _check(len(groups) == 1 and not any(key in filter for key in ("key", "value", "operator")))
+                children = filter[groups[0]]
+                _check(isinstance(children, list))
+                stack.append(children)
+                continue
+
+            _check(isinstance(filter.get("key"), str) and isinstance(filter.get("value"), str))
+            _check(filter.get("operator") in CONDITION_OPERATORS and isinstance(filter["operator"], str))
+            _check(isinstance(filter.get("name", ""), str))
+            has_condition = True
+
+    return has_condition
+
+
+def _walk_area(area):
+    _check(isinstance(area, dict))
+    _check(isinstance(area.get("type"), str) and area["type"] in AREA_TYPES)
+    _check(isinstance(area.get("value", ""), str))
+    _check(isinstance(area.get("geometry", {}), dict))
+
+    bbox = area.get("bbox", [])
+    _check(isinstance(bbox, list) and all(_is_number(value) for value in bbox))
+
+
+def _walk_node(node):
+    _check(isinstance(node, dict) and _is_number(node.get("id")))
+    # Semantic checks need a name for every node, including clusters
+    _check(isinstance(node.get("name"), str))
+
+    if node.get("type") == "cluster":
+        _check(_is_number(node.get("minPoints")) and isinstance(node.get("maxDistance"), str))
+    else:
+        _check(node.get("type") == "nwr")
+
+    return _walk_filters(node.get("filters"))
+
+
+def _walk_edge(edge):
+    _check(isinstance(edge, dict) and _is_number(edge.get("source")) and _is_number(edge.get("target")))
+
+    if edge.get("type") == "distance":
+        _check(isinstance(edge.get("value"), str))
+    else:
+        _check(edge.get("type") == "contains")
+
+    return edge["source"], edge["target"]
+
+
+def _fast_validate(spot_query):
+    """Validate the structure and semantics of a spot query in one walk.
+
+    Raises:
+        _Unsure: If the input is not one of the shapes handled here.
+        ValueError: With the codes of `validate_spot_query`.
+    """
+    _check(isinstance(spot_query, dict))
+    _walk_area(spot_query.get("area"))
+
+    nodes = spot_query.get("nodes")
+    _check(isinstance(nodes, list))
+    has_filters = [_walk_node(node) for node in nodes]
+
+    edges = spot_query.get("edges", [])
+    _check(isinstance(edges, list))
+    endpoints = [_walk_edge(edge) for edge in edges]
+
+    # The structure is valid; same checks and order as `validate_spot_query`
+    if not all(has_filters):
+        raise ValueError("missingFilterInNode")
+
+    node_ids = {node["id"] for node in nodes}
+
+    if len(node_ids) != len(nodes):
+        raise ValueError("duplicateNodeIds")
+
+    if len({node["name"] for node in nodes}) != len(nodes):
+        raise ValueError("duplicateNodeNames")
+
+    seen_edges = set()
+    for source, target in endpoints:
+        edge_tuple = (min(source, target), max(source, target))
+        if edge_tuple in seen_edges:
+            raise ValueError("duplicateOrInvertedEdge")
+
+        seen_edges.add(edge_tuple)
+
+        if source == target:
+            raise ValueError("selfReferencingEdge")
+
+        if not {source, target}.issubset(node_ids):
+            raise ValueError("edgeSourceOrTargetNotInNodes")
+
+
+def validate_spot_query_request(spot_query, validator):
+    """Validate a spot query against the schema and the semantic rules.
+
+    Args:
+        spot_query (Any): Decoded request body.
+        validator (jsonschema.Draft7Validator): Output of `compile_spot_query_schema`.
+
+    Raises:
+        jsonschema.exceptions.ValidationError: If the schema is violated.
+        ValueError: If a semantic rule is violated (see `validate_spot_query`).
+    """
+    try:
+        _fast_validate(spot_query)
+    except _Unsure:
+        # Same error selection as `jsonschema.validate`
+        error = best_match(validator.iter_errors(spot_query))
+        if error is not None:
+            raise error
+        validate_spot_query(spot_query)
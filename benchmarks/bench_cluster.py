@@ -0,0 +1,133 @@
+"""
+Benchmark cluster node latency as a function of the number of input points.
+
+For each input size a temporary table with the `TABLE_VIEW` schema
+(`node_id`, `primitive_type`, `geom`, `tags`) is filled with random points,
+mostly uniform noise plus a share of dense blobs. The cluster CTE is then
+built with every strategy in `CLUSTER_STRATEGIES` and timed end to end
+(query construction, the in-process clustering of the "python" strategy,
+plus execution).
+
+Requires a PostGIS database reachable through the usual `DATABASE_*`
+environment variables.
+
+Usage:
+    python benchmarks/bench_cluster.py [--sizes 1000 10000 100000] [--max-distance 50m] [--min-points 3]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import psycopg2  # noqa: E402
+from flask import Flask, g  # noqa: E402
+from psycopg2 import sql  # noqa: E402
+
+BENCH_TABLE = "bench_cluster_points"
+BBOX = [13.30, 52.45, 13.50, 52.55]
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=os.getenv("DATABASE_NAME"),
+        user=os.getenv("DATABASE_USER"),
+        password=os.getenv("DATABASE_PASSWORD"),
+        host=os.getenv("DATABASE_HOST"),
+        port=os.getenv("DATABASE_PORT"),
+    )
+
+
+def fill_points(cursor, count):
+    """Create the benchmark table with `count` points: 70% noise, 30% in blobs."""
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(BENCH_TABLE)))
+    cursor.execute(
+        sql.SQL(
+            """
+            CREATE TEMP TABLE {table} AS
+            SELECT
+                i AS node_id,
+                'node'::text AS primitive_type,
+                CASE WHEN i % 10 < 7
+                    THEN ST_SetSRID(ST_MakePoint({xmin} + random() * {width}, {ymin} + random() * {height}), 4326)
+                    ELSE ST_SetSRID(ST_MakePoint(
+                        {xmin} + (i % 97) / 97.0 * {width} + random() * 0.0005,
+                        {ymin} + (i % 89) / 89.0 * {height} + random() * 0.0005
+                    ), 4326)
+                END AS geom,
+                jsonb_build_object('amenity', 'bench') AS tags
+            FROM generate_series(1, {count}) AS i
+            """
+        ).format(
+            table=sql.Identifier(BENCH_TABLE),
+            xmin=sql.Literal(BBOX[0]),
+            ymin=sql.Literal(BBOX[1]),
+            width=sql.Literal(BBOX[2] - BBOX[0]),
+            height=sql.Literal(BBOX[3] - BBOX[1]),
+            count=sql.Literal(count),
+        )
+    )
+    cursor.execute(sql.SQL("CREATE INDEX ON {} USING GIST (geom)").format(sql.Identifier(BENCH_TABLE)))
+    cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(BENCH_TABLE)))
+
+
+def run_cluster_query(cursor, node):
+    """Build and execute the cluster CTE, returning the elapsed time in ms."""
+    from lib.ctes.construct_cluster import construct_cluster_cte
+    from lib.ctes.construct_search_area import construct_search_area_cte
+    from lib.executors import python_cluster_tables
+
+    start = time.perf_counter()
+    query = sql.SQL("WITH {}, {} SELECT COUNT(*) FROM {}").format(
+        construct_search_area_cte("bbox"),
+        construct_cluster_cte(node),
+        sql.Identifier(str(node["id"])),
+    )
+    with python_cluster_tables(cursor.connection, {"nodes": [node]}):
+        cursor.execute(query)
+        cursor.fetchone()
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 50_000, 100_000, 250_000])
+    parser.add_argument("--max-distance", default="50m")
+    parser.add_argument("--min-points", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    from lib.ctes.construct_cluster import CLUSTER_STRATEGIES
+    from lib.utils import set_area
+
+    os.environ["TABLE_VIEW"] = BENCH_TABLE
+    node = {
+        "id": 1,
+        "name": "bench",
+        "type": "cluster",
+        "maxDistance": args.max_distance,
+        "minPoints": args.min_points,
+        "filters": [{"key": "amenity", "operator": "=", "value": "bench"}],
+    }
+
+    db = connect()
+    cursor = db.cursor()
+    app = Flask(__name__)
+
+    print(f"{'points':>10} " + " ".join(f"{strategy + ' ms':>12}" for strategy in CLUSTER_STRATEGIES))
+    with app.app_context():
+        g.db = db
+        set_area({"area": {"type": "bbox", "bbox": BBOX}})
+
+        for size in args.sizes:
+            fill_points(cursor, size)
+            timings = []
+            for strategy in CLUSTER_STRATEGIES:
+                os.environ["CLUSTER_STRATEGY"] = strategy
+                timings.append(min(run_cluster_query(cursor, node) for _ in range(args.repeat)))
+            print(f"{size:>10} " + " ".join(f"{ms:>12.1f}" for ms in timings))
+
+
+if __name__ == "__main__":
+    main()
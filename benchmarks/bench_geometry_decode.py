@@ -0,0 +1,164 @@
+"""
+Benchmark geometry decoding in the `/run-spot-query` result path.
+
+Compares, for a synthetic result set:
+
+- `per-row hex`: the previous path, where psycopg2 returned hex WKB text and
+  every row was decoded with `wkb.loads(..., hex=True)`, mapped to GeoJSON and
+  re-parsed with `shape` to compute its centroid,
+- `vectorized bytes`: WKB `bytes` (as from `lib.database.wkb_cursor`) with one
+  `shapely.from_wkb`, `shapely.to_geojson` and `shapely.centroid` call.
+
+With `--database`, the geometries of the first `--rows` rows of `TABLE_VIEW`
+(default "germany") are fetched from PostGIS (the usual `DATABASE_*`
+environment variables) in both ways the executors have used:
+
+- `geometry + fromhex`: `SELECT geom`, decoded by a per-value Python
+  typecaster calling `bytes.fromhex` on the hex EWKB text,
+- `ST_AsBinary bytea`: `SELECT ST_AsBinary(geom)` on `lib.database.wkb_cursor`,
+  unescaped by psycopg2 in C.
+
+psycopg2 only speaks the text protocol, so `bytea` is hex-escaped on the wire
+as well (`\\x` + 2 characters per byte); the report lists the bytes on the
+wire (computed server-side from the text representation) next to the raw
+WKB size and the fetch time.
+
+Usage:
+    python benchmarks/bench_geometry_decode.py [--rows 200000] [--repeat 3]
+    python benchmarks/bench_geometry_decode.py --database [--rows 200000] [--repeat 3]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import psycopg2  # noqa: E402
+import shapely  # noqa: E402
+from psycopg2 import sql  # noqa: E402
+from shapely.geometry import Point, Polygon  # noqa: E402
+
+from lib.database import wkb_cursor  # noqa: E402
+from lib.utils import add_center_to_geojson, geom_bin_to_geojson, results_to_geojson  # noqa: E402
+
+
+def make_wire_rows(count, rng):
+    geometries = []
+    for i in range(count):
+        lon, lat = 13.0 + rng.random(), 52.0 + rng.random()
+        if i % 3:
+            geometries.append(Point(lon, lat))
+        else:
+            ring = [(lon + rng.random() / 1000, lat + rng.random() / 1000) for _ in range(20)]
+            geometries.append(Polygon(ring))
+    return list(shapely.to_wkb(geometries, hex=True))
+
+
+def per_row_hex(wire):
+    features = []
+    for value in wire:
+        feature = {"type": "Feature", "geometry": geom_bin_to_geojson(value), "properties": {}}
+        add_center_to_geojson(feature)
+        features.append(feature)
+    return features
+
+
+def vectorized_bytes(wire):
+    rows = [("set", bytes.fromhex(value)) for value in wire]
+    return results_to_geojson(rows, ["set_name", "geom"])[0]["features"]
+
+
+def measure(fn, wire, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(wire)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def connect():
+    return psycopg2.connect(
+        dbname=os.getenv("DATABASE_NAME"),
+        user=os.getenv("DATABASE_USER"),
+        password=os.getenv("DATABASE_PASSWORD"),
+        host=os.getenv("DATABASE_HOST"),
+        port=os.getenv("DATABASE_PORT"),
+    )
+
+
+def hex_geometry_cursor(db):
+    """A cursor decoding `geometry` values with a per-value `bytes.fromhex` callback."""
+    cursor = db.cursor()
+    cursor.execute("SELECT 'geometry'::regtype::oid")
+    geometry = psycopg2.extensions.new_type(
+        (cursor.fetchone()[0],), "GEOMETRY", lambda value, cursor: bytes.fromhex(value) if value is not None else None
+    )
+    psycopg2.extensions.register_type(geometry, cursor)
+    return cursor
+
+
+def bench_database(rows, repeat):
+    db = connect()
+    sample = sql.SQL("SELECT geom FROM {table} LIMIT {rows}").format(
+        table=sql.Identifier(os.getenv("TABLE_VIEW", "germany")), rows=sql.Literal(rows)
+    )
+
+    cursor = db.cursor()
+    cursor.execute(
+        sql.SQL(
+            "SELECT count(*), sum(octet_length(geom::text)), sum(2 + 2 * octet_length(ST_AsBinary(geom))), "
+            "sum(octet_length(ST_AsBinary(geom))) FROM ({sample}) AS sample"
+        ).format(sample=sample)
+    )
+    count, geometry_wire, bytea_wire, wkb_bytes = cursor.fetchone()
+
+    paths = [
+        ("geometry + fromhex", hex_geometry_cursor, sample, geometry_wire),
+        (
+            "ST_AsBinary bytea",
+            wkb_cursor,
+            sql.SQL("SELECT ST_AsBinary(geom) FROM ({sample}) AS sample").format(sample=sample),
+            bytea_wire,
+        ),
+    ]
+
+    print(f"{count} rows, {wkb_bytes / 1e6:.1f} MB of WKB")
+    print(f"{'path':<20} {'wire MB':>8} {'fetch ms':>10} {'us / row':>9}")
+    for name, open_cursor, query, wire_bytes in paths:
+        def fetch(_):
+            cursor = open_cursor(db)
+            cursor.execute(query)
+            shapely.from_wkb([row[0] for row in cursor.fetchall()])
+
+        elapsed = measure(fetch, None, repeat)
+        print(f"{name:<20} {wire_bytes / 1e6:>8.1f} {elapsed * 1000:>10.1f} {elapsed * 1e6 / max(count, 1):>9.2f}")
+
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--database", action="store_true", help="Fetch geometries from PostGIS")
+    args = parser.parse_args()
+
+    if args.database:
+        bench_database(args.rows, args.repeat)
+        return
+
+    wire = make_wire_rows(args.rows, random.Random(42))
+    wire_bytes = sum(len(value) for value in wire)
+
+    print(f"{'path':<18} {'wire MB':>8} {'decode ms':>10} {'us / row':>9}")
+    for name, fn in [("per-row hex", per_row_hex), ("vectorized bytes", vectorized_bytes)]:
+        elapsed = measure(fn, wire, args.repeat)
+        print(f"{name:<18} {wire_bytes / 1e6:>8.1f} {elapsed * 1000:>10.1f} {elapsed * 1e6 / args.rows:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark peak memory and CPU of the `/run-spot-query` result path.
+
+Each variant runs in its own subprocess on the same synthetic result set
+(200k rows by default, shaped like the rows of `construct_relations`) so that
+peak RSS is measured independently:
+
+- `dict rows`: the previous path, copying every `DictRow` into a dict, deleting
+  `geom` from it, and walking the rows twice more for the set names and counts,
+- `tuple rows`: `results_to_geojson(rows, columns)`, which builds features and
+  set counts in a single pass over plain tuples.
+
+Usage:
+    python benchmarks/bench_result_path.py [--rows 200000]
+"""
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from collections import Counter, OrderedDict
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import shapely  # noqa: E402
+from psycopg2.extras import DictRow  # noqa: E402
+from shapely.geometry import Point  # noqa: E402
+
+from lib.serializer import JSONFragment  # noqa: E402
+from lib.utils import results_to_geojson  # noqa: E402
+
+COLUMNS = ["set_name", "osm_ids", "geom", "tags", "primitive_type"]
+
+
+def make_rows(count):
+    rng = random.Random(42)
+    wkbs = shapely.to_wkb([Point(13.0 + rng.random(), 52.0 + rng.random()) for _ in range(count)])
+    return [
+        (f"set {i % 4}", [f"node/{i}"], wkb, {"amenity": "cafe", "name": f"Cafe {i}"}, "node")
+        for i, wkb in enumerate(wkbs)
+    ]
+
+
+def fetch_dict_rows(rows):
+    """Build `DictRow`s the way `DictCursor` does while fetching."""
+    cursor = SimpleNamespace(
+        index=OrderedDict((column, i) for i, column in enumerate(COLUMNS)),
+        description=COLUMNS,
+    )
+    records = []
+    for row in rows:
+        record = DictRow(cursor)
+        record[:] = row
+        records.append(record)
+    return records
+
+
+def dict_rows(rows):
+    results = [dict(record) for record in fetch_dict_rows(rows)]
+
+    geometries = shapely.from_wkb([result["geom"] for result in results])
+    geometries_geojson = shapely.to_geojson(geometries)
+    centroids = shapely.centroid(geometries)
+    features = []
+    for result, geom_geojson, x, y in zip(
+        results, geometries_geojson, shapely.get_x(centroids).tolist(), shapely.get_y(centroids).tolist()
+    ):
+        del result["geom"]
+        result["center"] = {"type": "Point", "coordinates": (x, y)}
+        features.append({"type": "Feature", "geometry": JSONFragment(geom_geojson), "properties": result})
+
+    distinct_set_names = list({result["set_name"] for result in results})
+    set_name_counts = dict(Counter(result["set_name"] for result in results))
+    return features, distinct_set_names, set_name_counts
+
+
+def tuple_rows(rows):
+    geojson, set_name_counts = results_to_geojson(rows, COLUMNS)
+    return geojson["features"], list(set_name_counts), set_name_counts
+
+
+VARIANTS = {"dict rows": dict_rows, "tuple rows": tuple_rows}
+
+
+def run_variant(name, count):
+    rows = make_rows(count)
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start_cpu, start_wall = time.process_time(), time.perf_counter()
+    VARIANTS[name](rows)
+    cpu, wall = time.process_time() - start_cpu, time.perf_counter() - start_wall
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"{name:<12} {cpu * 1000:>10.1f} {wall * 1000:>10.1f} {peak_rss / 1024:>14.1f} {(peak_rss - baseline_rss) / 1024:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--variant", choices=VARIANTS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.variant, args.rows)
+        return
+
+    print(f"{'variant':<12} {'cpu ms':>10} {'wall ms':>10} {'peak RSS MiB':>14} {'growth MiB':>12}")
+    sys.stdout.flush()
+    for name in VARIANTS:
+        subprocess.run([sys.executable, __file__, "--rows", str(args.rows), "--variant", name], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark JSON serialization of `/run-spot-query` style responses.
+
+Builds a synthetic FeatureCollection (points and small polygons, with tags and
+centers like `results_to_geojson` produces) and reports the time needed to
+serialize it, normalized to 100k features, for:
+
+- `stdlib-sorted`: what `flask.jsonify` did (stdlib encoder, sorted keys),
+- every backend registered in `lib.serializer.SERIALIZERS`,
+- the same backends with geometries passed as pre-encoded `JSONFragment`s.
+
+Usage:
+    python benchmarks/bench_serialization.py [--features 100000] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from lib.serializer import SERIALIZERS, JSONFragment, dumps  # noqa: E402
+
+
+def make_feature(i, rng):
+    lon, lat = 13.0 + rng.random(), 52.0 + rng.random()
+
+    if i % 3:
+        geometry = {"type": "Point", "coordinates": (lon, lat)}
+    else:
+        ring = [(lon + rng.random() / 1000, lat + rng.random() / 1000) for _ in range(20)]
+        ring.append(ring[0])
+        geometry = {"type": "Polygon", "coordinates": (tuple(ring),)}
+
+    return {
+        "type": "Feature",
+        "geometry": geometry,
+        "properties": {
+            "set_name": f"set {i % 4}",
+            "osm_ids": [f"node/{i}"],
+            "tags": {"amenity": "cafe", "name": f"Cafe {i}", "opening_hours": "Mo-Fr 08:00-18:00"},
+            "primitive_type": "node",
+            "center": {"type": "Point", "coordinates": (lon, lat)},
+        },
+    }
+
+
+def make_payload(features):
+    return {
+        "results": {"type": "FeatureCollection", "features": features},
+        "sets": {"distinct_sets": ["set 0", "set 1", "set 2", "set 3"], "stats": {}},
+        "timing": {},
+        "status": "success",
+    }
+
+
+def measure(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--features", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    features = [make_feature(i, rng) for i in range(args.features)]
+    payload = make_payload(features)
+
+    fragment_features = [
+        {**feature, "geometry": JSONFragment(json.dumps(feature["geometry"]))}
+        for feature in features
+    ]
+    fragment_payload = make_payload(fragment_features)
+
+    cases = [("stdlib-sorted", lambda: json.dumps(payload, sort_keys=True).encode("utf-8"))]
+    for name in SERIALIZERS:
+        cases.append((name, lambda name=name: dumps(payload, name)))
+        cases.append((f"{name}+fragments", lambda name=name: dumps(fragment_payload, name)))
+
+    scale = 100_000 / args.features
+    print(f"{'serializer':<20} {'ms / 100k features':>20} {'MB':>8}")
+    for name, fn in cases:
+        elapsed, size = measure(fn, args.repeat)
+        print(f"{name:<20} {elapsed * 1000 * scale:>20.1f} {size / 1e6:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
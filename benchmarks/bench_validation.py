@@ -0,0 +1,154 @@
+"""
+Benchmark spot query validation on deeply nested filter trees.
+
+Builds spot queries whose nodes carry `and`/`or` filter trees of increasing
+depth and reports the time per validation for:
+
+- `jsonschema.validate`: what the routes did (schema check and a new
+  validator on every call) followed by `validate_spot_query`,
+- `compiled`: the validator compiled once, followed by `validate_spot_query`,
+- `combined`: `lib.validation.validate_spot_query_request` (fast path).
+
+Before timing, randomly corrupted queries are validated with the old and the
+new path to check that both accept and reject the same inputs with the same
+errors; the script exits with status 1 on a mismatch.
+
+Usage:
+    python benchmarks/bench_validation.py [--depths 2,4,6,8] [--nodes 4] [--repeat 200] [--checks 2000]
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from jsonschema import exceptions, validate as validate_json_schema  # noqa: E402
+from lib.utils import validate_spot_query  # noqa: E402
+from lib.validation import compile_spot_query_schema, validate_spot_query_request  # noqa: E402
+
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), "..", "app", "schemas", "spot_query.json")
+
+
+def make_filters(depth, rng, fanout=2):
+    if depth == 0:
+        return {"key": rng.choice(["amenity", "shop", "name", "height"]), "operator": rng.choice("=<>~"), "value": "x"}
+    return {rng.choice(["and", "or"]): [make_filters(depth - 1, rng, fanout) for _ in range(fanout)]}
+
+
+def make_spot_query(depth, nodes, rng):
+    return {
+        "area": {"type": "bbox", "bbox": [13.3, 52.4, 13.5, 52.6]},
+        "nodes": [
+            {"id": i, "name": f"node {i}", "type": "nwr", "filters": [make_filters(depth, rng)]}
+            for i in range(nodes)
+        ],
+        "edges": [
+            {"source": i, "target": i + 1, "type": "distance", "value": "100 m"} for i in range(nodes - 1)
+        ],
+    }
+
+
+def corrupt(spot_query, rng):
+    """Apply one random change that may or may not invalidate the query."""
+    spot_query = copy.deepcopy(spot_query)
+    containers = []
+
+    def collect(value):
+        if isinstance(value, dict):
+            containers.append(value)
+            for child in value.values():
+                collect(child)
+        elif isinstance(value, list):
+            containers.append(value)
+            for child in value:
+                collect(child)
+
+    collect(spot_query)
+    target = rng.choice(containers)
+    replacement = rng.choice([None, 1, 1.5, True, "x", "=", "nwr", "cluster", [], {}, {"key": "a"}])
+
+    if isinstance(target, dict) and target:
+        key = rng.choice(list(target) + ["and", "or", "key", "name", "extra"])
+        if rng.random() < 0.3 and key in target:
+            del target[key]
+        else:
+            target[key] = replacement
+    elif isinstance(target, list) and target:
+        index = rng.randrange(len(target))
+        if rng.random() < 0.3:
+            target.append(copy.deepcopy(target[index]))
+        else:
+            target[index] = replacement
+
+    return spot_query
+
+
+def outcome(fn, spot_query):
+    try:
+        fn(spot_query)
+        return "valid"
+    except exceptions.ValidationError as e:
+        return f"schema: {e.message}"
+    except ValueError as e:
+        return f"value: {e}"
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def best_of(fn, spot_query, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(spot_query)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depths", default="2,4,6,8")
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--checks", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with open(SCHEMA_PATH) as file:
+        schema = json.load(file)
+    validator = compile_spot_query_schema(schema)
+
+    def old(spot_query):
+        validate_json_schema(spot_query, schema)
+        validate_spot_query(spot_query)
+
+    def compiled(spot_query):
+        validator.validate(spot_query)
+        validate_spot_query(spot_query)
+
+    def combined(spot_query):
+        validate_spot_query_request(spot_query, validator)
+
+    rng = random.Random(args.seed)
+    mismatches = 0
+    for _ in range(args.checks):
+        spot_query = corrupt(make_spot_query(rng.randint(0, 3), rng.randint(1, 3), rng), rng)
+        expected, actual = outcome(old, spot_query), outcome(combined, spot_query)
+        if expected != actual:
+            mismatches += 1
+            print(f"mismatch: {expected!r} != {actual!r}\n  {json.dumps(spot_query)}")
+    print(f"equivalence: {args.checks} corrupted queries, {mismatches} mismatches")
+
+    print(f"{'depth':>5} {'conditions':>10} {'validate [ms]':>14} {'compiled [ms]':>14} {'combined [ms]':>14}")
+    for depth in [int(depth) for depth in args.depths.split(",")]:
+        spot_query = make_spot_query(depth, args.nodes, random.Random(depth))
+        repeat = max(1, args.repeat >> max(depth - 4, 0))
+        timings = [best_of(fn, spot_query, repeat) * 1000 for fn in (old, compiled, combined)]
+        print(f"{depth:>5} {args.nodes * 2 ** depth:>10} " + " ".join(f"{t:>14.3f}" for t in timings))
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Randomized equivalence check of the filter normalization.
+
+Generates random `and`/`or` filter trees (duplicates, nested single-member
+groups, same-key alternatives, presence conditions, numeric ranges and
+contradictions included) and random tag sets, and checks that
+`lib.filters.normalize_filters` never changes which features match. Matching
+is evaluated in Python with the semantics of the SQL produced by
+`construct_filter` (a missing tag never matches, no negation is involved).
+
+Also reports how much the trees shrink and how many are detected as always
+false. Exits with status 1 on the first counterexample, printing it.
+
+Usage:
+    python benchmarks/check_filter_normalization.py [--trees 20000] [--seed 1]
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from lib.ctes.construct_where_clause import sanitize_for_regex  # noqa: E402
+from lib.filters import DIMENSION_KEYS, FALSE, normalize_filters  # noqa: E402
+from lib.utils import distance_to_meters  # noqa: E402
+
+KEYS = ["amenity", "shop", "name", "height", "levels"]
+VALUES = ["a", "b", "c", "***any***"]
+NUMBERS = ["1", "2", "5", "10m", "0.5km"]
+
+
+def random_condition(rng):
+    key = rng.choice(KEYS)
+    operator = rng.choice(["=", "=", "=", "~", ">", "<"])
+
+    if operator in (">", "<"):
+        value = rng.choice(NUMBERS)
+    elif key in DIMENSION_KEYS:
+        value = rng.choice(NUMBERS)
+    else:
+        value = rng.choice(VALUES)
+
+    return {"key": key, "operator": operator, "value": value}
+
+
+def random_tree(rng, depth=0):
+    if depth >= 3 or rng.random() < 0.45:
+        return random_condition(rng)
+
+    members = [random_tree(rng, depth + 1) for _ in range(rng.randint(1, 4))]
+    if rng.random() < 0.2:
+        members.append(json.loads(json.dumps(rng.choice(members))))
+
+    return {rng.choice(["and", "or"]): members}
+
+
+def random_tags(rng):
+    tags = {}
+    for key in KEYS:
+        if rng.random() < 0.6:
+            tags[key] = rng.choice(["a", "b", "c", "1", "2", "5", "10", "500", "x1"])
+    return tags
+
+
+def matches(filter, tags):
+    """Python evaluation of the SQL condition built by `construct_filter`."""
+    if "and" in filter:
+        return all(matches(f, tags) for f in filter["and"])
+    if "or" in filter:
+        return any(matches(f, tags) for f in filter["or"])
+
+    key, operator, value = filter["key"], filter["operator"], filter["value"]
+    tag = tags.get(key)
+
+    if operator == "in":
+        return tag in value
+
+    if key in DIMENSION_KEYS or operator in (">", "<"):
+        value = distance_to_meters(value)
+
+    if value == "***any***":
+        return key in tags
+
+    if tag is None:
+        return False
+
+    if operator == "~":
+        return re.search(sanitize_for_regex(value).lower(), re.sub(r"[^A-Za-z0-9]", "", tag).lower()) is not None
+
+    if operator in (">", "<"):
+        if not re.match(r"^[0-9]+(\.[0-9]+)?$", tag):
+            return False
+        return float(tag) > float(value) if operator == ">" else float(tag) < float(value)
+
+    return tag == value
+
+
+def size(filter):
+    if "and" in filter or "or" in filter:
+        return 1 + sum(size(f) for f in filter.get("and", filter.get("or")))
+    return 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trees", type=int, default=20_000)
+    parser.add_argument("--tags", type=int, default=50, help="random tag sets per tree")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tag_sets = [random_tags(rng) for _ in range(500)] + [{}]
+    before = after = always_false = 0
+
+    for _ in range(args.trees):
+        filters = [random_tree(rng) for _ in range(rng.randint(1, 3))]
+        original = json.loads(json.dumps(filters))
+        normalized = normalize_filters(filters)
+
+        before += sum(size(f) for f in original)
+        after += sum(size(f) for f in normalized)
+        always_false += normalized == [FALSE]
+
+        for tags in rng.sample(tag_sets, args.tags) + [{}]:
+            expected = all(matches(f, tags) for f in original)
+            actual = all(matches(f, tags) for f in normalized)
+            if expected != actual:
+                print("Counterexample:")
+                print("  filters:   ", json.dumps(original))
+                print("  normalized:", json.dumps(normalized))
+                print("  tags:      ", json.dumps(tags))
+                print(f"  expected {expected}, got {actual}")
+                sys.exit(1)
+
+    print(f"{args.trees} trees equivalent")
+    print(f"nodes before: {before}, after: {after} ({after / before:.0%})")
+    print(f"always false: {always_false}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Differential check and benchmark of the spot query executors.
+
+An unlogged table with the `TABLE_VIEW` schema (`node_id`, `primitive_type`,
+`geom`, `tags`) is filled with random points and small polygons tagged with
+a few amenities. A set of spot queries covering `distance` and `contains`
+edges, chained joins, several conditions on one node and isolated nodes is
+then run with every executor of `lib.executors`. The rows of the "hybrid"
+and "prefetch" executors must match the "sql" ones exactly (compared as sets,
+with geometries as WKB); the script exits with status 1 on any difference
+and reports the timings. The fixture table is dropped at the end (it is not a
+temporary table, so the pooled connections of "prefetch" can read it).
+
+Requires a PostGIS database reachable through the usual `DATABASE_*`
+environment variables.
+
+Usage:
+    python benchmarks/compare_executors.py [--points 20000] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from flask import Flask, g  # noqa: E402
+from psycopg2 import sql  # noqa: E402
+
+BENCH_TABLE = "bench_executor_features"
+BBOX = [13.30, 52.45, 13.50, 52.55]
+AMENITIES = ["bench", "cafe", "school", "park"]
+
+
+COMPARED_EXECUTORS = ["hybrid", "prefetch"]
+
+
+def database_config():
+    return {
+        "name": os.getenv("DATABASE_NAME"),
+        "user": os.getenv("DATABASE_USER"),
+        "password": os.getenv("DATABASE_PASSWORD"),
+        "host": os.getenv("DATABASE_HOST"),
+        "port": os.getenv("DATABASE_PORT"),
+    }
+
+
+def fill_features(cursor, count):
+    """Create the fixture table: points for most rows, small squares for parks."""
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(BENCH_TABLE)))
+    cursor.execute(
+        sql.SQL(
+            """
+            CREATE UNLOGGED TABLE {table} AS
+            SELECT
+                i AS node_id,
+                CASE WHEN amenity = 'park' THEN 'way' ELSE 'node' END AS primitive_type,
+                CASE WHEN amenity = 'park'
+                    THEN ST_Expand(point, 0.001)
+                    ELSE point
+                END AS geom,
+                jsonb_build_object('amenity', amenity, 'name', 'feature ' || i) AS tags
+            FROM (
+                SELECT
+                    i,
+                    ({amenities})[1 + i % {amenity_count}] AS amenity,
+                    ST_SetSRID(ST_MakePoint({xmin} + random() * {width}, {ymin} + random() * {height}), 4326) AS point
+                FROM generate_series(1, {count}) AS i
+            ) AS features
+            """
+        ).format(
+            table=sql.Identifier(BENCH_TABLE),
+            amenities=sql.Literal(AMENITIES),
+            amenity_count=sql.Literal(len(AMENITIES)),
+            xmin=sql.Literal(BBOX[0]),
+            ymin=sql.Literal(BBOX[1]),
+            width=sql.Literal(BBOX[2] - BBOX[0]),
+            height=sql.Literal(BBOX[3] - BBOX[1]),
+            count=sql.Literal(count),
+        )
+    )
+    cursor.execute(sql.SQL("CREATE INDEX ON {} USING GIST (geom)").format(sql.Identifier(BENCH_TABLE)))
+    cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(BENCH_TABLE)))
+    cursor.connection.commit()
+
+
+def node(id, amenity):
+    return {
+        "id": id,
+        "name": amenity,
+        "type": "nwr",
+        "filters": [{"key": "amenity", "operator": "=", "value": amenity}],
+    }
+
+
+def spot_queries():
+    """Spot queries exercising the relation shapes supported by all executors."""
+    bbox = {"type": "bbox", "bbox": BBOX}
+    bench, cafe, school, park = (node(i, amenity) for i, amenity in enumerate(AMENITIES, start=1))
+
+    return {
+        "distance": {
+            "area": bbox,
+            "nodes": [cafe, bench],
+            "edges": [{"source": 2, "target": 1, "type": "distance", "value": "30m"}],
+        },
+        "contains": {
+            "area": bbox,
+            "nodes": [park, bench],
+            "edges": [{"source": 4, "target": 1, "type": "contains"}],
+        },
+        "chain": {
+            "area": bbox,
+            "nodes": [school, cafe, bench],
+            "edges": [
+                {"source": 3, "target": 2, "type": "distance", "value": "100m"},
+                {"source": 2, "target": 1, "type": "distance", "value": "20m"},
+            ],
+        },
+        "two conditions": {
+            "area": bbox,
+            "nodes": [school, park, bench],
+            "edges": [
+                {"source": 3, "target": 4, "type": "distance", "value": "150m"},
+                {"source": 3, "target": 1, "type": "distance", "value": "50m"},
+                {"source": 4, "target": 1, "type": "contains"},
+            ],
+        },
+        "isolated node": {
+            "area": bbox,
+            "nodes": [cafe, bench, park],
+            "edges": [{"source": 2, "target": 1, "type": "distance", "value": "30m"}],
+        },
+    }
+
+
+def normalize(rows):
+    """Make rows comparable: geometries as bytes, tags as sorted JSON."""
+    return {
+        (
+            set_name,
+            tuple(osm_ids),
+            bytes(geom),
+            json.dumps(tags, sort_keys=True),
+            primitive_type,
+            tuple(sorted(primary_osm_ids)) if primary_osm_ids is not None else None,
+        )
+        for set_name, osm_ids, geom, tags, primitive_type, primary_osm_ids in rows
+    }
+
+
+def timed(fn, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    from lib.constructor import construct_query_from_graph
+    import lib.database as database
+    from lib.executors import RESULT_COLUMNS, execute_hybrid, execute_prefetch, execute_sql
+    from lib.utils import clean_spot_query, set_area
+
+    os.environ["TABLE_VIEW"] = BENCH_TABLE
+    database.initialize_connection_pool(database_config())
+    db = database.db_pool.getconn()
+    fill_features(db.cursor(), args.points)
+    app = Flask(__name__)
+    executors = {"hybrid": execute_hybrid, "prefetch": execute_prefetch}
+    failures = 0
+
+    print(f"{'query':<16} {'rows':>8} {'sql ms':>10} " + " ".join(f"{name + ' ms':>12}" for name in COMPARED_EXECUTORS))
+    try:
+        with app.app_context():
+            g.db = db
+
+            for name, spot_query in spot_queries().items():
+                cleaned = clean_spot_query(spot_query)
+                set_area(cleaned)
+                query = construct_query_from_graph(cleaned)
+
+                sql_ms, (columns, sql_rows) = timed(lambda: execute_sql(db, query), args.repeat)
+                expected = normalize(sql_rows)
+                timings, mismatches = [], []
+
+                for executor in COMPARED_EXECUTORS:
+                    ms, (executor_columns, rows) = timed(lambda: executors[executor](db, cleaned), args.repeat)
+                    actual = normalize(rows)
+                    timings.append(ms)
+
+                    if executor_columns != columns or actual != expected or len(rows) != len(sql_rows):
+                        mismatches.append(
+                            f"{executor}: only sql {len(expected - actual)}, only {executor} {len(actual - expected)}"
+                        )
+
+                failures += bool(mismatches)
+                print(
+                    f"{name:<16} {len(sql_rows):>8} {sql_ms:>10.1f} "
+                    + " ".join(f"{ms:>12.1f}" for ms in timings)
+                    + ("  ok" if not mismatches else "  MISMATCH")
+                )
+                for mismatch in mismatches:
+                    print(f"    {mismatch}")
+
+                if columns != RESULT_COLUMNS:
+                    print(f"    unexpected sql columns: {columns}")
+                    failures += 1
+    finally:
+        db.rollback()
+        db.cursor().execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(BENCH_TABLE)))
+        db.commit()
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
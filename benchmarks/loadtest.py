@@ -0,0 +1,160 @@
+"""
+Local load test of the gunicorn worker models.
+
+For every worker model in `--models` (`sync`, `gthread`, `gevent`), gunicorn is
+started with `app/gunicorn.conf.py` and `GUNICORN_WORKER_CLASS` set
+accordingly; `--workers` and `--threads` override the defaults of the config.
+Once it answers, `--concurrency` client threads send requests on keep-alive
+connections for `--duration` seconds, and the script reports requests per
+second, latency percentiles and the number of failed requests per model.
+
+By default the spot query in `--query` (a JSON file) is sent to
+`/run-spot-query` with the result cache and coalescing disabled, so that every
+request reaches the database; without `--query`, `GET /metrics` measures the
+bare request overhead. Models whose dependencies are missing (gevent requires
+`gevent` and `psycogreen`) are skipped.
+
+The `DATABASE_*`, `TABLE_VIEW`, `JWT_SECRET` and `TIMEOUT` environment
+variables must be set and point to a reachable database.
+
+Usage:
+    python benchmarks/loadtest.py --query query.json [--models sync,gthread,gevent]
+        [--concurrency 32] [--duration 20] [--workers 2] [--threads 10] [--port 5056]
+"""
+import argparse
+import http.client
+import importlib.util
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+MODEL_REQUIREMENTS = {"sync": [], "gthread": [], "gevent": ["gevent", "psycogreen"]}
+
+
+def wait_until_ready(port, server, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            return False
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            connection.request("GET", "/metrics")
+            connection.getresponse().read()
+            return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def client(port, method, path, body, stop, latencies, errors):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    headers = {"Content-Type": "application/json"} if body else {}
+
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors.append(response.status)
+            else:
+                latencies.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+
+    connection.close()
+
+
+def run_model(model, args, body):
+    environment = {
+        **os.environ,
+        "GUNICORN_WORKER_CLASS": model,
+        "GUNICORN_BIND": f"127.0.0.1:{args.port}",
+        "RESULT_CACHE_SIZE": "0",
+        "COALESCE": "false",
+    }
+    if args.workers:
+        environment["GUNICORN_WORKERS"] = str(args.workers)
+    if args.threads:
+        environment["GUNICORN_THREADS"] = str(args.threads)
+        environment["GUNICORN_WORKER_CONNECTIONS"] = str(args.threads)
+
+    server = subprocess.Popen(
+        ["gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=APP_DIR,
+        env=environment,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    try:
+        if not wait_until_ready(args.port, server):
+            print(f"{model:>8}: gunicorn did not start")
+            return
+
+        method, path = ("POST", "/run-spot-query") if body else ("GET", "/metrics")
+        stop = threading.Event()
+        latencies, errors = [], []
+        clients = [
+            threading.Thread(target=client, args=(args.port, method, path, body, stop, latencies, errors))
+            for _ in range(args.concurrency)
+        ]
+
+        start = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        if len(latencies) >= 2:
+            quantiles = statistics.quantiles(latencies, n=100)
+            p50, p95, p99 = (quantiles[i] * 1000 for i in (49, 94, 98))
+        else:
+            p50 = p95 = p99 = float("nan")
+
+        print(
+            f"{model:>8}: {len(latencies) / elapsed:>8.1f} req/s  "
+            f"p50 {p50:>7.1f} ms  p95 {p95:>7.1f} ms  p99 {p99:>7.1f} ms  errors {len(errors)}"
+        )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--query", help="JSON file with the spot query to send")
+    parser.add_argument("--models", default="sync,gthread,gevent")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--port", type=int, default=5056)
+    args = parser.parse_args()
+
+    body = None
+    if args.query:
+        with open(args.query, "rb") as file:
+            body = file.read()
+
+    for model in args.models.split(","):
+        missing = [module for module in MODEL_REQUIREMENTS[model] if importlib.util.find_spec(module) is None]
+        if missing:
+            print(f"{model:>8}: skipped, missing {', '.join(missing)}")
+            continue
+        run_model(model, args, body)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+"""
+Measure worker cold start: import time and first-request latency.
+
+Two measurements:
+
+- Import time: `import app` is run in fresh interpreters (`--imports` times)
+  and the median wall time is reported, together with the slowest top-level
+  imports according to `python -X importtime`.
+- First request (`--serve`): gunicorn is started with `app/gunicorn.conf.py`
+  (overridable with `--workers`), and the time until it answers `/metrics` is
+  reported. Then a spot query (`--query`, a JSON file) is sent twice to show
+  the latency of the first request of a worker next to a warm one. Start with
+  `--workers 1` so that both requests hit the same worker. The result cache
+  and coalescing are disabled for the server.
+
+The `DATABASE_*`, `TABLE_VIEW`, `JWT_SECRET` and `TIMEOUT` environment
+variables must be set; `--serve` additionally needs a reachable database.
+
+Usage:
+    python benchmarks/measure_startup.py [--imports 5] [--top 10]
+    python benchmarks/measure_startup.py --serve --query query.json [--workers 1] [--port 5055]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+
+def measure_imports(runs, top):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import app"], cwd=APP_DIR, check=True)
+        timings.append(time.perf_counter() - start)
+
+    print(f"import app: median {statistics.median(timings) * 1000:.0f} ms over {runs} runs (including interpreter start)")
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=APP_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+    # Lines look like "import time:  self [us] | cumulative | <indent>module"
+    modules = []
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)", line)
+        if match and len(match.group(3)) <= 3:
+            modules.append((int(match.group(2)), match.group(4)))
+
+    print("slowest top-level imports (cumulative):")
+    for cumulative, module in sorted(modules, reverse=True)[:top]:
+        print(f"  {cumulative / 1000:>8.1f} ms  {module}")
+
+
+def request(url, body=None):
+    data = body.encode() if body is not None else None
+    headers = {"Content-Type": "application/json"} if body is not None else {}
+    start = time.perf_counter()
+    with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers)) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def measure_first_request(port, workers, query_path):
+    environment = {**os.environ, "RESULT_CACHE_SIZE": "0", "COALESCE": "false"}
+    command = ["gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}", "app:app"]
+    if workers:
+        command += ["--workers", str(workers)]
+
+    start = time.perf_counter()
+    server = subprocess.Popen(command, cwd=APP_DIR, env=environment)
+
+    try:
+        base = f"http://127.0.0.1:{port}"
+        while True:
+            try:
+                request(f"{base}/metrics")
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if server.poll() is not None:
+                    sys.exit("gunicorn exited before answering")
+                time.sleep(0.05)
+        print(f"server start to first response: {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        if query_path:
+            with open(query_path) as file:
+                body = file.read()
+            first = request(f"{base}/run-spot-query", body)
+            second = request(f"{base}/run-spot-query", body)
+            print(f"first spot query: {first * 1000:.0f} ms, second: {second * 1000:.0f} ms")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--imports", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--serve", action="store_true")
+    parser.add_argument("--query", help="JSON file with a spot query for the first-request measurement")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--port", type=int, default=5055)
+    args = parser.parse_args()
+
+    measure_imports(args.imports, args.top)
+
+    if args.serve:
+        measure_first_request(args.port, args.workers, args.query)
+
+
+if __name__ == "__main__":
+    main()
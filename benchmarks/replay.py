@@ -0,0 +1,212 @@
+"""
+Replay a recorded spot query corpus and diff two runs.
+
+The corpus is the query log written with `QUERY_LOG_PATH` (see
+`app/lib/recorder.py`); rotated files can be passed as well. Only records of
+`/run-spot-query` requests that succeeded (status 200) are replayed, using
+the query as it was received.
+
+`run` sends the corpus to a target instance with `--concurrency` parallel
+clients, optionally paced to `--rate` requests per second overall, and writes
+one JSON line per query to `--output`: the query hash, HTTP status, latency,
+the `timing` checkpoints, the number of features and a digest of the result
+(set names and OSM ids of the features, independent of their order).
+
+`diff` compares two such runs (e.g. the same corpus against two builds): the
+latency percentiles of both, the queries whose latency changed most, and
+every query whose status or result digest differs. It exits with status 1
+when results differ.
+
+Usage:
+    python benchmarks/replay.py run query-log.jsonl [query-log.jsonl.1 ...] --target http://localhost:5000
+        --output run-a.jsonl [--concurrency 8] [--rate 20] [--limit 1000] [--token JWT]
+    python benchmarks/replay.py diff run-a.jsonl run-b.jsonl [--top 10]
+"""
+import argparse
+import hashlib
+import json
+import math
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def load_corpus(paths, limit=None):
+    corpus = []
+    for path in paths:
+        with open(path) as file:
+            for line in file:
+                record = json.loads(line)
+                if record.get("status") == 200 and "query" in record:
+                    corpus.append(record)
+    corpus.sort(key=lambda record: record.get("ts", 0))
+    return corpus[:limit] if limit else corpus
+
+
+def result_digest(payload):
+    features = payload.get("results", {}).get("features", [])
+    keys = sorted(
+        json.dumps([feature["properties"].get("set_name"), feature["properties"].get("osm_ids")]) for feature in features
+    )
+    return hashlib.sha256("\n".join(keys).encode()).hexdigest()
+
+
+class Pacer:
+    """Hands out send times so that requests start at most `rate` per second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            slot = max(self.next, time.monotonic())
+            self.next = slot + self.interval
+        time.sleep(max(0, slot - time.monotonic()))
+
+
+def replay_one(target, record, token, pacer):
+    pacer.wait()
+    headers = {"Content-Type": "application/json", "Accept-Encoding": "identity"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+
+    request = urllib.request.Request(
+        f"{target}/run-spot-query", data=json.dumps(record["query"]).encode(), headers=headers
+    )
+
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            status, body = response.status, response.read()
+    except urllib.error.HTTPError as e:
+        status, body = e.code, e.read()
+    except OSError as e:
+        return {"queryHash": record.get("queryHash"), "status": None, "error": str(e)}
+    latency = (time.perf_counter() - start) * 1000
+
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        payload = {}
+
+    return {
+        "queryHash": record.get("queryHash"),
+        "status": status,
+        "latency": round(latency, 1),
+        "timing": payload.get("timing"),
+        "features": len(payload.get("results", {}).get("features", [])),
+        "digest": result_digest(payload) if status == 200 else payload.get("errorType"),
+    }
+
+
+def run(args):
+    corpus = load_corpus(args.logs, args.limit)
+    pacer = Pacer(args.rate)
+    target = args.target.rstrip("/")
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda record: replay_one(target, record, args.token, pacer), corpus))
+
+    elapsed = time.perf_counter() - start
+
+    with open(args.output, "w") as file:
+        for index, result in enumerate(results):
+            file.write(json.dumps({"index": index, **result}) + "\n")
+
+    failed = sum(result["status"] != 200 for result in results)
+    print(f"replayed {len(results)} queries in {elapsed:.1f} s ({len(results) / elapsed:.1f} req/s), {failed} not 200")
+    print_latencies(args.output, results)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)] if ordered else float("nan")
+
+
+def print_latencies(name, results):
+    latencies = [result["latency"] for result in results if result.get("latency") is not None]
+    print(
+        f"{name}: p50 {percentile(latencies, 50):.1f} ms, p95 {percentile(latencies, 95):.1f} ms, "
+        f"p99 {percentile(latencies, 99):.1f} ms"
+    )
+
+
+def load_run(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def diff(args):
+    before, after = load_run(args.before), load_run(args.after)
+    print_latencies(args.before, before)
+    print_latencies(args.after, after)
+
+    if len(before) != len(after):
+        print(f"warning: runs have {len(before)} and {len(after)} queries, comparing the first {min(len(before), len(after))}")
+
+    pairs = list(zip(before, after))
+    changes = sorted(
+        (
+            (b["latency"] - a["latency"], a)
+            for a, b in pairs
+            if a.get("latency") is not None and b.get("latency") is not None
+        ),
+        key=lambda change: change[0],
+    )
+
+    print("\nlargest slowdowns:")
+    for delta, record in reversed(changes[-args.top:]):
+        print(f"  #{record['index']} {record['queryHash'] or '-'}: {delta:+.1f} ms")
+    print("largest speedups:")
+    for delta, record in changes[:args.top]:
+        print(f"  #{record['index']} {record['queryHash'] or '-'}: {delta:+.1f} ms")
+
+    mismatches = [
+        (a, b) for a, b in pairs if (a.get("status"), a.get("digest")) != (b.get("status"), b.get("digest"))
+    ]
+    print(f"\nresult differences: {len(mismatches)}")
+    for a, b in mismatches:
+        print(
+            f"  #{a['index']} {a['queryHash'] or '-'}: status {a.get('status')} -> {b.get('status')}, "
+            f"features {a.get('features')} -> {b.get('features')}"
+        )
+
+    return 1 if mismatches else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Replay a query log against a target instance")
+    run_parser.add_argument("logs", nargs="+")
+    run_parser.add_argument("--target", required=True)
+    run_parser.add_argument("--output", required=True)
+    run_parser.add_argument("--concurrency", type=int, default=8)
+    run_parser.add_argument("--rate", type=float, help="Overall requests per second (unlimited by default)")
+    run_parser.add_argument("--limit", type=int)
+    run_parser.add_argument("--token", help="JWT for instances with AUTH_ENABLED")
+
+    diff_parser = commands.add_parser("diff", help="Compare two replay runs")
+    diff_parser.add_argument("before")
+    diff_parser.add_argument("after")
+    diff_parser.add_argument("--top", type=int, default=10)
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args)
+        return 0
+    return diff(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+-- Synthetic OSM fixture with the `TABLE_VIEW` schema used by the service
+-- (`node_id`, `primitive_type`, `geom`, `tags`), covering parts of Berlin.
+--
+-- The data is deterministic (fixed random seed), so timings of different runs
+-- are comparable:
+--   - 60k points: amenities and shops, some named, some with opening hours,
+--   - 30k building footprints (ways) with heights and levels,
+--   - 1.5k parks (ways) and 300 large landuse areas (relations),
+--   - 20k street segments (ways) with highway classes and names.
+
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+SELECT setseed(0.42);
+
+CREATE TABLE germany (
+    node_id BIGINT NOT NULL,
+    primitive_type TEXT NOT NULL,
+    geom GEOMETRY(Geometry, 4326) NOT NULL,
+    tags JSONB NOT NULL
+);
+
+-- Points of interest
+INSERT INTO germany
+SELECT
+    i,
+    'node',
+    ST_SetSRID(ST_MakePoint(13.25 + random() * 0.3, 52.42 + random() * 0.16), 4326),
+    jsonb_strip_nulls(jsonb_build_object(
+        CASE WHEN i % 3 = 0 THEN 'shop' ELSE 'amenity' END,
+        CASE WHEN i % 3 = 0
+            THEN (ARRAY['supermarket', 'bakery', 'kiosk', 'clothes', 'books'])[1 + i % 5]
+            ELSE (ARRAY['bench', 'cafe', 'restaurant', 'school', 'pharmacy', 'bank', 'fuel'])[1 + i % 7]
+        END,
+        'name', CASE WHEN i % 4 <> 0 THEN (ARRAY['Kiezladen', 'Am Park', 'Zur Linde', 'Eck', 'Berliner'])[1 + i % 5] || ' ' || i END,
+        'opening_hours', CASE WHEN i % 5 = 0 THEN 'Mo-Fr 08:00-18:00' END
+    ))
+FROM generate_series(1, 60000) AS i;
+
+-- Buildings
+INSERT INTO germany
+SELECT
+    1000000 + i,
+    'way',
+    ST_Expand(ST_SetSRID(ST_MakePoint(13.25 + random() * 0.3, 52.42 + random() * 0.16), 4326), 0.0001 + random() * 0.0002),
+    jsonb_build_object(
+        'building', (ARRAY['yes', 'residential', 'apartments', 'commercial', 'school'])[1 + i % 5],
+        'height', (3 + (i % 20) * 3)::TEXT,
+        'building:levels', (1 + i % 20)::TEXT
+    )
+FROM generate_series(1, 30000) AS i;
+
+-- Parks
+INSERT INTO germany
+SELECT
+    2000000 + i,
+    'way',
+    ST_Expand(ST_SetSRID(ST_MakePoint(13.25 + random() * 0.3, 52.42 + random() * 0.16), 4326), 0.001 + random() * 0.003),
+    jsonb_build_object('leisure', 'park', 'name', 'Park ' || i)
+FROM generate_series(1, 1500) AS i;
+
+-- Landuse areas
+INSERT INTO germany
+SELECT
+    3000000 + i,
+    'relation',
+    ST_Expand(ST_SetSRID(ST_MakePoint(13.25 + random() * 0.3, 52.42 + random() * 0.16), 4326), 0.005 + random() * 0.01),
+    jsonb_build_object('landuse', (ARRAY['residential', 'industrial', 'forest', 'retail'])[1 + i % 4])
+FROM generate_series(1, 300) AS i;
+
+-- Street segments
+INSERT INTO germany
+SELECT
+    4000000 + i,
+    'way',
+    ST_MakeLine(point, ST_Translate(point, (random() - 0.5) * 0.004, (random() - 0.5) * 0.004)),
+    jsonb_build_object(
+        'highway', (ARRAY['residential', 'primary', 'secondary', 'footway', 'cycleway'])[1 + i % 5],
+        'name', (ARRAY['Hauptstraße', 'Parkweg', 'Lindenallee', 'Bahnhofstraße'])[1 + i % 4]
+    )
+FROM (
+    SELECT i, ST_SetSRID(ST_MakePoint(13.25 + random() * 0.3, 52.42 + random() * 0.16), 4326) AS point
+    FROM generate_series(1, 20000) AS i
+) AS streets;
+
+CREATE INDEX germany_geom_idx ON germany USING GIST (geom);
+CREATE INDEX germany_tags_idx ON germany USING GIN (tags);
+
+ANALYZE germany;
@@ -0,0 +1,186 @@
+"""
+Latency suite: replay a corpus of spot queries through the Flask app.
+
+Every query of the corpus (`queries.json`: nwr and cluster nodes, nested
+filters, distance and contains edges, bbox and polygon areas) is sent to
+`/run-spot-query` through the Flask test client, `--warmup` times without
+recording and then `--runs` times. For every query, the script reports the
+p50/p95/p99 of the wall time (`total`) and of every `Timer` checkpoint
+returned in `timing` (nested stages as `stage:<name>`). The result cache and coalescing are disabled so that
+every run executes the query.
+
+Regression gate: with `--baseline`, the chosen percentile (`--gate`, default
+p95) of `total` and of every checkpoint is compared with a previous
+`--output` file. The script exits with status 1 when one grows by more than
+`--threshold` (relative, default 0.2) and by more than `--min-delta`
+milliseconds (default 5, so that noise on tiny checkpoints is ignored), or
+when a query does not answer with 200.
+
+Database: start the fixture with
+    docker compose -f benchmarks/suite/docker-compose.yml up -d --wait
+Unless set, the `DATABASE_*` variables default to that container and
+`TABLE_VIEW` to `germany`.
+
+Usage:
+    python benchmarks/suite/run_suite.py [--runs 20] [--warmup 2] [--only distance,cluster]
+        [--output results.json] [--baseline baseline.json] [--gate p95] [--threshold 0.2]
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+SUITE_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(SUITE_DIR, "..", "..", "app")
+
+DEFAULT_ENVIRONMENT = {
+    "DATABASE_NAME": "spot_bench",
+    "DATABASE_USER": "postgres",
+    "DATABASE_PASSWORD": "postgres",
+    "DATABASE_HOST": "localhost",
+    "DATABASE_PORT": "55432",
+    "TABLE_VIEW": "germany",
+    "JWT_SECRET": "benchmark",
+    "TIMEOUT": "60000",
+}
+
+PERCENTILES = {"p50": 50, "p95": 95, "p99": 99}
+
+# Checkpoints that are ratios or settings rather than durations
+IGNORED_CHECKPOINTS = {"compression_ratio", "compression_level"}
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def load_app():
+    for name, value in DEFAULT_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    os.environ.update({"RESULT_CACHE_SIZE": "0", "COALESCE": "false", "AUTH_ENABLED": "false"})
+
+    # The app reads its schema relative to the working directory
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+
+    import app
+
+    return app.app
+
+
+def run_query(client, spot_query):
+    start = time.perf_counter()
+    response = client.post("/run-spot-query", json=spot_query)
+    total = (time.perf_counter() - start) * 1000
+
+    payload = response.get_json(silent=True) or {}
+    samples = {"total": total}
+    timing = payload.get("timing") or {}
+    for checkpoint, value in timing.items():
+        if checkpoint not in IGNORED_CHECKPOINTS and isinstance(value, (int, float)):
+            samples[checkpoint] = value
+    for stage, value in (timing.get("stages") or {}).items():
+        samples[f"stage:{stage}"] = value
+
+    return response.status_code, payload, samples
+
+
+def summarize(samples):
+    return {
+        checkpoint: {name: percentile(values, q) for name, q in PERCENTILES.items()}
+        for checkpoint, values in samples.items()
+    }
+
+
+def compare(results, baseline, gate, threshold, min_delta):
+    regressions = []
+    for query, checkpoints in results.items():
+        for checkpoint, stats in checkpoints.items():
+            previous = baseline.get(query, {}).get(checkpoint)
+            if previous is None:
+                continue
+            current, before = stats[gate], previous[gate]
+            if current > before * (1 + threshold) and current - before > min_delta:
+                regressions.append(f"{query} / {checkpoint}: {gate} {before:.1f} ms -> {current:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--queries", default=os.path.join(SUITE_DIR, "queries.json"))
+    parser.add_argument("--only", help="Comma-separated names of the queries to run")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--output", help="Write the percentiles to this JSON file")
+    parser.add_argument("--baseline", help="Percentiles of a previous run to gate against")
+    parser.add_argument("--gate", choices=list(PERCENTILES), default="p95")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--min-delta", type=float, default=5.0)
+    args = parser.parse_args()
+
+    queries_path, output_path, baseline_path = (
+        os.path.abspath(path) if path else None for path in (args.queries, args.output, args.baseline)
+    )
+
+    with open(queries_path) as file:
+        corpus = json.load(file)
+    if args.only:
+        names = set(args.only.split(","))
+        corpus = [item for item in corpus if item["name"] in names]
+
+    client = load_app().test_client()
+    results = {}
+    failures = []
+
+    for item in corpus:
+        name, spot_query = item["name"], item["query"]
+
+        for _ in range(args.warmup):
+            run_query(client, spot_query)
+
+        samples = {}
+        for _ in range(args.runs):
+            status, payload, run_samples = run_query(client, spot_query)
+            if status != 200:
+                failures.append(f"{name}: HTTP {status} {payload.get('errorType', '')} {payload.get('message', '')}")
+                break
+            for checkpoint, value in run_samples.items():
+                samples.setdefault(checkpoint, []).append(value)
+
+        if not samples:
+            continue
+
+        results[name] = summarize(samples)
+        features = len(payload.get("results", {}).get("features", []))
+        print(f"\n{name} ({features} features, {len(samples['total'])} runs)")
+        print(f"  {'checkpoint':<36} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for checkpoint, stats in results[name].items():
+            print(f"  {checkpoint:<36} " + " ".join(f"{stats[p]:>9.1f}" for p in PERCENTILES))
+
+    if output_path:
+        with open(output_path, "w") as file:
+            json.dump(results, file, indent=2)
+            file.write("\n")
+
+    regressions = []
+    if baseline_path:
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.gate, args.threshold, args.min_delta)
+        print(f"\nregression gate ({args.gate}, +{args.threshold:.0%} and +{args.min_delta:g} ms): "
+              + ("ok" if not regressions else f"{len(regressions)} regressions"))
+        for regression in regressions:
+            print(f"  {regression}")
+
+    for failure in failures:
+        print(f"FAILED {failure}")
+
+    sys.exit(1 if failures or regressions else 0)
+
+
+if __name__ == "__main__":
+    main()